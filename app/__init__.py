@@ -1,8 +1,11 @@
 from flask import Flask, jsonify, request
 from flask_cors import CORS
-from app.extension import db, jwt, mail
+from sqlalchemy import inspect
+from app.extension import db, migrate, jwt, mail, audio_store
 from .routes import bp
+from app.blueprints.write_behind import chat_writer
 from .auth import auth_bp
+from .commands import register_commands
 from app.models import UserModel, Conversation, ChatMessage
 from .config import Config
 from datetime import datetime
@@ -13,8 +16,11 @@ def create_app(config_class=Config):
     
     # Initialize extensions
     db.init_app(app)
+    migrate.init_app(app, db, directory=app.config['MIGRATIONS_DIR'])
     jwt.init_app(app)
     mail.init_app(app)
+    audio_store.init_app(app)
+    chat_writer.init_app(app)
     
     # Configure CORS - Parse origins from environment variable
     cors_origins = app.config['CORS_ORIGINS']
@@ -35,10 +41,11 @@ def create_app(config_class=Config):
                 "ngrok-skip-browser-warning",
                 "X-Requested-With",
                 "Accept",
-                "Origin"
+                "Origin",
+                "Range"
             ],
             "supports_credentials": True,
-            "expose_headers": ["Content-Type", "Authorization"],
+            "expose_headers": ["Content-Type", "Authorization", "Content-Range", "Accept-Ranges", "ETag", "Retry-After"],
             "send_wildcard": False,  # 重要：禁用通配符，确保credentials工作
             "vary_header": True      # 重要：添加Vary头，帮助浏览器正确处理CORS
         }
@@ -54,7 +61,7 @@ def create_app(config_class=Config):
             # 只对配置的origins返回CORS头
             if origin in cors_origins:
                 response.headers.add("Access-Control-Allow-Origin", origin)
-                response.headers.add('Access-Control-Allow-Headers', "Content-Type,Authorization,ngrok-skip-browser-warning,X-Requested-With,Accept,Origin")
+                response.headers.add('Access-Control-Allow-Headers', "Content-Type,Authorization,ngrok-skip-browser-warning,X-Requested-With,Accept,Origin,Range")
                 response.headers.add('Access-Control-Allow-Methods', "GET,PUT,POST,DELETE,OPTIONS")
                 response.headers.add('Access-Control-Allow-Credentials', 'true')  # 明确设置credentials
                 response.headers.add('Vary', 'Origin')  # 帮助浏览器缓存处理
@@ -113,12 +120,18 @@ def create_app(config_class=Config):
     # Register blueprints
     app.register_blueprint(bp, url_prefix='/api')
     app.register_blueprint(auth_bp, url_prefix='/api/auth')
+    register_commands(app)
     
     # Initialize database and create test user
     with app.app_context():
         try:
-            # Create database tables
-            db.create_all()
+            if app.config['DB_AUTO_CREATE']:
+                # 仅用于本地快速启动；正式环境用 flask --app run db upgrade 建表和加索引
+                db.create_all()
+            elif not inspect(db.engine).has_table('users'):
+                # 还没迁移时也要能启动，否则 flask db upgrade 本身都跑不起来
+                print("⚠️ Database schema missing - run `flask --app run db upgrade`")
+                return app
             
             # Check if test user exists
             test_user = UserModel.query.filter_by(email='test@example.com').first()
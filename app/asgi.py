@@ -0,0 +1,301 @@
+# ASGI entry: async handlers for the LLM-bound endpoints, everything else bridged to Flask
+
+import asyncio
+import json
+from flask_jwt_extended import decode_token, get_unverified_jwt_headers
+from flask_jwt_extended.exceptions import RevokedTokenError, UserLookupError
+from flask_jwt_extended.internal_utils import (
+    custom_verification_for_token, has_user_lookup, user_lookup, verify_token_not_blocklisted, verify_token_type
+)
+from jwt import ExpiredSignatureError
+from uvicorn.middleware.wsgi import WSGIMiddleware
+from app import create_app
+from app import routes
+from app.blueprints.async_ai import AsyncProviderRouter
+from app.blueprints.llm_clients import llm_clients
+from app.blueprints.limits import BulkheadFull, rate_limiter
+from app.blueprints.write_behind import chat_writer
+from app.extension import db
+from .config import Config
+
+class AsyncGateway:
+    """
+    Serve /api/chat and /api/regenerate-text on the event loop so a worker can
+    hold many in-flight upstream calls; other requests go to the Flask app.
+    """
+    def __init__(self, flask_app):
+        self.flask_app = flask_app
+        self.wsgi = WSGIMiddleware(flask_app, workers=Config.ASGI_WSGI_THREADS)
+        self.ai = AsyncProviderRouter(routes.ai_service)
+        self.handlers = {
+            ('POST', '/api/chat'): self.chat,
+            ('POST', '/api/regenerate-text'): self.regenerate_text,
+        }
+        cors_origins = flask_app.config['CORS_ORIGINS']
+        if isinstance(cors_origins, str):
+            cors_origins = [origin.strip() for origin in cors_origins.split(',')]
+        self.cors_origins = cors_origins
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            return await self.lifespan(receive, send)
+        handler = self.handlers.get((scope.get('method'), scope.get('path'))) if scope['type'] == 'http' else None
+        if handler is None:
+            return await self.wsgi(scope, receive, send)
+
+        body = await self._read_body(receive)
+        try:
+            await handler(scope, body, send, receive)
+        except _Delegate:
+            # 异步路径不支持的功能（如语音回复）交回 Flask 处理
+            await self.wsgi(scope, self._replay(body, receive), send)
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await llm_clients.aclose()
+                await asyncio.to_thread(chat_writer.shutdown)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    @staticmethod
+    async def _read_body(receive):
+        chunks = []
+        while True:
+            message = await receive()
+            chunks.append(message.get('body', b''))
+            if not message.get('more_body', False):
+                return b''.join(chunks)
+
+    @staticmethod
+    def _replay(body, receive):
+        sent = False
+
+        async def replay():
+            nonlocal sent
+            if not sent:
+                sent = True
+                return {'type': 'http.request', 'body': body, 'more_body': False}
+            return await receive()
+        return replay
+
+    def _in_app(self, func, *args):
+        """
+        Run blocking Flask/SQLAlchemy code inside an app context (call via to_thread)
+        """
+        with self.flask_app.app_context():
+            try:
+                return func(*args)
+            finally:
+                db.session.remove()
+
+    def _headers(self, scope, content_type):
+        headers = [(b'content-type', content_type.encode())]
+        request_headers = dict(scope.get('headers') or [])
+        origin = request_headers.get(b'origin', b'').decode()
+        if origin in self.cors_origins:
+            headers += [
+                (b'access-control-allow-origin', origin.encode()),
+                (b'access-control-allow-credentials', b'true'),
+                (b'vary', b'Origin'),
+            ]
+        return headers
+
+    async def _json(self, scope, send, payload, status=200, retry_after=None):
+        headers = self._headers(scope, 'application/json')
+        if retry_after is not None:
+            headers += [(b'retry-after', str(retry_after).encode()), (b'access-control-expose-headers', b'Retry-After')]
+        await send({'type': 'http.response.start', 'status': status, 'headers': headers})
+        await send({'type': 'http.response.body', 'body': json.dumps(payload, ensure_ascii=False).encode('utf-8')})
+
+    async def _rate_limited(self, scope, send, rate_scope, user_id):
+        """
+        Apply the per-user token bucket; sends a 429 and returns True when exhausted
+        """
+        allowed, retry_after = await asyncio.to_thread(rate_limiter.check, rate_scope, user_id)
+        if allowed:
+            return False
+        await self._json(scope, send, {'error': 'Too many requests, please slow down', 'retry_after': retry_after}, 429, retry_after)
+        return True
+
+    async def _overloaded(self, scope, send, error):
+        await self._json(scope, send, {'error': str(error), 'retry_after': error.retry_after}, 503, error.retry_after)
+
+    def _authenticate(self, scope):
+        """
+        Return the JWT identity, or an error payload matching the Flask JWT handlers.
+        Applies the same checks as jwt_required(): access tokens only, blocklist,
+        custom claims verification and the user lookup. Call via to_thread.
+        """
+        request_headers = dict(scope.get('headers') or [])
+        auth_header = request_headers.get(b'authorization', b'').decode()
+        if not auth_header.startswith('Bearer '):
+            return None, {'status': 401, 'sub_status': 42, 'msg': 'Missing authorization header'}
+        token = auth_header.split(' ', 1)[1]
+        try:
+            with self.flask_app.app_context():
+                try:
+                    decoded = decode_token(token)
+                    jwt_header = get_unverified_jwt_headers(token)
+                    # refresh token 只能用于 jwt_required(refresh=True) 的接口
+                    verify_token_type(decoded, refresh=False)
+                    verify_token_not_blocklisted(jwt_header, decoded)
+                    custom_verification_for_token(jwt_header, decoded)
+                    if has_user_lookup() and user_lookup(jwt_header, decoded) is None:
+                        raise UserLookupError(jwt_header, decoded)
+                    return decoded['sub'], None
+                finally:
+                    db.session.remove()
+        except ExpiredSignatureError:
+            return None, {'status': 401, 'sub_status': 42, 'msg': 'The token has expired'}
+        except RevokedTokenError:
+            return None, {'msg': 'Token has been revoked'}
+        except UserLookupError:
+            return None, {'msg': f"Error loading the user {decoded['sub']}"}
+        except Exception:
+            return None, {'status': 401, 'sub_status': 42, 'msg': 'Invalid token'}
+
+    async def regenerate_text(self, scope, body, send, receive):
+        user_id, auth_error = await asyncio.to_thread(self._authenticate, scope)
+        if auth_error:
+            return await self._json(scope, send, auth_error, 401)
+        if await self._rate_limited(scope, send, 'regenerate', user_id):
+            return
+        try:
+            data = json.loads(body or b'{}')
+        except ValueError:
+            return await self._json(scope, send, {'error': 'Invalid JSON body'}, 400)
+        if not isinstance(data, dict):
+            return await self._json(scope, send, {'error': 'Invalid JSON body'}, 400)
+        if 'text' not in data:
+            return await self._json(scope, send, {'error': 'No text provided'}, 400)
+        try:
+            current_content = data.get('currentContent', '')
+            new_content = data['text']
+
+            tier, reason = routes._regenerate_tier(current_content, new_content, data.get('tier'))
+            key = routes._regenerate_cache_key(current_content, new_content, tier)
+            if not data.get('force', False):
+                cached, cache_tier = await asyncio.to_thread(routes.regenerate_cache.get, key)
+                if cached is not None:
+                    return await self._json(scope, send, {
+                        'regenerated_text': cached, 'cached': True, 'cache_tier': cache_tier, 'model_tier': tier
+                    })
+
+            regenerated_text, shared = await routes.regenerate_flight.do_async(
+                key, lambda: self.ai.regenerate_text(current_content, new_content, tier, reason)
+            )
+            if not shared:
+                await asyncio.to_thread(routes.regenerate_cache.set, key, regenerated_text)
+            await self._json(scope, send, {
+                'regenerated_text': regenerated_text, 'cached': False, 'cache_tier': None, 'model_tier': tier
+            })
+        except BulkheadFull as e:
+            await self._overloaded(scope, send, e)
+        except Exception as e:
+            await self._json(scope, send, {'error': str(e)}, 500)
+
+    async def chat(self, scope, body, send, receive):
+        user_id, auth_error = await asyncio.to_thread(self._authenticate, scope)
+        if auth_error:
+            return await self._json(scope, send, auth_error, 401)
+        try:
+            data = json.loads(body or b'{}')
+        except ValueError:
+            return await self._json(scope, send, {'error': 'Invalid JSON body'}, 400)
+        if not isinstance(data, dict):
+            return await self._json(scope, send, {'error': 'Invalid JSON body'}, 400)
+        if data.get('voice_response', False):
+            raise _Delegate()
+        if await self._rate_limited(scope, send, 'chat', user_id):
+            return
+
+        messages, save_turn, error = await asyncio.to_thread(self._in_app, routes._prepare_chat, data, user_id)
+        if error:
+            return await self._json(scope, send, error[0], error[1])
+
+        tier, reason = routes._chat_tier(data, messages)
+        if data.get('stream', False):
+            return await self._stream_chat(scope, send, receive, messages, save_turn, tier, reason)
+        try:
+            response, shared = await routes.chat_flight.do_async(
+                routes._chat_flight_key(user_id, data, messages, tier), lambda: self.ai.chat(messages, tier, reason)
+            )
+            if shared:
+                response['coalesced'] = True
+            if save_turn:
+                if not shared:
+                    await asyncio.to_thread(self._in_app, save_turn, response['choices'][0]['message'])
+                response['conversation_id'] = data.get('conversation_id')
+            await self._json(scope, send, response)
+        except BulkheadFull as e:
+            await self._overloaded(scope, send, e)
+        except Exception as e:
+            await self._json(scope, send, {'error': str(e)}, 500)
+
+    async def _stream_chat(self, scope, send, receive, messages, save_turn, tier, reason):
+        # 先取第一个事件再发送响应头，容量不足或上游失败时仍能返回普通 HTTP 错误
+        upstream = self.ai.chat_stream(messages, tier, reason)
+        try:
+            first_event = await upstream.__anext__()
+        except BulkheadFull as e:
+            await upstream.aclose()
+            return await self._overloaded(scope, send, e)
+        except Exception as e:
+            await upstream.aclose()
+            return await self._json(scope, send, {'error': str(e)}, 500)
+
+        headers = self._headers(scope, 'text/event-stream')
+        headers += [(b'cache-control', b'no-cache'), (b'x-accel-buffering', b'no')]
+        await send({'type': 'http.response.start', 'status': 200, 'headers': headers})
+
+        async def emit(event, payload):
+            await send({'type': 'http.response.body', 'body': routes._sse(event, payload).encode('utf-8'), 'more_body': True})
+
+        async def events():
+            yield first_event
+            async for event in upstream:
+                yield event
+
+        async def pump():
+            try:
+                async for event in events():
+                    if event['type'] == 'delta':
+                        await emit('delta', {'content': event['content']})
+                        continue
+                    if save_turn:
+                        await asyncio.to_thread(self._in_app, save_turn, {'role': event['role'], 'content': event['content']})
+                    await emit('done', {
+                        'message': {'role': event['role'], 'content': event['content']},
+                        'finish_reason': event['finish_reason'],
+                        'usage': event['usage'],
+                        'model_tier': event.get('tier')
+                    })
+            except Exception as e:
+                print(f"Chat stream error: {str(e)}")
+                await emit('error', {'error': str(e)})
+            finally:
+                await upstream.aclose()
+
+        async def wait_disconnect():
+            while (await receive())['type'] != 'http.disconnect':
+                pass
+
+        # 客户端断开时取消 pump，上游流随之关闭
+        pump_task = asyncio.ensure_future(pump())
+        disconnect_task = asyncio.ensure_future(wait_disconnect())
+        done, _ = await asyncio.wait([pump_task, disconnect_task], return_when=asyncio.FIRST_COMPLETED)
+        if disconnect_task in done:
+            pump_task.cancel()
+            return
+        disconnect_task.cancel()
+        await send({'type': 'http.response.body', 'body': b'', 'more_body': False})
+
+class _Delegate(Exception):
+    pass
+
+def create_asgi_app(flask_app=None):
+    return AsyncGateway(flask_app or create_app())
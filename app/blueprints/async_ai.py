@@ -0,0 +1,348 @@
+import asyncio
+import copy
+import json
+import time
+import httpx
+from app.blueprints.openai import AIService as OpenRouterAIService
+from app.blueprints.chat import AIService as GLMAIService
+from .prompts import (
+    ensure_system_prompt, REGENERATION_SYSTEM_PROMPT, build_regeneration_prompt,
+    SUMMARY_SYSTEM_PROMPT, build_summary_prompt
+)
+from .llm_clients import llm_clients
+from .limits import bulkheads
+from .model_tiers import DEFAULT_TIER, tier_stats
+from ..config import Config
+
+class AsyncOpenRouterService:
+    """
+    asyncio counterpart of the OpenRouter AIService for the ASGI serving path
+    """
+    REGENERATE_MODEL = OpenRouterAIService.REGENERATE_MODEL
+    REGENERATE_PROMPT_VERSION = OpenRouterAIService.REGENERATE_PROMPT_VERSION
+
+    async def regenerate_text(self, current_content, new_content, model=None):
+        try:
+            completion = await llm_clients.async_openrouter().chat.completions.create(
+                model=model or self.REGENERATE_MODEL,
+                messages=[
+                    {'role': 'system', 'content': REGENERATION_SYSTEM_PROMPT},
+                    {'role': 'user', 'content': build_regeneration_prompt(current_content, new_content)}
+                ]
+            )
+            return completion.choices[0].message.content.strip()
+        except Exception as e:
+            print(f"Regeneration error: {str(e)}")
+            raise Exception(f"Failed to regenerate text: {str(e)}")
+
+    async def chat(self, messages, model=None):
+        ensure_system_prompt(messages)
+        try:
+            completion = await llm_clients.async_openrouter().chat.completions.create(
+                model=model or "openai/gpt-4o",
+                messages=messages
+            )
+        except Exception as e:
+            print(f"Chat error: {str(e)}")
+            raise Exception(f"Failed to process chat: {str(e)}")
+        return {
+            'choices': [
+                {
+                    'message': {
+                        'role': completion.choices[0].message.role,
+                        'content': completion.choices[0].message.content
+                    }
+                }
+            ]
+        }
+
+    async def summarize(self, previous_summary, messages, model=None):
+        try:
+            completion = await llm_clients.async_openrouter().chat.completions.create(
+                model=model or "openai/gpt-4o",
+                messages=[
+                    {'role': 'system', 'content': SUMMARY_SYSTEM_PROMPT},
+                    {'role': 'user', 'content': build_summary_prompt(previous_summary, messages)}
+                ]
+            )
+            return completion.choices[0].message.content.strip()
+        except Exception as e:
+            print(f"Summary error: {str(e)}")
+            raise Exception(f"Failed to summarize conversation: {str(e)}")
+
+    async def chat_stream(self, messages, model=None):
+        ensure_system_prompt(messages)
+        stream = await llm_clients.async_openrouter().chat.completions.create(
+            model=model or "openai/gpt-4o",
+            messages=messages,
+            stream=True,
+            stream_options={'include_usage': True}
+        )
+        content = []
+        finish_reason = None
+        usage = None
+        try:
+            async for chunk in stream:
+                if chunk.usage:
+                    usage = chunk.usage.model_dump()
+                if not chunk.choices:
+                    continue
+                choice = chunk.choices[0]
+                if choice.delta and choice.delta.content:
+                    content.append(choice.delta.content)
+                    yield {'type': 'delta', 'content': choice.delta.content}
+                if choice.finish_reason:
+                    finish_reason = choice.finish_reason
+        finally:
+            await stream.close()
+        yield {
+            'type': 'done',
+            'role': 'assistant',
+            'content': ''.join(content),
+            'finish_reason': finish_reason,
+            'usage': usage
+        }
+
+class AsyncGLMService:
+    """
+    asyncio counterpart of the GLM AIService for the ASGI serving path
+    """
+    REGENERATE_MODEL = GLMAIService.REGENERATE_MODEL
+    REGENERATE_PROMPT_VERSION = GLMAIService.REGENERATE_PROMPT_VERSION
+
+    @staticmethod
+    async def _complete(payload):
+        try:
+            response = await llm_clients.async_glm().post('/chat/completions', json=payload)
+        except httpx.TimeoutException:
+            raise Exception("Request timeout - please try again")
+        except httpx.HTTPError as e:
+            raise Exception(f"Network error: {str(e)}")
+        response_data = response.json()
+        if response.status_code >= 400:
+            raise Exception(f"API Error {response.status_code}: {response_data.get('error', 'Unknown error')}")
+        if 'choices' not in response_data or not response_data['choices']:
+            raise Exception("No response from AI model")
+        return response_data
+
+    async def regenerate_text(self, current_content, new_content, model=None):
+        try:
+            response_data = await self._complete({
+                'model': model or self.REGENERATE_MODEL,
+                'messages': [
+                    {'role': 'system', 'content': REGENERATION_SYSTEM_PROMPT},
+                    {'role': 'user', 'content': build_regeneration_prompt(current_content, new_content)}
+                ]
+            })
+            return response_data['choices'][0]['message']['content'].strip()
+        except Exception as e:
+            print(f"Regeneration error: {str(e)}")
+            raise Exception(f"Failed to regenerate text: {str(e)}")
+
+    async def chat(self, messages, model=None):
+        ensure_system_prompt(messages)
+        try:
+            return await self._complete({'model': model or 'glm-4-Plus', 'messages': messages})
+        except Exception as e:
+            print(f"Chat error: {str(e)}")
+            raise Exception(f"Failed to process chat: {str(e)}")
+
+    async def summarize(self, previous_summary, messages, model=None):
+        try:
+            response_data = await self._complete({
+                'model': model or 'glm-4-plus',
+                'messages': [
+                    {'role': 'system', 'content': SUMMARY_SYSTEM_PROMPT},
+                    {'role': 'user', 'content': build_summary_prompt(previous_summary, messages)}
+                ]
+            })
+            return response_data['choices'][0]['message']['content'].strip()
+        except Exception as e:
+            print(f"Summary error: {str(e)}")
+            raise Exception(f"Failed to summarize conversation: {str(e)}")
+
+    async def chat_stream(self, messages, model=None):
+        ensure_system_prompt(messages)
+        content = []
+        finish_reason = None
+        usage = None
+        payload = {'model': model or 'glm-4-Plus', 'messages': messages, 'stream': True}
+        async with llm_clients.async_glm().stream('POST', '/chat/completions', json=payload) as response:
+            if response.status_code >= 400:
+                body = await response.aread()
+                raise Exception(f"API Error {response.status_code}: {body.decode('utf-8', 'ignore')}")
+            async for line in response.aiter_lines():
+                if not line.startswith('data:'):
+                    continue
+                data = line[len('data:'):].strip()
+                if data == '[DONE]':
+                    break
+                chunk = json.loads(data)
+                if chunk.get('usage'):
+                    usage = chunk['usage']
+                for choice in chunk.get('choices', []):
+                    delta = choice.get('delta') or {}
+                    if delta.get('content'):
+                        content.append(delta['content'])
+                        yield {'type': 'delta', 'content': delta['content']}
+                    if choice.get('finish_reason'):
+                        finish_reason = choice['finish_reason']
+        yield {
+            'type': 'done',
+            'role': 'assistant',
+            'content': ''.join(content),
+            'finish_reason': finish_reason,
+            'usage': usage
+        }
+
+ASYNC_PROVIDERS = {
+    'openrouter': AsyncOpenRouterService,
+    'glm': AsyncGLMService,
+}
+
+class AsyncProviderRouter:
+    """
+    asyncio routing over the same providers, sharing the sync router's latency stats.
+    Hedged losers are really cancelled here, which also aborts their HTTP request.
+    """
+    def __init__(self, sync_router):
+        self.sync_router = sync_router
+        self.providers = {name: ASYNC_PROVIDERS[name]() for name in sync_router.providers}
+        self.stats = sync_router.stats
+        self.stream_stats = sync_router.stream_stats
+        self.regenerate_prompt_version = sync_router.regenerate_prompt_version
+
+    def _model(self, name, tier):
+        # 模型配置以同步服务为准
+        return self.sync_router.providers[name].model_for(tier)
+
+    async def _call(self, name, method, args, tier):
+        started = time.time()
+        # 不分档的调用（摘要）使用服务自己的默认模型
+        kwargs = {'model': self._model(name, tier)} if tier else {}
+        try:
+            result = await getattr(self.providers[name], method)(*args, **kwargs)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            self.stats[name].record(time.time() - started, False)
+            raise
+        self.stats[name].record(time.time() - started, True)
+        return result
+
+    async def _invoke(self, method, make_args, tier):
+        ranked = self.sync_router.ranked()
+        if not self.sync_router.hedge or len(ranked) < 2:
+            last_error = None
+            for name in ranked:
+                try:
+                    return name, await self._call(name, method, make_args(), tier)
+                except Exception as e:
+                    print(f"Provider {name} failed for {method}: {str(e)}")
+                    last_error = e
+            raise last_error
+
+        primary, secondary = ranked[0], ranked[1]
+        first = asyncio.ensure_future(self._call(primary, method, make_args(), tier))
+        try:
+            done, _ = await asyncio.wait([first], timeout=self.sync_router._hedge_delay(primary))
+        except asyncio.CancelledError:
+            first.cancel()
+            raise
+        if done and first.exception() is None:
+            return primary, first.result()
+        if done:
+            print(f"Provider {primary} failed for {method}: {str(first.exception())}")
+        else:
+            print(f"Hedging {method}: {primary} slower than its p{Config.LLM_HEDGE_PERCENTILE}, also asking {secondary}")
+
+        tasks = {asyncio.ensure_future(self._call(secondary, method, make_args(), tier)): secondary}
+        if not done:
+            tasks[first] = primary
+        last_error = first.exception() if done else None
+        pending = set(tasks)
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        return tasks[task], task.result()
+                    last_error = task.exception()
+                    print(f"Provider {tasks[task]} failed for {method}: {str(last_error)}")
+            raise last_error
+        finally:
+            for task in pending:
+                task.cancel()
+
+    @staticmethod
+    async def _tiered(endpoint, tier, reason, call, output_chars):
+        started = time.time()
+        try:
+            result = await call()
+        except Exception:
+            tier_stats.record(endpoint, tier, reason, time.time() - started, False)
+            raise
+        tier_stats.record(endpoint, tier, reason, time.time() - started, True, output_chars(result))
+        return result
+
+    async def chat(self, messages, tier=DEFAULT_TIER, reason='default'):
+        async with bulkheads['llm'].async_slot():
+            name, response = await self._tiered(
+                'chat', tier, reason,
+                lambda: self._invoke('chat', lambda: [copy.deepcopy(messages)], tier),
+                lambda result: len(result[1]['choices'][0]['message']['content'] or '')
+            )
+        response['provider'] = name
+        response['tier'] = tier
+        return response
+
+    async def regenerate_text(self, current_content, new_content, tier=DEFAULT_TIER, reason='default'):
+        async with bulkheads['llm'].async_slot():
+            name, result = await self._tiered(
+                'regenerate', tier, reason,
+                lambda: self._invoke('regenerate_text', lambda: [current_content, new_content], tier),
+                lambda result: len(result[1])
+            )
+        return result
+
+    async def chat_stream(self, messages, tier=DEFAULT_TIER, reason='default'):
+        async with bulkheads['llm'].async_slot():
+            started = time.time()
+            try:
+                async for event in self._chat_stream(messages, tier):
+                    if event['type'] == 'done':
+                        event['tier'] = tier
+                        tier_stats.record('chat', tier, reason, time.time() - started, True, len(event['content']))
+                    yield event
+            except (asyncio.CancelledError, GeneratorExit):
+                raise
+            except Exception:
+                tier_stats.record('chat', tier, reason, time.time() - started, False)
+                raise
+
+    async def _chat_stream(self, messages, tier):
+        last_error = None
+        for name in self.sync_router.ranked(stream=True):
+            started = time.time()
+            first_token = None
+            upstream = self.providers[name].chat_stream(copy.deepcopy(messages), model=self._model(name, tier))
+            try:
+                async for event in upstream:
+                    if first_token is None:
+                        first_token = time.time() - started
+                    if event['type'] == 'done':
+                        event['provider'] = name
+                    yield event
+                self.stream_stats[name].record(time.time() - started if first_token is None else first_token, True)
+                return
+            except (asyncio.CancelledError, GeneratorExit):
+                raise
+            except Exception as e:
+                self.stream_stats[name].record(time.time() - started, False)
+                print(f"Provider {name} stream failed: {str(e)}")
+                if first_token is not None:
+                    raise
+                last_error = e
+            finally:
+                await upstream.aclose()
+        raise last_error
@@ -0,0 +1,147 @@
+import os
+import re
+import secrets
+import threading
+import time
+
+class AudioStore:
+    """
+    Managed directory for generated audio, addressed by opaque ids instead of paths
+    """
+    ID_PATTERN = re.compile(r'^[A-Za-z0-9_-]{16,64}$')
+    PARTIAL_SUFFIX = '.part'
+    MIMETYPES = {
+        '.mp3': 'audio/mpeg',
+        '.webm': 'audio/webm',
+        '.ogg': 'audio/ogg',
+    }
+
+    def __init__(self):
+        self.directory = None
+        self.ttl_seconds = 3600
+        self.max_bytes = 512 * 1024 * 1024
+        self.janitor_interval = 300
+        self._janitor = None
+        self._janitor_pid = None
+        self._stop_event = threading.Event()
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        self.directory = app.config['AUDIO_STORE_DIR']
+        self.ttl_seconds = app.config['AUDIO_TTL_SECONDS']
+        self.max_bytes = app.config['AUDIO_MAX_BYTES']
+        self.janitor_interval = app.config['AUDIO_JANITOR_INTERVAL']
+        os.makedirs(self.directory, exist_ok=True)
+        self.start_janitor()
+
+    def allocate(self, extension='.mp3'):
+        """
+        Reserve a new audio id; returns (audio_id, partial_path, final_path)
+        """
+        if extension not in self.MIMETYPES:
+            raise ValueError(f"Unsupported audio extension: {extension}")
+        self.start_janitor()
+        audio_id = secrets.token_urlsafe(18)
+        final_path = os.path.join(self.directory, audio_id + extension)
+        return audio_id, final_path + self.PARTIAL_SUFFIX, final_path
+
+    def publish(self, partial_path, final_path):
+        """
+        Atomically expose a fully written file under its final name
+        """
+        os.replace(partial_path, final_path)
+
+    def discard(self, path):
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+
+    def resolve(self, audio_id):
+        """
+        Map an opaque id to a live file path, or None if unknown/expired
+        """
+        if not audio_id or not self.ID_PATTERN.match(audio_id):
+            return None
+        for extension in self.MIMETYPES:
+            path = os.path.join(self.directory, audio_id + extension)
+            try:
+                mtime = os.stat(path).st_mtime
+            except FileNotFoundError:
+                continue
+            if time.time() - mtime > self.ttl_seconds:
+                return None
+            return path
+        return None
+
+    def touch(self, path):
+        """
+        Refresh a file's age so a reused artifact is not expired under its reader
+        """
+        try:
+            os.utime(path, None)
+        except FileNotFoundError:
+            pass
+
+    def mimetype_for(self, path):
+        return self.MIMETYPES.get(os.path.splitext(path)[1], 'application/octet-stream')
+
+    def start_janitor(self):
+        """
+        Start the cleanup thread once per process (threads do not survive fork)
+        """
+        with self._lock:
+            if self._janitor is not None and self._janitor.is_alive() and self._janitor_pid == os.getpid():
+                return
+            if self.directory is None:
+                return
+            self._stop_event = threading.Event()
+            self._janitor = threading.Thread(target=self._run_janitor, name='audio-janitor', daemon=True)
+            self._janitor_pid = os.getpid()
+            self._janitor.start()
+
+    def stop_janitor(self):
+        self._stop_event.set()
+
+    def _run_janitor(self):
+        while not self._stop_event.is_set():
+            try:
+                self.sweep()
+            except Exception as e:
+                print(f"Audio janitor error: {str(e)}")
+            self._stop_event.wait(self.janitor_interval)
+
+    def sweep(self):
+        """
+        Remove expired files, then evict oldest files until under the disk quota
+        """
+        now = time.time()
+        removed = 0
+        entries = []
+        with os.scandir(self.directory) as it:
+            for entry in it:
+                if not entry.is_file():
+                    continue
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                if now - stat.st_mtime > self.ttl_seconds:
+                    self.discard(entry.path)
+                    removed += 1
+                elif not entry.name.endswith(self.PARTIAL_SUFFIX):
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+
+        total_bytes = sum(size for _, size, _ in entries)
+        if total_bytes > self.max_bytes:
+            entries.sort()
+            for _, size, path in entries:
+                if total_bytes <= self.max_bytes:
+                    break
+                self.discard(path)
+                total_bytes -= size
+                removed += 1
+
+        if removed:
+            print(f"Audio janitor removed {removed} file(s), {total_bytes} bytes in use")
+        return removed
@@ -0,0 +1,175 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from flask import current_app
+from app.extension import db
+from app.models import ChatMessage, ConversationSummary
+from .history import conversation_history
+from .prompts import LIFE_STORY_SYSTEM_PROMPT
+from .tokens import count_tokens, message_tokens, MESSAGE_OVERHEAD
+from ..config import Config
+
+# 摘要更新不在响应路径上，交给后台线程
+summary_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='chat-summary')
+
+class ContextBuilder:
+    """
+    Build token-bounded prompts: system prompt + rolling summary + recent turns
+    """
+    def __init__(self, ai_service, budget=None):
+        self.ai_service = ai_service
+        self.budget = budget or Config.CHAT_CONTEXT_TOKEN_BUDGET
+        self.system_tokens = count_tokens(LIFE_STORY_SYSTEM_PROMPT) + MESSAGE_OVERHEAD
+        self._refreshing = set()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _summary_message(summary):
+        return {
+            'role': 'system',
+            'content': f"Summary of the earlier conversation: {summary.content}"
+        }
+
+    @staticmethod
+    def _memory_message(memories, budget=None):
+        """
+        System message with related excerpts from the user's other diaries, within a token budget
+        """
+        budget = budget if budget is not None else Config.MEMORY_CONTEXT_TOKENS
+        lines, used = [], 0
+        for memory in memories:
+            line = f"- [{memory['date']}] {memory['title']}: {memory['excerpt']}"
+            tokens = count_tokens(line)
+            if used + tokens > budget:
+                break
+            lines.append(line)
+            used += tokens
+        if not lines:
+            return None
+        return {
+            'role': 'system',
+            'content': "Related memories from the user's earlier diaries (do not ask again about what is already known here):\n" + "\n".join(lines)
+        }
+
+    @staticmethod
+    def _fit_recent(messages, budget):
+        """
+        Index of the oldest message such that messages[index:] fits the budget
+        """
+        used = 0
+        start = len(messages)
+        for index in range(len(messages) - 1, -1, -1):
+            tokens = message_tokens(messages[index])
+            if used + tokens > budget:
+                break
+            used += tokens
+            start = index
+        return start
+
+    def history_budget(self, summary_tokens=0, new_tokens=0):
+        return max(self.budget - self.system_tokens - summary_tokens - new_tokens, 0)
+
+    def build(self, conversation_id, history, new_messages, memories=()):
+        """
+        Prompt messages for the next turn; history is oldest-first.
+        memories are related excerpts from other diaries (see MemoryIndex.search).
+        Turns the summary does not cover yet are always kept, even past the budget.
+        """
+        summary = ConversationSummary.query.filter_by(conversation_id=conversation_id).first()
+        summary_tokens = summary.token_count + MESSAGE_OVERHEAD if summary else 0
+        new_tokens = sum(message_tokens(message) for message in new_messages)
+        memory_message = self._memory_message(memories) if memories else None
+        memory_tokens = message_tokens(memory_message) if memory_message else 0
+
+        # 相关回忆占用的 token 计入摘要部分，从历史预算中扣除
+        start = self._fit_recent(history, self.history_budget(summary_tokens + memory_tokens, new_tokens))
+        # 摘要之后的消息（包括还没落库、没有 id 的）被窗口截掉就既不在摘要里也不在提示里
+        after_id = summary.last_message_id if summary else 0
+        unsummarized = next(
+            (index for index, m in enumerate(history) if m.get('id') is None or m['id'] > after_id), len(history)
+        )
+        if start > unsummarized:
+            start = unsummarized
+            # 不等摘要阈值，按本轮的窗口立即折叠，下一轮回到预算之内
+            self.refresh_summary_async(conversation_id, reserve=new_tokens + memory_tokens, force=True)
+        messages = [{'role': 'system', 'content': LIFE_STORY_SYSTEM_PROMPT}]
+        if summary:
+            messages.append(self._summary_message(summary))
+        if memory_message:
+            messages.append(memory_message)
+        messages.extend({'role': m['role'], 'content': m['content']} for m in history[start:])
+        messages.extend({'role': m['role'], 'content': m['content']} for m in new_messages)
+        return messages
+
+    def refresh_summary_async(self, conversation_id, reserve=0, force=False):
+        """
+        Schedule a summary update after a turn has been saved (see refresh_summary)
+        """
+        with self._lock:
+            if conversation_id in self._refreshing:
+                return
+            self._refreshing.add(conversation_id)
+        app = current_app._get_current_object()
+
+        def run():
+            try:
+                with app.app_context():
+                    self.refresh_summary(conversation_id, reserve, force)
+            except Exception as e:
+                print(f"Summary refresh error for conversation {conversation_id}: {str(e)}")
+            finally:
+                with self._lock:
+                    self._refreshing.discard(conversation_id)
+
+        summary_executor.submit(run)
+
+    def refresh_summary(self, conversation_id, reserve=0, force=False):
+        """
+        Fold messages that no longer fit the window into the rolling summary.
+        reserve is the part of the budget the next prompt needs besides history
+        (new turn, memories); force skips the CHAT_SUMMARY_MIN_TOKENS threshold.
+        """
+        summary = ConversationSummary.query.filter_by(conversation_id=conversation_id).first()
+        after_id = summary.last_message_id if summary else 0
+        rows = db.session.query(ChatMessage.id, ChatMessage.role, ChatMessage.content, ChatMessage.token_count) \
+            .filter(ChatMessage.conversation_id == conversation_id, ChatMessage.id > after_id) \
+            .order_by(ChatMessage.id) \
+            .all()
+        pending = [
+            {'id': row.id, 'role': row.role, 'content': row.content, 'token_count': row.token_count}
+            for row in rows
+        ]
+
+        # 与 build 使用相同的窗口规则：超出预算或超出历史条数的部分需要折叠
+        summary_tokens = summary.token_count + MESSAGE_OVERHEAD if summary else 0
+        start = self._fit_recent(pending, self.history_budget(summary_tokens, reserve))
+        start = max(start, len(pending) - Config.CHAT_HISTORY_LIMIT, 0)
+        span = pending[:start]
+        if force:
+            # 缓存里没有 id 的旧条目会一直被当成未摘要，重建缓存让它们带上 id
+            conversation_history.invalidate(conversation_id)
+        if not span:
+            return None
+        # 攒够一定量再摘要，避免每一轮都调用模型
+        if not force and sum(message_tokens(message) for message in span) < Config.CHAT_SUMMARY_MIN_TOKENS:
+            return None
+
+        # 很长的旧会话分块折叠，限制单次摘要请求的大小
+        while span:
+            end = len(span) - self._fit_recent(span[::-1], Config.CHAT_SUMMARY_CHUNK_TOKENS)
+            chunk, span = span[:max(end, 1)], span[max(end, 1):]
+            content = self.ai_service.summarize(summary.content if summary else '', chunk)
+            if summary is None:
+                summary = ConversationSummary(conversation_id=conversation_id)
+                db.session.add(summary)
+            summary.content = content
+            summary.token_count = count_tokens(content)
+            summary.last_message_id = chunk[-1]['id']
+            try:
+                db.session.commit()
+            except Exception as e:
+                db.session.rollback()
+                raise Exception(f"Failed to save summary: {str(e)}")
+        # write-behind 写入的消息在缓存里没有 id，摘要推进后重建，避免它们被当成未摘要
+        conversation_history.invalidate(conversation_id)
+        print(f"Conversation {conversation_id} summary now covers up to message {summary.last_message_id}")
+        return summary
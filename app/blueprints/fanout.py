@@ -0,0 +1,34 @@
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from ..config import Config
+
+# 批量请求共享的线程池；单个请求的并行度由 fan_out 的 limit 控制
+batch_executor = ThreadPoolExecutor(max_workers=Config.REGENERATE_BATCH_WORKERS, thread_name_prefix='batch-fanout')
+
+def fan_out(func, items, limit, executor=None):
+    """
+    Run func(item) for every item with at most `limit` in flight.
+    Yields (index, result, error) in completion order; closing the generator
+    cancels the items that have not started yet.
+    """
+    executor = executor or batch_executor
+    pending = {}
+    queue = iter(enumerate(items))
+
+    def submit_next():
+        for index, item in queue:
+            pending[executor.submit(func, item)] = index
+            return
+
+    try:
+        for _ in range(max(1, limit)):
+            submit_next()
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                index = pending.pop(future)
+                submit_next()
+                error = future.exception()
+                yield index, None if error else future.result(), error
+    finally:
+        for future in pending:
+            future.cancel()
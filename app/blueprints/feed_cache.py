@@ -0,0 +1,92 @@
+import threading
+import time
+from app.extension import redis_client
+from .single_flight import SingleFlight
+from ..config import Config
+
+class FeedCache:
+    """
+    Pre-serialised first pages of the public community feed.
+    Page keys embed a version counter that every write bumps, so invalidation is a
+    single INCR and superseded pages just expire. Rebuilds go through single-flight
+    (COMMUNITY_FEED_SINGLE_FLIGHT, independent of SINGLE_FLIGHT_ENABLED), so a burst
+    of misses after an invalidation runs the query once.
+    """
+    VERSION_KEY = 'feed:community:version'
+
+    def __init__(self, ttl=None):
+        self.ttl = ttl or Config.COMMUNITY_FEED_CACHE_TTL
+        self.flight = SingleFlight('community-feed', enabled=Config.COMMUNITY_FEED_SINGLE_FLIGHT)
+        # 同一版本的页面在进程内再留一份，命中时只需读一次版本号
+        self._local = {}
+        self._lock = threading.Lock()
+
+    def _version(self):
+        try:
+            return int(redis_client.get(self.VERSION_KEY) or 0)
+        except Exception as e:
+            print(f"Feed cache version read error: {str(e)}")
+            return None
+
+    def _key(self, version, limit):
+        return f"feed:community:v{version}:limit:{limit}"
+
+    def _get_local(self, key):
+        with self._lock:
+            entry = self._local.get(key)
+        if entry is not None and entry[0] > time.time():
+            return entry[1]
+        return None
+
+    def _set_local(self, key, body):
+        with self._lock:
+            # 旧版本的页面不会再被读到，直接清掉
+            version_prefix = key.rsplit(':limit:', 1)[0]
+            self._local = {k: v for k, v in self._local.items() if k.startswith(version_prefix + ':')}
+            self._local[key] = (time.time() + self.ttl, body)
+
+    def first_page(self, limit, build):
+        """
+        Return (json_body, outcome) for the first page of `limit` posts;
+        build() serialises the page on a miss. outcome is 'hit', 'miss', 'shared' or 'bypass'.
+        """
+        version = self._version()
+        if version is None:
+            return build(), 'bypass'
+        key = self._key(version, limit)
+
+        body = self._get_local(key)
+        if body is not None:
+            return body, 'hit'
+        try:
+            body = redis_client.get(key)
+        except Exception as e:
+            print(f"Feed cache read error: {str(e)}")
+            return build(), 'bypass'
+        if body is not None:
+            self._set_local(key, body)
+            return body, 'hit'
+
+        body, shared = self.flight.do(key, lambda: self._rebuild(key, build))
+        self._set_local(key, body)
+        return body, 'shared' if shared else 'miss'
+
+    def _rebuild(self, key, build):
+        body = build()
+        try:
+            redis_client.setex(key, self.ttl, body)
+        except Exception as e:
+            print(f"Feed cache write error: {str(e)}")
+        return body
+
+    def invalidate(self):
+        """
+        Call after a committed write that changes the public feed
+        """
+        try:
+            redis_client.incr(self.VERSION_KEY)
+        except Exception as e:
+            # 失效失败时最多读到 TTL 内的旧页面
+            print(f"Feed cache invalidation error: {str(e)}")
+
+feed_cache = FeedCache()
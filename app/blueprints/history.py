@@ -0,0 +1,181 @@
+import json
+from app.extension import db, redis_client
+from app.models import ChatMessage
+from .tokens import count_tokens
+from .write_behind import chat_writer
+from ..config import Config
+
+class ConversationHistory:
+    """
+    Recent chat turns per conversation: Redis hot cache in front of chat_messages
+    """
+    KEY_PREFIX = 'chat:history:'
+
+    def __init__(self, limit=None, ttl=None):
+        self.limit = limit or Config.CHAT_HISTORY_LIMIT
+        self.ttl = ttl or Config.CHAT_HISTORY_TTL
+
+    def _key(self, conversation_id):
+        return f"{self.KEY_PREFIX}{conversation_id}"
+
+    @staticmethod
+    def _encode(message):
+        return json.dumps({
+            'id': message.get('id'),
+            'role': message['role'],
+            'content': message['content'],
+            'token_count': message.get('token_count')
+        }, ensure_ascii=False)
+
+    def _load_cached(self, conversation_id):
+        try:
+            cached = redis_client.lrange(self._key(conversation_id), -self.limit, -1)
+        except Exception as e:
+            print(f"History cache read error: {str(e)}")
+            return None
+        if not cached:
+            return None
+        return [json.loads(item) for item in cached]
+
+    def recent_query(self, conversation_id):
+        """
+        The newest `limit` messages of a conversation, newest first
+        """
+        return db.session.query(ChatMessage.id, ChatMessage.role, ChatMessage.content, ChatMessage.token_count, ChatMessage.created_at) \
+            .filter(ChatMessage.conversation_id == conversation_id) \
+            .order_by(ChatMessage.created_at.desc(), ChatMessage.id.desc()) \
+            .limit(self.limit)
+
+    @staticmethod
+    def _same_row(stored, pending):
+        # MySQL DATETIME 会把微秒舍入到秒
+        return stored.role == pending['role'] and stored.content == pending['content'] \
+            and stored.created_at is not None \
+            and abs((stored.created_at - pending['created_at']).total_seconds()) <= 1
+
+    def _not_stored(self, rows, pending):
+        """
+        Pending rows minus those the query already returned, i.e. ones the
+        write-behind flusher committed while this load was running
+        """
+        unmatched = list(rows)
+        result = []
+        for item in pending:
+            match = next((row for row in unmatched if self._same_row(row, item)), None)
+            if match is None:
+                result.append(item)
+            else:
+                unmatched.remove(match)
+        return result
+
+    def _load_from_db(self, conversation_id):
+        rows = list(reversed(self.recent_query(conversation_id).all()))
+        messages = [
+            {'id': row.id, 'role': row.role, 'content': row.content, 'token_count': row.token_count}
+            for row in rows
+        ]
+        # write-behind 还没写完（或刚刚写完）的消息；已经查到的部分去掉，其余还没有 id
+        pending = chat_writer.pending_for(conversation_id)
+        pending = [
+            {'id': None, 'role': row['role'], 'content': row['content'], 'token_count': row['token_count']}
+            for row in self._not_stored(rows, pending)
+        ]
+        return (messages + pending)[-self.limit:]
+
+    def _warm(self, conversation_id, messages):
+        if not messages:
+            return
+        key = self._key(conversation_id)
+        try:
+            pipe = redis_client.pipeline()
+            pipe.delete(key)
+            pipe.rpush(key, *[self._encode(message) for message in messages])
+            pipe.expire(key, self.ttl)
+            pipe.execute()
+        except Exception as e:
+            print(f"History cache write error: {str(e)}")
+
+    def load(self, conversation_id):
+        """
+        Return the most recent messages in chronological order
+        """
+        messages = self._load_cached(conversation_id)
+        if messages is not None:
+            return messages
+        messages = self._load_from_db(conversation_id)
+        self._warm(conversation_id, messages)
+        return messages
+
+    def _append_cached(self, conversation_id, messages):
+        key = self._key(conversation_id)
+        try:
+            # RPUSHX 只在缓存已存在时追加，缺失时下次读取会从数据库重建
+            pipe = redis_client.pipeline()
+            pipe.rpushx(key, *[self._encode(message) for message in messages])
+            pipe.ltrim(key, -self.limit, -1)
+            pipe.expire(key, self.ttl)
+            pipe.execute()
+        except Exception as e:
+            print(f"History cache write error: {str(e)}")
+
+    def append(self, conversation_id, messages):
+        """
+        Persist new turns to chat_messages and the hot cache.
+        With write-behind enabled the insert is queued and the cache updated right away.
+        """
+        if not messages:
+            return
+        messages = [
+            {
+                'role': message['role'],
+                'content': message['content'],
+                'token_count': count_tokens(message['content'])
+            }
+            for message in messages
+        ]
+        if chat_writer.enabled:
+            # 缓存缺失时先从数据库重建，保证 RPUSHX 能接上尚未落库的新消息
+            try:
+                cached = redis_client.exists(self._key(conversation_id))
+            except Exception:
+                cached = True
+            if not cached:
+                self._warm(conversation_id, self._load_from_db(conversation_id))
+            chat_writer.enqueue(conversation_id, messages)
+            self._append_cached(conversation_id, messages)
+            return
+        try:
+            rows = [
+                ChatMessage(
+                    conversation_id=conversation_id,
+                    role=message['role'],
+                    content=message['content'],
+                    token_count=message['token_count']
+                )
+                for message in messages
+            ]
+            db.session.add_all(rows)
+            # commit 前取 id：摘要按 id 判断哪些消息已经折叠
+            db.session.flush()
+            for message, row in zip(messages, rows):
+                message['id'] = row.id
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            raise Exception(f"Failed to save messages: {str(e)}")
+        self._append_cached(conversation_id, messages)
+
+    def extend(self, conversation_id, messages):
+        """
+        Add messages that were already committed elsewhere to the hot cache
+        """
+        if messages:
+            self._append_cached(conversation_id, messages)
+
+    def invalidate(self, conversation_id):
+        try:
+            redis_client.delete(self._key(conversation_id))
+        except Exception as e:
+            print(f"History cache delete error: {str(e)}")
+
+conversation_history = ConversationHistory()
@@ -0,0 +1,175 @@
+import asyncio
+import math
+import threading
+from contextlib import contextmanager, asynccontextmanager
+from functools import wraps
+from flask import jsonify
+from flask_jwt_extended import get_jwt_identity
+from app.extension import redis_client
+from ..config import Config
+
+class BulkheadFull(Exception):
+    """
+    Raised when an upstream's concurrency limit and wait queue are both exhausted
+    """
+    def __init__(self, name, retry_after):
+        super().__init__(f"{name} is at capacity, please retry shortly")
+        self.name = name
+        self.retry_after = retry_after
+
+class Bulkhead:
+    """
+    Cap in-flight calls to one upstream, with a bounded, time-limited wait queue
+    """
+    def __init__(self, name, max_concurrent, max_queue, queue_timeout, retry_after=1):
+        self.name = name
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.retry_after = retry_after
+        self._semaphore = threading.BoundedSemaphore(max_concurrent)
+        self._lock = threading.Lock()
+        self._waiting = 0
+        # ASGI 路径在事件循环中使用独立的 asyncio 信号量
+        self._async_semaphore = None
+        self._async_waiting = 0
+
+    def _full(self):
+        return BulkheadFull(self.name, self.retry_after)
+
+    def acquire(self):
+        if self._semaphore.acquire(blocking=False):
+            return
+        with self._lock:
+            if self._waiting >= self.max_queue:
+                raise self._full()
+            self._waiting += 1
+        try:
+            acquired = self._semaphore.acquire(timeout=self.queue_timeout)
+        finally:
+            with self._lock:
+                self._waiting -= 1
+        if not acquired:
+            raise self._full()
+
+    def release(self):
+        self._semaphore.release()
+
+    @contextmanager
+    def slot(self):
+        self.acquire()
+        try:
+            yield
+        finally:
+            self.release()
+
+    @asynccontextmanager
+    async def async_slot(self):
+        if self._async_semaphore is None:
+            self._async_semaphore = asyncio.Semaphore(self.max_concurrent)
+        semaphore = self._async_semaphore
+        if semaphore.locked():
+            if self._async_waiting >= self.max_queue:
+                raise self._full()
+            self._async_waiting += 1
+            try:
+                await asyncio.wait_for(semaphore.acquire(), self.queue_timeout)
+            except asyncio.TimeoutError:
+                raise self._full()
+            finally:
+                self._async_waiting -= 1
+        else:
+            await semaphore.acquire()
+        try:
+            yield
+        finally:
+            semaphore.release()
+
+    def snapshot(self):
+        return {
+            'max_concurrent': self.max_concurrent,
+            'max_queue': self.max_queue,
+            'waiting': self._waiting + self._async_waiting
+        }
+
+bulkheads = {name: Bulkhead(name, **settings) for name, settings in Config.BULKHEADS.items()}
+
+# 令牌桶状态保存在 Redis hash 中，脚本保证读-改-写的原子性，时间取 Redis 服务器时钟
+TOKEN_BUCKET_SCRIPT = """
+redis.replicate_commands()
+local rate = tonumber(ARGV[1])
+local capacity = tonumber(ARGV[2])
+local cost = tonumber(ARGV[3])
+local clock = redis.call('TIME')
+local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(state[1]) or capacity
+local ts = tonumber(state[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - ts) * rate)
+local allowed = 0
+local retry_after = 0
+if tokens >= cost then
+    tokens = tokens - cost
+    allowed = 1
+else
+    retry_after = (cost - tokens) / rate
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'ts', tostring(now))
+redis.call('PEXPIRE', KEYS[1], math.ceil(capacity / rate * 1000) + 1000)
+return {allowed, tostring(retry_after)}
+"""
+
+class TokenBucketLimiter:
+    """
+    Per-user token buckets in Redis; fails open when Redis is unavailable
+    """
+    def __init__(self, limits):
+        self.limits = limits
+        self._script = None
+
+    def check(self, scope, user_id, cost=1):
+        """
+        Return (allowed, retry_after_seconds)
+        """
+        limit = self.limits.get(scope)
+        if not Config.RATE_LIMIT_ENABLED or not limit:
+            return True, 0
+        try:
+            if self._script is None:
+                self._script = redis_client.register_script(TOKEN_BUCKET_SCRIPT)
+            allowed, retry_after = self._script(
+                keys=[f"ratelimit:{scope}:{user_id}"],
+                args=[limit['rate'] / limit['per'], limit['burst'], cost]
+            )
+        except Exception as e:
+            print(f"Rate limiter error (allowing request): {str(e)}")
+            return True, 0
+        return bool(int(allowed)), max(1, math.ceil(float(retry_after)))
+
+rate_limiter = TokenBucketLimiter(Config.RATE_LIMITS)
+
+def too_many_requests(retry_after):
+    response = jsonify({'error': 'Too many requests, please slow down', 'retry_after': retry_after})
+    response.status_code = 429
+    response.headers['Retry-After'] = str(retry_after)
+    return response
+
+def overloaded(error):
+    response = jsonify({'error': str(error), 'retry_after': error.retry_after})
+    response.status_code = 503
+    response.headers['Retry-After'] = str(error.retry_after)
+    return response
+
+def rate_limited(scope):
+    """
+    Decorator for JWT-protected views: reject with 429 when the user's bucket is empty
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            allowed, retry_after = rate_limiter.check(scope, get_jwt_identity())
+            if not allowed:
+                return too_many_requests(retry_after)
+            return view(*args, **kwargs)
+        return wrapper
+    return decorator
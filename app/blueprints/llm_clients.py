@@ -0,0 +1,179 @@
+import asyncio
+import os
+import threading
+import importlib.util
+import httpx
+import requests
+from requests.adapters import HTTPAdapter
+from openai import OpenAI, AsyncOpenAI
+from ..config import Config
+
+OPENROUTER_BASE_URL = Config.OPENROUTER_BASE_URL
+GLM_BASE_URL = Config.GLM_BASE_URL
+
+OPENROUTER_HEADERS = {
+    "HTTP-Referer": "https://your-site.com",
+    "X-Title": "Ora AI Assistant",
+}
+
+# HTTP/2 needs the optional h2 package (httpx[http2])
+HTTP2_AVAILABLE = importlib.util.find_spec('h2') is not None
+
+class LLMClientRegistry:
+    """
+    Process-wide keep-alive HTTP clients for the LLM providers
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+        self._clients = {}
+
+    def _ensure_process(self):
+        # 连接池不能跨 fork 共享，子进程中重新创建
+        if self._pid != os.getpid():
+            self._after_fork()
+
+    def _after_fork(self):
+        # 父进程的 socket 仍在使用，只丢弃引用而不关闭
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+        self._clients = {}
+
+    def _get(self, name, factory):
+        self._ensure_process()
+        client = self._clients.get(name)
+        if client is not None:
+            return client
+        with self._lock:
+            client = self._clients.get(name)
+            if client is None:
+                client = factory()
+                self._clients[name] = client
+            return client
+
+    @staticmethod
+    def request_timeout():
+        """
+        (connect, read) timeout tuple for requests-based providers
+        """
+        return (Config.LLM_CONNECT_TIMEOUT, Config.LLM_READ_TIMEOUT)
+
+    @staticmethod
+    def _httpx_timeout():
+        return httpx.Timeout(Config.LLM_READ_TIMEOUT, connect=Config.LLM_CONNECT_TIMEOUT)
+
+    def _build_openrouter(self):
+        http_client = httpx.Client(
+            http2=Config.LLM_HTTP2 and HTTP2_AVAILABLE,
+            limits=httpx.Limits(
+                max_connections=Config.LLM_POOL_SIZE,
+                max_keepalive_connections=Config.LLM_POOL_SIZE,
+                keepalive_expiry=Config.LLM_KEEPALIVE_EXPIRY
+            ),
+            timeout=self._httpx_timeout()
+        )
+        return OpenAI(
+            base_url=OPENROUTER_BASE_URL,
+            api_key=Config.GPT_API_KEY,
+            http_client=http_client,
+            timeout=self._httpx_timeout(),
+            default_headers=OPENROUTER_HEADERS
+        )
+
+    @staticmethod
+    def _async_limits():
+        return httpx.Limits(
+            max_connections=Config.LLM_ASYNC_POOL_SIZE,
+            max_keepalive_connections=Config.LLM_ASYNC_POOL_SIZE,
+            keepalive_expiry=Config.LLM_KEEPALIVE_EXPIRY
+        )
+
+    def _get_async(self, name, factory):
+        # 异步客户端绑定到创建它的事件循环（ASGI worker 的循环、同步路由的对冲循环），每个循环各建一份
+        return self._get((name, asyncio.get_running_loop()), factory)
+
+    def _build_async_openrouter(self):
+        http_client = httpx.AsyncClient(
+            http2=Config.LLM_HTTP2 and HTTP2_AVAILABLE,
+            limits=self._async_limits(),
+            timeout=self._httpx_timeout()
+        )
+        return AsyncOpenAI(
+            base_url=OPENROUTER_BASE_URL,
+            api_key=Config.GPT_API_KEY,
+            http_client=http_client,
+            timeout=self._httpx_timeout(),
+            default_headers=OPENROUTER_HEADERS
+        )
+
+    def _build_async_glm(self):
+        return httpx.AsyncClient(
+            base_url=GLM_BASE_URL,
+            http2=Config.LLM_HTTP2 and HTTP2_AVAILABLE,
+            limits=self._async_limits(),
+            timeout=self._httpx_timeout(),
+            headers={
+                'Content-Type': 'application/json',
+                'Authorization': f'Bearer {Config.CHAT_API_KEY}'
+            }
+        )
+
+    def _build_glm(self):
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=Config.LLM_POOL_SIZE)
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        session.headers.update({
+            'Content-Type': 'application/json',
+            'Authorization': f'Bearer {Config.CHAT_API_KEY}'
+        })
+        return session
+
+    def openrouter(self) -> OpenAI:
+        return self._get('openrouter', self._build_openrouter)
+
+    def glm(self) -> requests.Session:
+        return self._get('glm', self._build_glm)
+
+    def async_openrouter(self) -> AsyncOpenAI:
+        return self._get_async('async_openrouter', self._build_async_openrouter)
+
+    def async_glm(self) -> httpx.AsyncClient:
+        return self._get_async('async_glm', self._build_async_glm)
+
+    def close(self):
+        """
+        Close pooled sync connections (e.g. on shutdown); async clients need aclose()
+        """
+        with self._lock:
+            sync_clients = {name: client for name, client in self._clients.items() if isinstance(name, str)}
+            for name in sync_clients:
+                del self._clients[name]
+        for client in sync_clients.values():
+            try:
+                client.close()
+            except Exception as e:
+                print(f"Error closing LLM client: {str(e)}")
+
+    async def aclose(self):
+        """
+        Close the async clients bound to the running event loop (ASGI shutdown)
+        """
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            async_clients = {key: client for key, client in self._clients.items() if isinstance(key, tuple) and key[1] is loop}
+            for name in async_clients:
+                del self._clients[name]
+        for client in async_clients.values():
+            try:
+                if isinstance(client, AsyncOpenAI):
+                    await client.close()
+                else:
+                    await client.aclose()
+            except Exception as e:
+                print(f"Error closing LLM client: {str(e)}")
+
+llm_clients = LLMClientRegistry()
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=llm_clients._after_fork)
@@ -0,0 +1,387 @@
+import hashlib
+import importlib
+import json
+import math
+import os
+import re
+import threading
+import unicodedata
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from flask import current_app
+from app.extension import db, redis_client
+from app.models import Conversation
+from ..config import Config
+
+TOKEN_PATTERN = re.compile(r'[a-z0-9]+|[\u3400-\u4dbf\u4e00-\u9fff\u3040-\u30ff\uac00-\ud7af]')
+PARAGRAPH_PATTERN = re.compile(r'\n\s*\n|(?<=[。！？!?])')
+
+# 单线程执行，同一用户的索引更新按提交顺序应用
+index_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='memory-index')
+
+# 版本号仍是本地索引所基于的版本时才递增，否则说明另一个 worker 已发布了更新
+BUMP_IF_CURRENT_SCRIPT = """
+local current = redis.call('GET', KEYS[1]) or '0'
+if current ~= ARGV[1] then
+    return -1
+end
+return redis.call('INCR', KEYS[1])
+"""
+PUBLISH_ATTEMPTS = 5
+# 检索最多等这么久；锁被后台重建占用时直接返回空，不阻塞对话
+SEARCH_LOCK_TIMEOUT = 0.05
+
+class HashingEmbedder:
+    """
+    Offline embedder: signed feature hashing of words, CJK characters and token bigrams
+    """
+    def __init__(self, dim=None):
+        self.dim = dim or Config.MEMORY_EMBED_DIM
+
+    def _features(self, text):
+        tokens = TOKEN_PATTERN.findall(unicodedata.normalize('NFKC', text or '').lower())
+        # 相邻 token 组成二元组，中文里大致相当于词
+        return Counter(tokens + [a + ' ' + b for a, b in zip(tokens, tokens[1:])])
+
+    def embed(self, texts):
+        """
+        L2-normalised float32 matrix, one row per text
+        """
+        matrix = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for feature, count in self._features(text).items():
+                digest = int.from_bytes(hashlib.blake2b(feature.encode('utf-8'), digest_size=8).digest(), 'little')
+                sign = 1.0 if digest & 1 else -1.0
+                matrix[row, (digest >> 1) % self.dim] += sign * (1.0 + math.log(count))
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return matrix / norms
+
+def load_embedder(spec):
+    """
+    'hashing' or 'package.module:ClassName' for a class exposing dim and embed(texts)
+    """
+    if not spec or spec == 'hashing':
+        return HashingEmbedder()
+    module_name, _, class_name = spec.partition(':')
+    return getattr(importlib.import_module(module_name), class_name)()
+
+def split_chunks(text, max_chars=None):
+    """
+    Cut a diary into paragraph/sentence-aligned chunks of at most max_chars
+    """
+    max_chars = max_chars or Config.MEMORY_CHUNK_CHARS
+    chunks, current = [], ''
+    for piece in PARAGRAPH_PATTERN.split(text or ''):
+        piece = piece.strip()
+        if not piece:
+            continue
+        if current and len(current) + len(piece) + 1 > max_chars:
+            chunks.append(current)
+            current = ''
+        while len(piece) > max_chars:
+            chunks.append(piece[:max_chars])
+            piece = piece[max_chars:]
+        current = f"{current} {piece}".strip()
+    if current:
+        chunks.append(current)
+    return chunks
+
+class UserIndex:
+    """
+    One user's chunk vectors in a growable numpy matrix, with row metadata
+    """
+    def __init__(self, dim):
+        self.dim = dim
+        self.vectors = np.zeros((64, dim), dtype=np.float32)
+        self.conversation_ids = np.zeros(64, dtype=np.int64)
+        self.entries = []
+        self.size = 0
+        self.version = None
+
+    def add(self, conversation_id, entries, vectors):
+        needed = self.size + len(entries)
+        if needed > len(self.conversation_ids):
+            capacity = max(needed, len(self.conversation_ids) * 2)
+            self.vectors = np.resize(self.vectors, (capacity, self.dim))
+            self.conversation_ids = np.resize(self.conversation_ids, capacity)
+        self.vectors[self.size:needed] = vectors
+        self.conversation_ids[self.size:needed] = conversation_id
+        self.entries.extend(entries)
+        self.size = needed
+
+    def remove(self, conversation_id):
+        keep = self.conversation_ids[:self.size] != conversation_id
+        kept = int(keep.sum())
+        if kept == self.size:
+            return
+        self.vectors[:kept] = self.vectors[:self.size][keep]
+        self.conversation_ids[:kept] = self.conversation_ids[:self.size][keep]
+        self.entries = [entry for entry, flag in zip(self.entries, keep) if flag]
+        self.size = kept
+
+    def search(self, query_vector, k, exclude=None, min_score=0.0):
+        if self.size == 0:
+            return []
+        scores = self.vectors[:self.size] @ query_vector
+        if exclude is not None:
+            scores[self.conversation_ids[:self.size] == exclude] = -1.0
+        # 多取一些候选，同一篇日记只保留得分最高的片段
+        candidates = min(k * 4, self.size)
+        top = np.argpartition(scores, -candidates)[-candidates:]
+        results, seen = [], set()
+        for row in top[np.argsort(-scores[top])]:
+            score = float(scores[row])
+            conversation_id = int(self.conversation_ids[row])
+            if score < min_score or len(results) >= k:
+                break
+            if conversation_id in seen:
+                continue
+            seen.add(conversation_id)
+            results.append({**self.entries[row], 'conversation_id': conversation_id, 'score': round(score, 4)})
+        return results
+
+    def save(self, path):
+        partial = path + '.part'
+        with open(partial, 'wb') as f:
+            np.savez(
+                f,
+                vectors=self.vectors[:self.size],
+                conversation_ids=self.conversation_ids[:self.size],
+                entries=np.array(json.dumps(self.entries, ensure_ascii=False)),
+                version=np.array(self.version or 0)
+            )
+        os.replace(partial, path)
+
+    @classmethod
+    def load(cls, path, dim):
+        with np.load(path) as data:
+            if data['vectors'].shape[1:] != (dim,):
+                return None
+            index = cls(dim)
+            size = len(data['conversation_ids'])
+            index.vectors = np.resize(data['vectors'], (max(size, 64), dim))
+            index.conversation_ids = np.resize(data['conversation_ids'], max(size, 64))
+            index.entries = json.loads(str(data['entries']))
+            index.size = size
+            index.version = int(data['version'])
+        return index
+
+class MemoryIndex:
+    """
+    Per-user "related memories" index over Conversation.content.
+    Each worker keeps indexes in memory; a Redis version counter tells it when
+    another worker changed a user's index, and an on-disk snapshot lets it
+    reload without re-embedding. Missing or stale snapshots are rebuilt from the DB
+    in the background, never on the request path.
+    """
+    def __init__(self):
+        self._embedder = None
+        self._indexes = {}
+        self._lock = threading.Lock()
+        # 每个用户一把锁：一个用户的重建或更新不会挡住其他用户的检索
+        self._user_locks = {}
+        self._refreshing = set()
+        self._bump_script = None
+
+    @property
+    def embedder(self):
+        if self._embedder is None:
+            self._embedder = load_embedder(Config.MEMORY_EMBEDDER)
+        return self._embedder
+
+    def _user_lock(self, user_id):
+        with self._lock:
+            return self._user_locks.setdefault(user_id, threading.RLock())
+
+    @staticmethod
+    def _version_key(user_id):
+        return f"memory:index:version:{user_id}"
+
+    def _snapshot_path(self, user_id):
+        os.makedirs(Config.MEMORY_INDEX_DIR, exist_ok=True)
+        return os.path.join(Config.MEMORY_INDEX_DIR, f"user_{int(user_id)}.npz")
+
+    def _shared_version(self, user_id):
+        try:
+            version = redis_client.get(self._version_key(user_id))
+        except Exception as e:
+            print(f"Memory index version read error: {str(e)}")
+            return None
+        return int(version) if version is not None else 0
+
+    def _embed_conversation(self, title, content, date):
+        chunks = split_chunks(content)
+        entries = [
+            {'title': title, 'date': date, 'excerpt': chunk[:Config.MEMORY_EXCERPT_CHARS]}
+            for chunk in chunks
+        ]
+        vectors = self.embedder.embed([f"{title}\n{chunk}" for chunk in chunks])
+        return entries, vectors
+
+    def _rebuild(self, user_id):
+        index = UserIndex(self.embedder.dim)
+        conversations = db.session.query(Conversation.id, Conversation.title, Conversation.content, Conversation.date) \
+            .filter(Conversation.user_id == user_id) \
+            .all()
+        for conversation in conversations:
+            entries, vectors = self._embed_conversation(conversation.title, conversation.content, conversation.date)
+            index.add(conversation.id, entries, vectors)
+        return index
+
+    def _ensure(self, user_id):
+        """
+        This worker's index for a user, reloaded or rebuilt if another worker changed it.
+        May re-embed every diary of the user: call with the user's lock held, off the request path.
+        """
+        user_id = int(user_id)
+        version = self._shared_version(user_id)
+        index = self._indexes.get(user_id)
+        if index is not None and (version is None or index.version == version):
+            return index
+        path = self._snapshot_path(user_id)
+        index = None
+        if os.path.exists(path):
+            try:
+                index = UserIndex.load(path, self.embedder.dim)
+            except Exception as e:
+                print(f"Memory index snapshot unreadable for user {user_id}: {str(e)}")
+        if index is None or (version is not None and index.version != version):
+            index = self._rebuild(user_id)
+            index.version = version
+            self._save(user_id, index)
+        self._indexes[user_id] = index
+        return index
+
+    def _save(self, user_id, index):
+        try:
+            index.save(self._snapshot_path(user_id))
+        except Exception as e:
+            print(f"Memory index snapshot write error: {str(e)}")
+
+    def _bump(self, user_id, index):
+        """
+        Publish a changed index: compare-and-set the shared version from the one the
+        change was applied to. Returns False if another worker published first.
+        """
+        try:
+            if self._bump_script is None:
+                self._bump_script = redis_client.register_script(BUMP_IF_CURRENT_SCRIPT)
+            version = int(self._bump_script(keys=[self._version_key(user_id)], args=[index.version or 0]))
+        except Exception as e:
+            # 没有 Redis 时只有本进程，直接保存
+            print(f"Memory index version write error: {str(e)}")
+            self._save(user_id, index)
+            return True
+        if version < 0:
+            return False
+        # 每个版本号只有一个写入者，快照里的版本号总是对应它的内容
+        index.version = version
+        self._save(user_id, index)
+        return True
+
+    def _schedule(self, func, *args):
+        # 索引更新不在响应路径上；首次访问可能需要从数据库重建，放到后台线程
+        app = current_app._get_current_object()
+
+        def run():
+            with app.app_context():
+                try:
+                    func(*args)
+                except Exception as e:
+                    print(f"Memory index update failed: {str(e)}")
+                finally:
+                    db.session.remove()
+
+        index_executor.submit(run)
+
+    def _apply(self, user_id, change):
+        """
+        Apply change(index) to a user's index and publish it; when another worker
+        published in between, start again from its version so neither change is lost
+        """
+        with self._user_lock(user_id):
+            for _ in range(PUBLISH_ATTEMPTS):
+                index = self._ensure(user_id)
+                change(index)
+                if self._bump(user_id, index):
+                    return
+                self._indexes.pop(user_id, None)
+            print(f"Memory index for user {user_id} kept changing, will reload on next search")
+
+    def _refresh_async(self, user_id):
+        """
+        Reload or rebuild a user's index in the background (at most one pending per user)
+        """
+        with self._lock:
+            if user_id in self._refreshing:
+                return
+            self._refreshing.add(user_id)
+
+        def refresh():
+            try:
+                with self._user_lock(user_id):
+                    self._ensure(user_id)
+            finally:
+                with self._lock:
+                    self._refreshing.discard(user_id)
+
+        try:
+            self._schedule(refresh)
+        except Exception:
+            with self._lock:
+                self._refreshing.discard(user_id)
+            raise
+
+    def _upsert(self, user_id, conversation_id, title, content, date):
+        entries, vectors = self._embed_conversation(title, content, date)
+
+        def change(index):
+            index.remove(conversation_id)
+            index.add(conversation_id, entries, vectors)
+        self._apply(user_id, change)
+
+    def _remove(self, user_id, conversation_id):
+        self._apply(user_id, lambda index: index.remove(conversation_id))
+
+    def upsert(self, user_id, conversation):
+        """
+        Index (or re-index) one conversation after it was created or edited
+        """
+        if Config.MEMORY_INDEX_ENABLED:
+            self._schedule(self._upsert, int(user_id), conversation.id, conversation.title, conversation.content, conversation.date)
+
+    def remove(self, user_id, conversation_id):
+        if Config.MEMORY_INDEX_ENABLED:
+            self._schedule(self._remove, int(user_id), conversation_id)
+
+    def search(self, user_id, query, k=None, exclude=None):
+        """
+        Top-k related diary excerpts for a query, best chunk per conversation.
+        A cold or outdated index is refreshed in the background; until then the
+        previous copy (or nothing) is searched.
+        """
+        if not Config.MEMORY_INDEX_ENABLED or not (query or '').strip():
+            return []
+        try:
+            user_id = int(user_id)
+            version = self._shared_version(user_id)
+            query_vector = self.embedder.embed([query])[0]
+            lock = self._user_lock(user_id)
+            if not lock.acquire(timeout=SEARCH_LOCK_TIMEOUT):
+                return []
+            try:
+                index = self._indexes.get(user_id)
+                if index is None or (version is not None and index.version != version):
+                    self._refresh_async(user_id)
+                if index is None:
+                    return []
+                return index.search(query_vector, k or Config.MEMORY_TOP_K, exclude, Config.MEMORY_MIN_SCORE)
+            finally:
+                lock.release()
+        except Exception as e:
+            print(f"Memory search failed for user {user_id}: {str(e)}")
+            return []
+
+memory_index = MemoryIndex()
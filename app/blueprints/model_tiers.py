@@ -0,0 +1,74 @@
+import re
+import threading
+from collections import deque
+from ..config import Config
+
+TIERS = ('fast', 'standard')
+DEFAULT_TIER = 'standard'
+
+# 需要推理、分析或长篇输出的请求留在标准模型
+COMPLEX_PATTERN = re.compile(
+    r'```|\b(explain|analy[sz]e|compare|why|how does|step by step|summari[sz]e|translate|plan)\b'
+    r'|为什么|分析|解释|比较|总结|翻译|详细|规划|建议',
+    re.IGNORECASE
+)
+
+def choose_tier(endpoint, text, context_tokens=0, requested=None):
+    """
+    Pick a model tier for a request. Returns (tier, reason).
+    An explicit, valid `requested` tier always wins (users can opt up).
+    """
+    if requested in TIERS:
+        return requested, 'requested'
+    if not Config.LLM_TIERING_ENABLED:
+        return DEFAULT_TIER, 'tiering disabled'
+    max_chars = Config.LLM_FAST_MAX_CHARS.get(endpoint)
+    if max_chars is None:
+        return DEFAULT_TIER, 'endpoint'
+    text = text or ''
+    if len(text) > max_chars:
+        return 'standard', 'long input'
+    if context_tokens > Config.LLM_FAST_MAX_CONTEXT_TOKENS:
+        return 'standard', 'long context'
+    # 复杂度判断只针对对话；润色请求的内容本身就是日记正文
+    if endpoint == 'chat' and (COMPLEX_PATTERN.search(text) or text.count('\n') > 8 or len(re.findall(r'[?？]', text)) > 2):
+        return 'standard', 'complex'
+    return 'fast', 'short'
+
+class TierStats:
+    """
+    Rolling latency / error / output-size window per (endpoint, tier)
+    """
+    def __init__(self, window=200):
+        self.window = window
+        self._samples = {}
+        self._counts = {}
+        self._lock = threading.Lock()
+
+    def record(self, endpoint, tier, reason, latency, ok, output_chars=0):
+        print(f"LLM tier {endpoint}/{tier} ({reason}): {latency:.2f}s {'ok' if ok else 'failed'}, {output_chars} chars")
+        with self._lock:
+            key = (endpoint, tier)
+            samples = self._samples.setdefault(key, deque(maxlen=self.window))
+            samples.append((latency, ok, output_chars))
+            counts = self._counts.setdefault(key, {})
+            counts[reason] = counts.get(reason, 0) + 1
+
+    def snapshot(self):
+        with self._lock:
+            items = {key: (list(samples), dict(self._counts.get(key, {}))) for key, samples in self._samples.items()}
+        result = {}
+        for (endpoint, tier), (samples, reasons) in items.items():
+            latencies = sorted(latency for latency, ok, _ in samples if ok)
+            succeeded = [chars for _, ok, chars in samples if ok]
+            result.setdefault(endpoint, {})[tier] = {
+                'samples': len(samples),
+                'error_rate': round(1 - len(succeeded) / len(samples), 4) if samples else 0.0,
+                'p50': latencies[len(latencies) // 2] if latencies else None,
+                'p90': latencies[min(int(len(latencies) * 0.9), len(latencies) - 1)] if latencies else None,
+                'avg_output_chars': round(sum(succeeded) / len(succeeded), 1) if succeeded else None,
+                'reasons': reasons
+            }
+        return result
+
+tier_stats = TierStats()
@@ -1,44 +1,50 @@
-from openai import OpenAI
 from app.extension import db
 from app.models import Conversation, ChatMessage
 from ..config import Config
+from .prompts import (
+    ensure_system_prompt,
+    REGENERATION_SYSTEM_PROMPT,
+    build_regeneration_prompt,
+    SUMMARY_SYSTEM_PROMPT,
+    build_summary_prompt
+)
+from .llm_clients import llm_clients
 
 class AIService:
+    REGENERATE_MODEL = "openai/gpt-4o"
+    # 修改 regenerate 提示词时递增，使旧的缓存结果失效
+    REGENERATE_PROMPT_VERSION = 1
+
+    @staticmethod
+    def model_for(tier):
+        """
+        Model name for a routing tier ('fast' or 'standard')
+        """
+        return Config.LLM_MODELS['openrouter'][tier]
+
     @staticmethod
-    def regenerate_text(current_content, new_content):
+    def regenerate_text(current_content, new_content, model=None):
         try:
             print(f"Regenerate text request - Current: '{current_content}', New: '{new_content}'")
             
-            prompt = ''
-            if not current_content:
-                prompt = f'Please help improve the fluency of this text: "{new_content}". Return ONLY the improved text without any additional commentary or explanations.'
-            else:
-                prompt = f'Please combine and improve the fluency of these two texts. You can make some adjustment to make it more fluent. First text: "{current_content}". Second text: "{new_content}". Return ONLY the improved text without any additional commentary or explanations.'
+            prompt = build_regeneration_prompt(current_content, new_content)
 
             print(f"Sending regeneration request to AI API...")
             
-            client = OpenAI(
-                base_url="https://openrouter.ai/api/v1",
-                api_key=Config.GPT_API_KEY,
-            )
+            client = llm_clients.openrouter()
             
             completion = client.chat.completions.create(
-                extra_headers={
-                    "HTTP-Referer": "https://your-site.com",
-                    "X-Title": "Ora AI Assistant",
-                },
-                model="openai/gpt-4o",
+                model=model or AIService.REGENERATE_MODEL,
                 messages=[
                     {
                         'role': 'system',
-                        'content': "You are an assistant who helps improve text fluency.No other additional information should be added.Return ONLY the improved text without any additional commentary, explanations, or formatting."
+                        'content': REGENERATION_SYSTEM_PROMPT
                     },
                     {
                         'role': 'user',
                         'content': prompt
                     }
-                ],
-                timeout=30
+                ]
             )
             
             print(f"Regeneration API Response successful")
@@ -50,32 +56,20 @@ class AIService:
             raise Exception(f"Failed to regenerate text: {str(e)}")
 
     @staticmethod
-    def chat(messages):
+    def chat(messages, model=None):
         try:
             # 添加详细的日志记录
             print(f"Chat request - Messages count: {len(messages)}")
             
-            if not any(msg.get('role') == 'system' for msg in messages):
-                messages.insert(0, {
-                    'role': 'system',
-                    'content': "As a professional 'Life Story Architect,' you'll blend oral history methodology with narrative therapy techniques to help users construct comprehensive autobiographical narratives. Your systematic approach guides them through reconstructing key life events with full contextual dimensions—pinpointing temporal/spatial markers (when/where), central characters, causal chains, and emotional transformations. Using a 'beginning-development-turning point' story structure, you'll elicit rich details through nuanced questioning: 'What was your life circumstance before this event? What served as the catalyst? What decisive moments emerged during the process? How did your understanding evolve afterward?' By employing emotional arc tracking ('If this experience were weather patterns, what sequence would it follow?') and multi-perspective reflection ('How would your present self reinterpret that scene?'), you'll reveal both factual sequences and inner growth trajectories. Your toolkit includes sensory activation ('What distinctive sounds or scents defined that space?') for enhanced recall and gap analysis ('You mentioned A then jumped to C—what connected these moments?') to ensure narrative cohesion. The process yields three integrated biography components: a chronological fact timeline, psychological journey mapping, and distilled life lessons. Throughout, you maintain narrative ethics with regular comfort checks ('Shall we approach this sensitive topic differently?') and empower reframing choices ('Would you categorize this story as rebirth or fateful twist?'). Now, where shall we begin your life exploration? Key career crossroads, profound relationship chapters, or transformative identity journeys—which domain calls to you first? Make your response short and it is better to have two or three sentences maximum."
-                })
+            ensure_system_prompt(messages)
 
             print(f"Sending request to AI API...")
             
-            client = OpenAI(
-                base_url="https://openrouter.ai/api/v1",
-                api_key=Config.GPT_API_KEY,
-            )
+            client = llm_clients.openrouter()
             
             completion = client.chat.completions.create(
-                extra_headers={
-                    "HTTP-Referer": "https://your-site.com",
-                    "X-Title": "Ora AI Assistant",
-                },
-                model="openai/gpt-4o",
-                messages=messages,
-                timeout=30
+                model=model or "openai/gpt-4o",
+                messages=messages
             )
             
             print("Chat request successful")
@@ -95,24 +89,85 @@ class AIService:
             print(f"Chat error: {str(e)}")
             raise Exception(f"Failed to process chat: {str(e)}")
 
+    @staticmethod
+    def chat_stream(messages, model=None):
+        """
+        Stream a chat completion; yields delta events then one done event
+        """
+        print(f"Chat stream request - Messages count: {len(messages)}")
+        ensure_system_prompt(messages)
+        
+        client = llm_clients.openrouter()
+        try:
+            stream = client.chat.completions.create(
+                model=model or "openai/gpt-4o",
+                messages=messages,
+                stream=True,
+                stream_options={'include_usage': True}
+            )
+        except Exception as e:
+            print(f"Chat stream error: {str(e)}")
+            raise Exception(f"Failed to process chat: {str(e)}")
+        
+        content = []
+        finish_reason = None
+        usage = None
+        try:
+            for chunk in stream:
+                if chunk.usage:
+                    usage = chunk.usage.model_dump()
+                if not chunk.choices:
+                    continue
+                choice = chunk.choices[0]
+                if choice.delta and choice.delta.content:
+                    content.append(choice.delta.content)
+                    yield {'type': 'delta', 'content': choice.delta.content}
+                if choice.finish_reason:
+                    finish_reason = choice.finish_reason
+        finally:
+            # 客户端断开时 generator 被关闭，同时释放上游连接
+            stream.close()
+        
+        print("Chat stream finished")
+        yield {
+            'type': 'done',
+            'role': 'assistant',
+            'content': ''.join(content),
+            'finish_reason': finish_reason,
+            'usage': usage
+        }
+
+    @staticmethod
+    def summarize(previous_summary, messages):
+        """
+        Fold messages into a rolling conversation summary
+        """
+        try:
+            print(f"Summary request - Messages count: {len(messages)}")
+            client = llm_clients.openrouter()
+            completion = client.chat.completions.create(
+                model="openai/gpt-4o",
+                messages=[
+                    {'role': 'system', 'content': SUMMARY_SYSTEM_PROMPT},
+                    {'role': 'user', 'content': build_summary_prompt(previous_summary, messages)}
+                ]
+            )
+            return completion.choices[0].message.content.strip()
+        except Exception as e:
+            print(f"Summary error: {str(e)}")
+            raise Exception(f"Failed to summarize conversation: {str(e)}")
+
 class ConversationService:
     @staticmethod
     def create_conversation(title, content, date, messages=None):
         try:
             conversation = Conversation(title=title, content=content, date=date)
             db.session.add(conversation)
+            # 会话和消息在同一个事务里提交
+            db.session.flush()
+            ChatMessage.insert_many(conversation.id, messages)
             db.session.commit()
 
-            if messages:
-                for message in messages:
-                    chat_message = ChatMessage(
-                        conversation_id=conversation.id,
-                        role=message['role'],
-                        content=message['content']
-                    )
-                    db.session.add(chat_message)
-                db.session.commit()
-
             return conversation
         except Exception as e:
             db.session.rollback()
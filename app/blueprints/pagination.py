@@ -0,0 +1,60 @@
+import base64
+import json
+from datetime import datetime
+from sqlalchemy import or_, and_
+from ..config import Config
+
+def encode_cursor(created_at, row_id):
+    """
+    Opaque cursor for the row after which the next page starts
+    """
+    raw = json.dumps([created_at.isoformat(), row_id], separators=(',', ':'))
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii').rstrip('=')
+
+def decode_cursor(cursor):
+    """
+    Return (created_at, id); raises ValueError on a malformed cursor
+    """
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        created_at, row_id = json.loads(raw)
+        return datetime.fromisoformat(created_at), int(row_id)
+    except Exception:
+        raise ValueError('Invalid cursor')
+
+def page_size(value):
+    """
+    Requested page size clamped to the configured bounds
+    """
+    try:
+        size = int(value) if value else Config.PAGE_SIZE_DEFAULT
+    except (TypeError, ValueError):
+        size = Config.PAGE_SIZE_DEFAULT
+    return max(1, min(size, Config.PAGE_SIZE_MAX))
+
+def keyset_query(query, model, cursor=None, limit=None):
+    """
+    The query for one newest-first page (limit + 1 rows, to detect a next page)
+    """
+    if cursor:
+        created_at, row_id = decode_cursor(cursor)
+        # 与排序键一致的行比较，可以直接走 (…, created_at, id) 索引
+        query = query.filter(or_(
+            model.created_at < created_at,
+            and_(model.created_at == created_at, model.id < row_id)
+        ))
+    return query.order_by(model.created_at.desc(), model.id.desc()).limit(page_size(limit) + 1)
+
+def keyset_page(query, model, cursor=None, limit=None, key=None):
+    """
+    Newest-first page of a query ordered by (created_at, id).
+    Returns (rows, next_cursor); next_cursor is None on the last page.
+    key maps a result row to its model instance when the query returns tuples.
+    """
+    limit = page_size(limit)
+    rows = keyset_query(query, model, cursor, limit).all()
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    last = key(rows[-1]) if key else rows[-1]
+    return rows, encode_cursor(last.created_at, last.id)
@@ -0,0 +1,269 @@
+import asyncio
+import copy
+import os
+import threading
+import time
+from collections import deque
+from app.blueprints.openai import AIService as OpenRouterAIService
+from app.blueprints.chat import AIService as GLMAIService
+from .limits import bulkheads
+from .model_tiers import DEFAULT_TIER, tier_stats
+from ..config import Config
+
+# provider 名称 -> (服务类, 需要的 API key 配置项)
+PROVIDERS = {
+    'openrouter': (OpenRouterAIService, 'GPT_API_KEY'),
+    'glm': (GLMAIService, 'CHAT_API_KEY'),
+}
+
+class ProviderStats:
+    """
+    Rolling latency and error window for one provider
+    """
+    def __init__(self, window):
+        self.latencies = deque(maxlen=window)
+        self.outcomes = deque(maxlen=window)
+        self.open_until = 0.0
+        self._lock = threading.Lock()
+
+    def record(self, latency, ok):
+        with self._lock:
+            self.outcomes.append(ok)
+            if ok:
+                self.latencies.append(latency)
+            elif self._error_rate() >= Config.LLM_ROUTER_ERROR_THRESHOLD and len(self.outcomes) >= Config.LLM_ROUTER_MIN_SAMPLES:
+                # 错误率过高时熔断一段时间
+                self.open_until = time.time() + Config.LLM_ROUTER_COOLDOWN
+
+    def _error_rate(self):
+        if not self.outcomes:
+            return 0.0
+        return 1 - sum(self.outcomes) / len(self.outcomes)
+
+    def error_rate(self):
+        with self._lock:
+            return self._error_rate()
+
+    def percentile(self, p):
+        with self._lock:
+            if len(self.latencies) < Config.LLM_ROUTER_MIN_SAMPLES:
+                return None
+            ordered = sorted(self.latencies)
+        return ordered[min(int(len(ordered) * p / 100), len(ordered) - 1)]
+
+    def healthy(self):
+        return time.time() >= self.open_until
+
+    def snapshot(self):
+        return {
+            'samples': len(self.outcomes),
+            'error_rate': round(self.error_rate(), 4),
+            'p50': self.percentile(50),
+            'p90': self.percentile(90),
+            'healthy': self.healthy()
+        }
+
+class ProviderRouter:
+    """
+    Route LLM calls to the fastest healthy backend, optionally hedging to the runner-up
+    """
+    def __init__(self, providers, hedge=None):
+        if not providers:
+            raise ValueError("At least one LLM provider is required")
+        self.providers = providers
+        self.hedge = Config.LLM_HEDGE_ENABLED if hedge is None else hedge
+        self.stats = {name: ProviderStats(Config.LLM_ROUTER_WINDOW) for name in providers}
+        # 流式调用记录首 token 时间，和整次调用的耗时分开统计，否则会拉高对冲延迟
+        self.stream_stats = {name: ProviderStats(Config.LLM_ROUTER_WINDOW) for name in providers}
+        self._hedge_loop = None
+        self._hedge_pid = None
+        self._hedge_lock = threading.Lock()
+        self._async_router = None
+        self.regenerate_prompt_version = max(service.REGENERATE_PROMPT_VERSION for service in providers.values())
+
+    @classmethod
+    def from_config(cls):
+        providers = {}
+        for name in Config.LLM_PROVIDERS:
+            service_class, key_setting = PROVIDERS[name]
+            if getattr(Config, key_setting):
+                providers[name] = service_class()
+            else:
+                print(f"⚠️ LLM provider '{name}' disabled - {key_setting} not set")
+        if not providers:
+            # 没有配置任何 key 时保持原来的默认后端
+            providers['openrouter'] = OpenRouterAIService()
+        return cls(providers)
+
+    def model_signature(self, tier):
+        """
+        All models a tier may be served by (result cache keys must cover every one)
+        """
+        return '|'.join(service.model_for(tier) for service in self.providers.values())
+
+    def _healthy(self, name):
+        # 任一种调用熔断都视为不健康
+        return self.stats[name].healthy() and self.stream_stats[name].healthy()
+
+    def _open_until(self, name):
+        return max(self.stats[name].open_until, self.stream_stats[name].open_until)
+
+    def ranked(self, stream=False):
+        """
+        Provider names, healthy ones first, fastest median latency first
+        (time to first token when stream is set)
+        """
+        stats = self.stream_stats if stream else self.stats
+        def score(name):
+            median = stats[name].percentile(50)
+            # 样本不足的 provider 优先探测
+            return 0.0 if median is None else median
+        healthy = sorted((name for name in self.providers if self._healthy(name)), key=score)
+        unhealthy = sorted((name for name in self.providers if not self._healthy(name)), key=self._open_until)
+        return healthy + unhealthy
+
+    def _call(self, name, method, args, tier=None):
+        started = time.time()
+        service = self.providers[name]
+        kwargs = {'model': service.model_for(tier)} if tier else {}
+        try:
+            result = getattr(service, method)(*args, **kwargs)
+        except Exception:
+            self.stats[name].record(time.time() - started, False)
+            raise
+        self.stats[name].record(time.time() - started, True)
+        return result
+
+    def _hedge_delay(self, name):
+        p90 = self.stats[name].percentile(Config.LLM_HEDGE_PERCENTILE)
+        if p90 is None:
+            return Config.LLM_HEDGE_MAX_DELAY
+        return min(max(p90, Config.LLM_HEDGE_MIN_DELAY), Config.LLM_HEDGE_MAX_DELAY)
+
+    def _hedger(self):
+        """
+        Event loop thread that runs hedged calls on the async clients
+        """
+        # fork 之后子进程里没有这个线程，重新创建
+        if self._hedge_pid != os.getpid():
+            with self._hedge_lock:
+                if self._hedge_pid != os.getpid():
+                    from .async_ai import AsyncProviderRouter
+                    loop = asyncio.new_event_loop()
+                    threading.Thread(target=loop.run_forever, name='llm-hedge', daemon=True).start()
+                    self._hedge_loop, self._async_router = loop, AsyncProviderRouter(self)
+                    self._hedge_pid = os.getpid()
+        return self._hedge_loop, self._async_router
+
+    def _invoke(self, method, make_args, tier=None):
+        """
+        Call method on the best provider; fail over, or hedge when the primary is slow
+        """
+        ranked = self.ranked()
+        if not self.hedge or len(ranked) < 2:
+            last_error = None
+            for name in ranked:
+                try:
+                    return name, self._call(name, method, make_args(), tier)
+                except Exception as e:
+                    print(f"Provider {name} failed for {method}: {str(e)}")
+                    last_error = e
+            raise last_error
+
+        # 对冲走异步客户端：先返回的胜出，落后的任务被取消，连同它的 HTTP 请求一起中断
+        loop, async_router = self._hedger()
+        return asyncio.run_coroutine_threadsafe(async_router._invoke(method, make_args, tier), loop).result()
+
+    @staticmethod
+    def _tiered(endpoint, tier, reason, call, output_chars):
+        """
+        Run call() and record latency/outcome for the model tier it used
+        """
+        started = time.time()
+        try:
+            result = call()
+        except Exception:
+            tier_stats.record(endpoint, tier, reason, time.time() - started, False)
+            raise
+        tier_stats.record(endpoint, tier, reason, time.time() - started, True, output_chars(result))
+        return result
+
+    def chat(self, messages, tier=DEFAULT_TIER, reason='default'):
+        # 每个 provider 都会插入 system prompt，因此各自使用一份副本
+        with bulkheads['llm'].slot():
+            name, response = self._tiered(
+                'chat', tier, reason,
+                lambda: self._invoke('chat', lambda: [copy.deepcopy(messages)], tier),
+                lambda result: len(result[1]['choices'][0]['message']['content'] or '')
+            )
+        response['provider'] = name
+        response['tier'] = tier
+        return response
+
+    def regenerate_text(self, current_content, new_content, tier=DEFAULT_TIER, reason='default'):
+        with bulkheads['llm'].slot():
+            return self._tiered(
+                'regenerate', tier, reason,
+                lambda: self._invoke('regenerate_text', lambda: [current_content, new_content], tier)[1],
+                len
+            )
+
+    def summarize(self, previous_summary, messages):
+        with bulkheads['llm'].slot():
+            return self._invoke('summarize', lambda: [previous_summary, messages])[1]
+
+    def chat_stream(self, messages, tier=DEFAULT_TIER, reason='default'):
+        """
+        Stream from the best provider, failing over only if nothing was sent yet.
+        The LLM bulkhead slot is held until the stream is finished or closed.
+        """
+        with bulkheads['llm'].slot():
+            started = time.time()
+            try:
+                for event in self._chat_stream(messages, tier):
+                    if event['type'] == 'done':
+                        event['tier'] = tier
+                        tier_stats.record('chat', tier, reason, time.time() - started, True, len(event['content']))
+                    yield event
+            except GeneratorExit:
+                raise
+            except Exception:
+                tier_stats.record('chat', tier, reason, time.time() - started, False)
+                raise
+
+    def _chat_stream(self, messages, tier):
+        last_error = None
+        for name in self.ranked(stream=True):
+            started = time.time()
+            first_token = None
+            service = self.providers[name]
+            upstream = service.chat_stream(copy.deepcopy(messages), model=service.model_for(tier))
+            try:
+                for event in upstream:
+                    if first_token is None:
+                        first_token = time.time() - started
+                    if event['type'] == 'done':
+                        event['provider'] = name
+                    yield event
+                self.stream_stats[name].record(time.time() - started if first_token is None else first_token, True)
+                return
+            except GeneratorExit:
+                raise
+            except Exception as e:
+                self.stream_stats[name].record(time.time() - started, False)
+                print(f"Provider {name} stream failed: {str(e)}")
+                if first_token is not None:
+                    raise
+                last_error = e
+            finally:
+                upstream.close()
+        raise last_error
+
+    def snapshot(self):
+        return {
+            'hedge': self.hedge,
+            'order': self.ranked(),
+            'providers': {name: stats.snapshot() for name, stats in self.stats.items()},
+            'streams': {name: stats.snapshot() for name, stats in self.stream_stats.items()},
+            'tiers': tier_stats.snapshot()
+        }
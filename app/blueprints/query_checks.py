@@ -0,0 +1,191 @@
+# Query plan and query-count checks for the hot read paths.
+# flask explain-check prints them against any scratch database; tests/test_query_plans.py asserts them on SQLite.
+
+import random
+import re
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from alembic import command
+from sqlalchemy import create_engine, event, inspect, text
+from sqlalchemy.orm import Session
+from app.extension import db, migrate
+from app.models import UserModel, Conversation, ChatMessage, CommunityPost
+from .history import ConversationHistory
+from .pagination import keyset_query, encode_cursor
+from ..config import Config
+
+# SQLite: "SCAN conversations" 是全表扫描；"USE TEMP B-TREE FOR ORDER BY" 是 filesort
+SQLITE_FULL_SCAN = re.compile(r'^SCAN (TABLE )?\w+( AS \w+)?$')
+SQLITE_SORT = 'USE TEMP B-TREE'
+
+def seed(connection, users=50, conversations=40, messages=10, posts=40):
+    """
+    Bulk-insert a synthetic dataset spread over the last year
+    """
+    rng = random.Random(42)
+    now = datetime.utcnow()
+
+    def moment():
+        return now - timedelta(seconds=rng.randint(0, 365 * 86400))
+
+    connection.execute(UserModel.__table__.insert(), [
+        {'id': i, 'name': f'explain-{i}', 'email': f'explain-{i}@example.com', 'password_hash': '-', 'created_at': now}
+        for i in range(1, users + 1)
+    ])
+    conversation_rows = []
+    for user_id in range(1, users + 1):
+        for _ in range(conversations):
+            created_at = moment()
+            conversation_rows.append({
+                'id': len(conversation_rows) + 1, 'user_id': user_id, 'title': 'diary', 'content': 'seed',
+                'date': created_at.date().isoformat(), 'created_at': created_at, 'updated_at': created_at
+            })
+    connection.execute(Conversation.__table__.insert(), conversation_rows)
+    for start in range(0, len(conversation_rows), 500):
+        connection.execute(ChatMessage.__table__.insert(), [
+            {
+                'conversation_id': row['id'], 'role': 'user' if n % 2 == 0 else 'assistant', 'content': 'seed',
+                'token_count': 1, 'created_at': row['created_at'] + timedelta(seconds=n)
+            }
+            for row in conversation_rows[start:start + 500]
+            for n in range(messages)
+        ])
+    # 一半帖子不带冗余作者名，模拟迁移前的旧数据
+    connection.execute(CommunityPost.__table__.insert(), [
+        {
+            'user_id': user_id, 'title': 'post', 'content': 'seed', 'is_public': rng.random() < 0.7,
+            'source_type': 'original', 'author_name': f'explain-{user_id}' if n % 2 else None,
+            'created_at': moment(), 'updated_at': now
+        }
+        for user_id in range(1, users + 1)
+        for n in range(posts)
+    ])
+    connection.commit()
+
+    # 让优化器拿到真实的行数/基数统计
+    if connection.dialect.name == 'mysql':
+        connection.exec_driver_sql('ANALYZE TABLE users, conversations, chat_messages, community_posts').fetchall()
+    else:
+        connection.exec_driver_sql('ANALYZE')
+    connection.commit()
+
+def hot_queries(user_id, conversation_id):
+    """
+    The statements the paginated endpoints actually run, first page and a later page
+    """
+    cursor = encode_cursor(datetime.utcnow() - timedelta(days=180), 1 << 30)
+    conversations = Conversation.list_query(user_id)
+    feed = CommunityPost.list_query(is_public=True)
+    my_posts = CommunityPost.list_query(user_id=user_id)
+    return [
+        ('GET /conversations', keyset_query(conversations, Conversation)),
+        ('GET /conversations?cursor', keyset_query(conversations, Conversation, cursor)),
+        ('GET /community/posts', keyset_query(feed, CommunityPost)),
+        ('GET /community/posts?cursor', keyset_query(feed, CommunityPost, cursor)),
+        ('GET /community/my-posts', keyset_query(my_posts, CommunityPost)),
+        ('chat history', ConversationHistory().recent_query(conversation_id)),
+    ]
+
+def rendered_pages(user_id, conversation_id):
+    """
+    (name, statement, render, max queries) for responses whose JSON rendering must
+    not issue per-row queries; render turns the result into what the endpoint returns
+    """
+    def posts(result):
+        return [post.to_dict() for post in result.scalars().unique()]
+
+    def conversation_list(result):
+        return [conv.to_list_dict(count, last_at) for conv, count, last_at in result]
+
+    def conversation_detail(result):
+        return [conv.to_dict() for conv in result.scalars()]
+
+    limit = Config.PAGE_SIZE_MAX
+    return [
+        ('GET /community/posts', keyset_query(CommunityPost.list_query(is_public=True), CommunityPost, limit=limit).statement, posts, 1),
+        ('GET /community/my-posts', keyset_query(CommunityPost.list_query(user_id=user_id), CommunityPost, limit=limit).statement, posts, 1),
+        ('GET /conversations', keyset_query(Conversation.list_query(user_id), Conversation, limit=limit).statement, conversation_list, 1),
+        # 会话一次，消息 selectinload 一次
+        ('GET /conversations/<id>', Conversation.detail_query(conversation_id, user_id).statement, conversation_detail, 2),
+    ]
+
+def count_queries(connection, statement, render):
+    """
+    Number of statements it takes to load a response and render it; returns (queries, rows)
+    """
+    executed = []
+
+    def record(conn, cursor, sql, parameters, context, executemany):
+        executed.append(sql)
+
+    event.listen(connection, 'before_cursor_execute', record)
+    try:
+        with Session(bind=connection) as session:
+            rows = render(session.execute(statement))
+    finally:
+        event.remove(connection, 'before_cursor_execute', record)
+    return len(executed), len(rows)
+
+def explain(connection, statement):
+    """
+    Return (plan lines, offending lines) for one statement
+    """
+    sql = str(statement.compile(dialect=connection.dialect, compile_kwargs={'literal_binds': True}))
+    if connection.dialect.name == 'sqlite':
+        plan = [row[-1] for row in connection.exec_driver_sql('EXPLAIN QUERY PLAN ' + sql)]
+        return plan, [line for line in plan if SQLITE_FULL_SCAN.match(line) or SQLITE_SORT in line]
+    if connection.dialect.name != 'mysql':
+        raise ValueError(f"Query plan checks support MySQL and SQLite, not {connection.dialect.name}")
+    plan, problems = [], []
+    for row in connection.exec_driver_sql('EXPLAIN ' + sql).mappings():
+        extra = row['Extra'] or ''
+        line = f"{row['table']}: type={row['type']} key={row['key']} rows={row['rows']} {extra}".strip()
+        plan.append(line)
+        if row['type'] == 'ALL' or 'filesort' in extra or 'temporary' in extra:
+            problems.append(line)
+    return plan, problems
+
+@contextmanager
+def scratch_database(url, keep=False):
+    """
+    Connection to an empty database migrated to head; tables are dropped afterwards unless keep
+    """
+    engine = create_engine(url)
+    try:
+        with engine.connect() as connection:
+            if inspect(connection).get_table_names():
+                raise ValueError(f"{engine.url.render_as_string()} is not empty; use a scratch database")
+            try:
+                # 用迁移建表而不是 create_all，检查的是线上真正会有的索引
+                config = migrate.get_config()
+                config.attributes['connection'] = connection
+                command.upgrade(config, 'head')
+                connection.commit()
+                yield connection
+            finally:
+                if not keep:
+                    connection.rollback()
+                    db.metadata.drop_all(connection)
+                    if connection.dialect.name == 'sqlite':
+                        # 0005 建的 FTS5 虚拟表不在 metadata 里
+                        for fts in ('conversations_fts', 'chat_messages_fts'):
+                            connection.execute(text(f'DROP TABLE IF EXISTS {fts}'))
+                    connection.execute(text('DROP TABLE IF EXISTS alembic_version'))
+                    connection.commit()
+    finally:
+        engine.dispose()
+
+def plan_problems(connection, user_id=1, conversation_id=1):
+    """
+    (name, plan lines, offending lines) for every hot query
+    """
+    return [(name, *explain(connection, query.statement)) for name, query in hot_queries(user_id, conversation_id)]
+
+def render_counts(connection, user_id=1, conversation_id=1):
+    """
+    (name, queries, rows, max queries) for every rendered page
+    """
+    return [
+        (name, *count_queries(connection, statement, render), budget)
+        for name, statement, render, budget in rendered_pages(user_id, conversation_id)
+    ]
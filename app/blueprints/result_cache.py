@@ -0,0 +1,142 @@
+import hashlib
+import json
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from app.extension import redis_client
+
+def normalize_text(text):
+    """
+    Canonical form for cache keys: NFC, trimmed lines, collapsed spaces and blank lines
+    """
+    text = unicodedata.normalize('NFC', text or '')
+    lines = [re.sub(r'[ \t　]+', ' ', line).strip() for line in text.splitlines()]
+    return re.sub(r'\n{3,}', '\n\n', '\n'.join(lines)).strip()
+
+class ResultCache:
+    """
+    Two-tier cache: in-process LRU in front of Redis, both with a TTL
+    """
+    # 共享计数在本地累积，最多每隔这么久写一次 Redis
+    STATS_FLUSH_SECONDS = 5
+
+    def __init__(self, namespace, maxsize=1024, ttl=86400):
+        self.namespace = namespace
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._local = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {'local_hits': 0, 'redis_hits': 0, 'misses': 0}
+        self._unflushed = dict.fromkeys(self._stats, 0)
+        self._flushed_at = time.time()
+
+    def make_key(self, *parts):
+        digest = hashlib.sha256(json.dumps(parts, ensure_ascii=False, sort_keys=True).encode('utf-8')).hexdigest()
+        return f"cache:{self.namespace}:{digest}"
+
+    def _record(self, outcome):
+        with self._lock:
+            self._stats[outcome] += 1
+            self._unflushed[outcome] += 1
+            due = time.time() - self._flushed_at >= self.STATS_FLUSH_SECONDS
+        if due:
+            self._flush_stats()
+
+    def _flush_stats(self):
+        """
+        Add the counts gathered since the last flush to the shared Redis hash
+        """
+        with self._lock:
+            counts = {name: count for name, count in self._unflushed.items() if count}
+            self._unflushed = dict.fromkeys(self._stats, 0)
+            self._flushed_at = time.time()
+        if not counts:
+            return
+        try:
+            # 汇总所有 worker 的命中情况
+            pipe = redis_client.pipeline()
+            for name, count in counts.items():
+                pipe.hincrby(f"cache:{self.namespace}:stats", name, count)
+            pipe.execute()
+        except Exception:
+            # 写失败的计数留到下次再试
+            with self._lock:
+                for name, count in counts.items():
+                    self._unflushed[name] += count
+
+    def _get_local(self, key):
+        with self._lock:
+            entry = self._local.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at < time.time():
+                del self._local[key]
+                return None
+            self._local.move_to_end(key)
+            return value
+
+    def _set_local(self, key, value, ttl):
+        with self._lock:
+            self._local[key] = (time.time() + ttl, value)
+            self._local.move_to_end(key)
+            while len(self._local) > self.maxsize:
+                self._local.popitem(last=False)
+
+    def get(self, key):
+        """
+        Return (value, tier) where tier is 'local', 'redis' or None on a miss
+        """
+        value = self._get_local(key)
+        if value is not None:
+            self._record('local_hits')
+            return value, 'local'
+
+        try:
+            cached = redis_client.get(key)
+        except Exception as e:
+            print(f"Result cache read error: {str(e)}")
+            cached = None
+        if cached is not None:
+            value = json.loads(cached)
+            try:
+                remaining = redis_client.ttl(key)
+            except Exception:
+                remaining = self.ttl
+            self._set_local(key, value, remaining if remaining and remaining > 0 else self.ttl)
+            self._record('redis_hits')
+            return value, 'redis'
+
+        self._record('misses')
+        return None, None
+
+    def set(self, key, value):
+        self._set_local(key, value, self.ttl)
+        try:
+            redis_client.setex(key, self.ttl, json.dumps(value, ensure_ascii=False))
+        except Exception as e:
+            print(f"Result cache write error: {str(e)}")
+
+    @staticmethod
+    def _with_ratio(stats):
+        total = sum(stats.values())
+        hits = stats['local_hits'] + stats['redis_hits']
+        return {**stats, 'requests': total, 'hit_ratio': round(hits / total, 4) if total else 0.0}
+
+    def stats(self):
+        """
+        Hit ratios for this process and, when Redis is reachable, for all workers
+        (other workers' counts lag by up to STATS_FLUSH_SECONDS)
+        """
+        self._flush_stats()
+        with self._lock:
+            process_stats = dict(self._stats)
+        result = {'process': self._with_ratio(process_stats)}
+        try:
+            shared = redis_client.hgetall(f"cache:{self.namespace}:stats")
+            result['global'] = self._with_ratio({name: int(shared.get(name, 0)) for name in process_stats})
+        except Exception:
+            pass
+        return result
@@ -0,0 +1,143 @@
+import re
+from sqlalchemy import DateTime, inspect, text
+from app.extension import db
+from ..config import Config
+
+# 两个来源合并后按相关度排序；同分时新的在前
+MYSQL_SEARCH = """
+SELECT * FROM (
+    SELECT 'conversation' AS kind, c.id AS conversation_id, NULL AS message_id, c.title, c.date,
+           c.content AS body, c.created_at,
+           MATCH(c.title, c.content) AGAINST (:q IN NATURAL LANGUAGE MODE) AS score
+    FROM conversations c
+    WHERE MATCH(c.title, c.content) AGAINST (:q IN NATURAL LANGUAGE MODE) AND c.user_id = :user_id
+    UNION ALL
+    SELECT 'message', m.conversation_id, m.id, c.title, c.date, m.content, m.created_at,
+           MATCH(m.content) AGAINST (:q IN NATURAL LANGUAGE MODE)
+    FROM chat_messages m JOIN conversations c ON c.id = m.conversation_id
+    WHERE MATCH(m.content) AGAINST (:q IN NATURAL LANGUAGE MODE) AND c.user_id = :user_id
+) hits
+ORDER BY score DESC, created_at DESC
+LIMIT :limit OFFSET :offset
+"""
+
+# CROSS JOIN 固定连接顺序：先查 FTS 索引再按用户过滤，而不是逐行探测 FTS
+SQLITE_SEARCH = """
+SELECT * FROM (
+    SELECT 'conversation' AS kind, c.id AS conversation_id, NULL AS message_id, c.title, c.date,
+           c.content AS body, c.created_at, -bm25(conversations_fts) AS score
+    FROM conversations_fts CROSS JOIN conversations c ON c.id = conversations_fts.rowid
+    WHERE conversations_fts MATCH :q AND c.user_id = :user_id
+    UNION ALL
+    SELECT 'message', m.conversation_id, m.id, c.title, c.date, m.content, m.created_at,
+           -bm25(chat_messages_fts)
+    FROM chat_messages_fts
+    CROSS JOIN chat_messages m ON m.id = chat_messages_fts.rowid
+    CROSS JOIN conversations c ON c.id = m.conversation_id
+    WHERE chat_messages_fts MATCH :q AND c.user_id = :user_id
+)
+ORDER BY score DESC, created_at DESC
+LIMIT :limit OFFSET :offset
+"""
+
+# 没有全文索引时（或 SQLite trigram 不支持的 1-2 字查询）逐行匹配，只在本地小数据量下使用
+LIKE_SEARCH = """
+SELECT * FROM (
+    SELECT 'conversation' AS kind, c.id AS conversation_id, NULL AS message_id, c.title, c.date,
+           c.content AS body, c.created_at, 0 AS score
+    FROM conversations c
+    WHERE c.user_id = :user_id AND (c.title LIKE :pattern ESCAPE '\\' OR c.content LIKE :pattern ESCAPE '\\')
+    UNION ALL
+    SELECT 'message', m.conversation_id, m.id, c.title, c.date, m.content, m.created_at, 0
+    FROM chat_messages m JOIN conversations c ON c.id = m.conversation_id
+    WHERE c.user_id = :user_id AND m.content LIKE :pattern ESCAPE '\\'
+) hits
+ORDER BY created_at DESC
+LIMIT :limit OFFSET :offset
+"""
+
+def make_snippet(body, terms, width=None):
+    """
+    Window of body around the first matched term, plus [start, end) offsets of
+    every term occurrence inside the window for client-side highlighting
+    """
+    width = width or Config.SEARCH_SNIPPET_CHARS
+    body = re.sub(r'\s+', ' ', body or '').strip()
+    lowered = body.lower()
+    positions = [lowered.find(term.lower()) for term in terms]
+    positions = [position for position in positions if position >= 0]
+    start = max(0, min(positions) - width // 4) if positions else 0
+    end = min(len(body), start + width)
+    snippet = body[start:end]
+
+    highlights = []
+    if terms:
+        pattern = re.compile('|'.join(re.escape(term) for term in sorted(terms, key=len, reverse=True)), re.IGNORECASE)
+        highlights = [[match.start(), match.end()] for match in pattern.finditer(snippet)]
+    prefix = '…' if start > 0 else ''
+    suffix = '…' if end < len(body) else ''
+    return prefix + snippet + suffix, [[a + len(prefix), b + len(prefix)] for a, b in highlights]
+
+class DiarySearch:
+    """
+    Ranked full-text search over one user's diaries (title/content) and chat messages
+    """
+    def __init__(self):
+        self._has_fts5 = None
+
+    def _backend(self, terms):
+        dialect = db.engine.dialect.name
+        if dialect == 'mysql':
+            return 'mysql'
+        if dialect == 'sqlite':
+            if self._has_fts5 is None:
+                self._has_fts5 = inspect(db.engine).has_table('conversations_fts')
+            # trigram 分词器至少需要 3 个字符
+            if self._has_fts5 and all(len(term) >= 3 for term in terms):
+                return 'sqlite'
+        return 'like'
+
+    @staticmethod
+    def terms(query):
+        return [term for term in (query or '').split() if term][:Config.SEARCH_MAX_TERMS]
+
+    def search(self, user_id, query, limit, offset=0):
+        """
+        Return (results, next_offset); next_offset is None on the last page
+        """
+        terms = self.terms(query)
+        if not terms:
+            return [], None
+        params = {'user_id': user_id, 'limit': limit + 1, 'offset': offset}
+        backend = self._backend(terms)
+        if backend == 'mysql':
+            statement, params['q'] = MYSQL_SEARCH, ' '.join(terms)
+        elif backend == 'sqlite':
+            # 每个词都作为短语引用，避免用户输入被当成 FTS5 查询语法
+            statement = SQLITE_SEARCH
+            params['q'] = ' OR '.join('"' + term.replace('"', '""') + '"' for term in terms)
+        else:
+            statement = LIKE_SEARCH
+            escaped = query.strip().replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+            params['pattern'] = f"%{escaped}%"
+            terms = [query.strip()]
+
+        rows = db.session.execute(text(statement).columns(created_at=DateTime), params).mappings().all()
+        next_offset = offset + limit if len(rows) > limit else None
+        results = []
+        for row in rows[:limit]:
+            snippet, highlights = make_snippet(row['body'], terms)
+            results.append({
+                'type': row['kind'],
+                'conversation_id': row['conversation_id'],
+                'message_id': row['message_id'],
+                'title': row['title'],
+                'date': row['date'],
+                'snippet': snippet,
+                'highlights': highlights,
+                'score': round(float(row['score'] or 0), 4),
+                'created_at': row['created_at'].isoformat() if row['created_at'] else None
+            })
+        return results, next_offset
+
+diary_search = DiarySearch()
@@ -0,0 +1,235 @@
+import asyncio
+import copy
+import hashlib
+import json
+import threading
+import time
+import uuid
+import redis
+from app.extension import redis_client
+from ..config import Config
+
+# 只删除自己持有的锁
+RELEASE_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+def payload_key(*parts):
+    """
+    Stable hash of a JSON-serialisable request payload
+    """
+    return hashlib.sha256(json.dumps(parts, ensure_ascii=False, sort_keys=True).encode('utf-8')).hexdigest()
+
+class _LeaderCancelled(Exception):
+    """
+    The in-process async leader was cancelled (its client went away) before finishing
+    """
+
+class _Call:
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+class SingleFlight:
+    """
+    Coalesce concurrent identical calls: one leader runs the function, followers
+    in this process wait on it and followers in other workers wait on Redis pub/sub.
+    Without Redis it degrades to in-process coalescing only.
+    """
+    def __init__(self, namespace, enabled=None):
+        self.namespace = namespace
+        # None 表示跟随 SINGLE_FLIGHT_ENABLED（LLM 请求合并的开关）
+        self.enabled = enabled
+        self._calls = {}
+        self._async_calls = {}
+        self._lock = threading.Lock()
+        self._release = None
+
+    def _enabled(self):
+        return Config.SINGLE_FLIGHT_ENABLED if self.enabled is None else self.enabled
+
+    def _keys(self, key):
+        base = f"singleflight:{self.namespace}:{key}"
+        return f"{base}:lock", f"{base}:result", f"{base}:done"
+
+    def do(self, key, func):
+        """
+        Return (result, shared); shared is True when another request did the work
+        """
+        if not self._enabled():
+            return func(), False
+
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+        if not leader:
+            if not call.event.wait(Config.SINGLE_FLIGHT_WAIT_TIMEOUT):
+                # leader 卡住时不陪着一起等，自己调用
+                print(f"Single-flight wait timed out ({self.namespace}), calling upstream directly")
+                return func(), False
+            if call.error is not None:
+                raise call.error
+            return copy.deepcopy(call.result), True
+
+        try:
+            result, shared = self._do_remote(key, func)
+            # 调用方可能修改返回值，等待者拿到的是独立副本
+            call.result = copy.deepcopy(result)
+            return result, shared
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.event.set()
+
+    async def do_async(self, key, factory):
+        """
+        asyncio variant for the ASGI path; factory returns a fresh awaitable
+        """
+        if not self._enabled():
+            return await factory(), False
+
+        while True:
+            future = self._async_calls.get(key)
+            if future is None:
+                break
+            try:
+                result = await asyncio.wait_for(asyncio.shield(future), Config.SINGLE_FLIGHT_WAIT_TIMEOUT)
+            except asyncio.TimeoutError:
+                print(f"Single-flight wait timed out ({self.namespace}), calling upstream directly")
+                return await factory(), False
+            except _LeaderCancelled:
+                # 领头请求的客户端断开了，但本请求的客户端还在：重新竞争成为 leader
+                continue
+            return copy.deepcopy(result), True
+
+        future = self._async_calls[key] = asyncio.get_running_loop().create_future()
+        try:
+            token = await asyncio.to_thread(self._try_lock, key)
+            outcome = await asyncio.to_thread(self._wait_remote, key) if token is None else None
+            if outcome is not None:
+                result, shared = self._result(outcome), True
+            elif token is None:
+                result, shared = await factory(), False
+            else:
+                try:
+                    result = await factory()
+                except asyncio.CancelledError:
+                    # 客户端断开：放开锁，让其他 worker 的等待者自己调用
+                    await asyncio.to_thread(self._unlock, key, token)
+                    raise
+                except Exception as e:
+                    await asyncio.to_thread(self._publish, key, token, {'error': str(e)})
+                    raise
+                await asyncio.to_thread(self._publish, key, token, {'result': result})
+                shared = False
+            future.set_result(copy.deepcopy(result))
+            return result, shared
+        except BaseException as e:
+            future.set_exception(e if isinstance(e, Exception) else _LeaderCancelled())
+            # 没有等待者时避免 "exception was never retrieved" 警告
+            future.exception()
+            raise
+        finally:
+            del self._async_calls[key]
+
+    def _do_remote(self, key, func):
+        token = self._try_lock(key)
+        if token is None:
+            outcome = self._wait_remote(key)
+            if outcome is not None:
+                return self._result(outcome), True
+            return func(), False
+        try:
+            result = func()
+        except Exception as e:
+            self._publish(key, token, {'error': str(e)})
+            raise
+        self._publish(key, token, {'result': result})
+        return result, False
+
+    def _try_lock(self, key):
+        """
+        Return a lock token if this worker should run the call, None if another
+        worker already is. Redis errors make every worker its own leader.
+        """
+        lock_key, _, _ = self._keys(key)
+        token = uuid.uuid4().hex
+        try:
+            if redis_client.set(lock_key, token, nx=True, px=int(Config.SINGLE_FLIGHT_LOCK_TTL * 1000)):
+                return token
+            return None
+        except Exception as e:
+            print(f"Single-flight lock error ({self.namespace}): {str(e)}")
+            return ''
+
+    def _publish(self, key, token, outcome):
+        if not token:
+            return
+        lock_key, result_key, channel = self._keys(key)
+        try:
+            message = json.dumps(outcome, ensure_ascii=False)
+            # 结果短暂保留，覆盖订阅前就已完成的竞态
+            redis_client.setex(result_key, Config.SINGLE_FLIGHT_RESULT_TTL, message)
+            redis_client.publish(channel, message)
+        except Exception as e:
+            print(f"Single-flight publish error ({self.namespace}): {str(e)}")
+        self._unlock(key, token)
+
+    def _unlock(self, key, token):
+        if not token:
+            return
+        lock_key, _, _ = self._keys(key)
+        try:
+            if self._release is None:
+                self._release = redis_client.register_script(RELEASE_SCRIPT)
+            self._release(keys=[lock_key], args=[token])
+        except Exception as e:
+            print(f"Single-flight unlock error ({self.namespace}): {str(e)}")
+
+    @staticmethod
+    def _result(outcome):
+        if 'error' in outcome:
+            raise Exception(outcome['error'])
+        return outcome['result']
+
+    def _wait_remote(self, key):
+        """
+        Wait for the leading worker's outcome ({'result'} or {'error'}). Returns None
+        when the leader vanished, timed out or Redis failed, so the caller runs it itself.
+        """
+        lock_key, result_key, channel = self._keys(key)
+        pubsub = None
+        try:
+            pubsub = redis_client.pubsub(ignore_subscribe_messages=True)
+            pubsub.subscribe(channel)
+            deadline = time.time() + Config.SINGLE_FLIGHT_WAIT_TIMEOUT
+            while time.time() < deadline:
+                cached = redis_client.get(result_key)
+                if cached is not None:
+                    return json.loads(cached)
+                message = pubsub.get_message(timeout=1.0)
+                if message and message['type'] == 'message':
+                    return json.loads(message['data'])
+                if not redis_client.exists(lock_key) and redis_client.get(result_key) is None:
+                    # leader 异常退出，锁已过期
+                    return None
+            print(f"Single-flight wait timed out ({self.namespace}), calling upstream directly")
+            return None
+        except redis.RedisError as e:
+            print(f"Single-flight wait error ({self.namespace}): {str(e)}")
+            return None
+        finally:
+            if pubsub is not None:
+                try:
+                    pubsub.close()
+                except Exception:
+                    pass
@@ -0,0 +1,115 @@
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from ..config import Config
+
+# TTS 调用是阻塞的，放到共享线程池中与 LLM 流并行执行
+tts_executor = ThreadPoolExecutor(max_workers=Config.TTS_PIPELINE_WORKERS, thread_name_prefix='tts-pipeline')
+
+class SentenceSplitter:
+    """
+    Incrementally cut streamed text into complete sentences
+    """
+    TERMINATORS = '。！？!?；;\n'
+    CLOSERS = '"\'”’）)」』'
+
+    def __init__(self, min_chars=None):
+        self.min_chars = min_chars if min_chars is not None else Config.TTS_MIN_SEGMENT_CHARS
+        self.buffer = ''
+
+    def _is_boundary(self, index):
+        char = self.buffer[index]
+        if char in self.TERMINATORS:
+            return True
+        # 英文句号后面跟空白才算句末，避免切开小数和缩写
+        return char == '.' and index + 1 < len(self.buffer) and self.buffer[index + 1].isspace()
+
+    def feed(self, text):
+        """
+        Add streamed text; return the sentences completed by it
+        """
+        self.buffer += text
+        sentences = []
+        start = 0
+        index = 0
+        while index < len(self.buffer):
+            if not self._is_boundary(index):
+                index += 1
+                continue
+            end = index + 1
+            while end < len(self.buffer) and self.buffer[end] in self.TERMINATORS + self.CLOSERS:
+                end += 1
+            sentence = self.buffer[start:end].strip()
+            # 过短的句子并入下一句，减少 TTS 调用次数
+            if len(sentence) >= self.min_chars:
+                sentences.append(sentence)
+                start = end
+            index = end
+        self.buffer = self.buffer[start:]
+        return sentences
+
+    def flush(self):
+        """
+        Return whatever text is left once the stream has ended
+        """
+        rest = self.buffer.strip()
+        self.buffer = ''
+        return rest
+
+class SpeechPipeline:
+    """
+    Synthesize sentences concurrently and hand the audio back in order
+    """
+    def __init__(self, tts_service, audio_format, voice=None):
+        self.tts_service = tts_service
+        self.audio_format = audio_format
+        self.voice = voice
+        self.splitter = SentenceSplitter()
+        self.pending = deque()
+        self.next_index = 0
+
+    def _submit(self, sentence):
+        future = tts_executor.submit(self.tts_service.text_to_speech_sync, sentence, self.voice, self.audio_format)
+        self.pending.append((self.next_index, sentence, future))
+        self.next_index += 1
+
+    def feed(self, text):
+        for sentence in self.splitter.feed(text):
+            self._submit(sentence)
+
+    def finish(self):
+        rest = self.splitter.flush()
+        if rest:
+            self._submit(rest)
+
+    def _segment(self, index, sentence, future):
+        try:
+            audio_id = future.result()
+        except Exception as e:
+            print(f"TTS segment {index} error: {str(e)}")
+            return {'index': index, 'text': sentence, 'error': str(e)}
+        return {
+            'index': index,
+            'text': sentence,
+            'audio_id': audio_id,
+            'audio_url': f"/api/audio/{audio_id}",
+            'audio_format': self.audio_format
+        }
+
+    def ready(self):
+        """
+        Yield finished segments without blocking, stopping at the first unfinished one
+        """
+        while self.pending and self.pending[0][2].done():
+            yield self._segment(*self.pending.popleft())
+
+    def drain(self):
+        """
+        Block until every remaining segment is synthesized, yielding in order
+        """
+        while self.pending:
+            yield self._segment(*self.pending.popleft())
+
+    def cancel(self):
+        # 已开始的合成无法中断，只取消尚未开始的任务
+        while self.pending:
+            self.pending.popleft()[2].cancel()
@@ -0,0 +1,44 @@
+import re
+
+# tiktoken 是可选依赖，不可用时按字符数估算
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+CJK_PATTERN = re.compile(r'[　-〿぀-ヿ㐀-䶿一-鿿가-힯＀-￯]')
+MESSAGE_OVERHEAD = 4  # role/分隔符等每条消息的固定开销
+
+_encoding = None
+_encoding_failed = False
+
+def _get_encoding():
+    global _encoding, _encoding_failed
+    if _encoding is None and tiktoken is not None and not _encoding_failed:
+        try:
+            _encoding = tiktoken.get_encoding('o200k_base')
+        except Exception as e:
+            print(f"⚠️ tiktoken encoding unavailable, using estimate: {str(e)}")
+            _encoding_failed = True
+    return _encoding
+
+def count_tokens(text):
+    """
+    Token count of a text (exact with tiktoken, otherwise a CJK-aware estimate)
+    """
+    if not text:
+        return 0
+    encoding = _get_encoding()
+    if encoding is not None:
+        return len(encoding.encode(text))
+    cjk = len(CJK_PATTERN.findall(text))
+    return cjk + (len(text) - cjk + 3) // 4
+
+def message_tokens(message):
+    """
+    Tokens a chat message costs in a prompt, reusing a stored count when present
+    """
+    token_count = message.get('token_count')
+    if token_count is None:
+        token_count = count_tokens(message.get('content'))
+    return token_count + MESSAGE_OVERHEAD
@@ -1,40 +1,153 @@
 import edge_tts
 import asyncio
-import tempfile
-import os
-from flask import current_app
+import hashlib
+import shutil
+from app.extension import audio_store, redis_client
+from .limits import bulkheads
+from ..config import Config
+
+# 可选输出格式：edge-tts 固定输出 mp3，Opus 格式通过 ffmpeg 转码得到
+AUDIO_FORMATS = {
+    'mp3': {
+        'mimetype': 'audio/mpeg',
+        'extension': '.mp3',
+        'ffmpeg_args': None
+    },
+    'webm': {
+        'mimetype': 'audio/webm',
+        'extension': '.webm',
+        'ffmpeg_args': ['-c:a', 'libopus', '-application', 'voip', '-f', 'webm']
+    },
+    'ogg': {
+        'mimetype': 'audio/ogg',
+        'extension': '.ogg',
+        'ffmpeg_args': ['-c:a', 'libopus', '-application', 'voip', '-f', 'ogg']
+    },
+}
+
+# 客户端同时支持时优先选择体积更小的格式
+FORMAT_PREFERENCE = ['webm', 'ogg', 'mp3']
 
 class TTSService:
     def __init__(self):
         self.voice = 'zh-CN-XiaoxiaoNeural'  # 默认中文声音
+        self.ffmpeg_path = shutil.which(Config.FFMPEG_BINARY)
+        if not self.ffmpeg_path:
+            print("⚠️ ffmpeg not available - TTS will only produce mp3")
         
-    async def text_to_speech(self, text: str, voice: str = None) -> str:
+    def supported_formats(self):
+        """
+        当前环境可以生成的输出格式
         """
-        将文本转换为语音并返回音频文件路径
+        return [fmt for fmt, spec in AUDIO_FORMATS.items() if not spec['ffmpeg_args'] or self.ffmpeg_path]
+    
+    def negotiate_format(self, accept_mimetypes=None, requested: str = None) -> str:
+        """
+        根据显式参数或 Accept 头选择输出格式，通配符 */* 不算作支持 Opus
+        """
+        supported = self.supported_formats()
+        if requested:
+            requested = requested.lower()
+            if requested in supported:
+                return requested
+        
+        if accept_mimetypes:
+            accepted = set()
+            for value, quality in accept_mimetypes:
+                if quality > 0:
+                    accepted.add(value.split(';')[0].strip().lower())
+            for fmt in FORMAT_PREFERENCE:
+                if fmt in supported and AUDIO_FORMATS[fmt]['mimetype'] in accepted:
+                    return fmt
+        
+        default_format = Config.TTS_DEFAULT_FORMAT
+        return default_format if default_format in supported else 'mp3'
+    
+    @staticmethod
+    def _cache_key(text: str, voice: str, audio_format: str) -> str:
+        # 同一段文本的每种格式分别缓存
+        digest = hashlib.sha256(f"{voice}|{audio_format}|{text}".encode('utf-8')).hexdigest()
+        return f"tts:cache:{audio_format}:{digest}"
+    
+    def _cache_get(self, cache_key: str):
+        try:
+            audio_id = redis_client.get(cache_key)
+        except Exception as e:
+            print(f"TTS cache read error: {str(e)}")
+            return None
+        if not audio_id:
+            return None
+        path = audio_store.resolve(audio_id)
+        if not path:
+            return None
+        audio_store.touch(path)
+        return audio_id
+    
+    def _cache_set(self, cache_key: str, audio_id: str):
+        try:
+            redis_client.setex(cache_key, audio_store.ttl_seconds, audio_id)
+        except Exception as e:
+            print(f"TTS cache write error: {str(e)}")
+    
+    async def _transcode(self, source_path: str, target_path: str, audio_format: str):
+        args = [
+            self.ffmpeg_path, '-nostdin', '-loglevel', 'error', '-y',
+            '-i', source_path,
+            '-ac', '1', '-b:a', Config.TTS_OPUS_BITRATE,
+            *AUDIO_FORMATS[audio_format]['ffmpeg_args'],
+            target_path
+        ]
+        process = await asyncio.create_subprocess_exec(
+            *args,
+            stdout=asyncio.subprocess.DEVNULL,
+            stderr=asyncio.subprocess.PIPE
+        )
+        _, stderr = await process.communicate()
+        if process.returncode != 0:
+            raise Exception(f"ffmpeg transcode failed: {stderr.decode('utf-8', 'ignore').strip()}")
+    
+    async def text_to_speech(self, text: str, voice: str = None, audio_format: str = 'mp3') -> str:
+        """
+        将文本转换为语音，写入音频存储并返回音频ID
         """
         if not voice:
             voice = self.voice
+        if audio_format not in self.supported_formats():
+            raise ValueError(f"Unsupported audio format: {audio_format}")
+        
+        cache_key = self._cache_key(text, voice, audio_format)
+        cached_id = self._cache_get(cache_key)
+        if cached_id:
+            return cached_id
             
-        # 创建临时文件
-        temp_file = tempfile.NamedTemporaryFile(delete=False, suffix='.mp3')
-        output_path = temp_file.name
-        temp_file.close()
+        # 先写入 .part 文件，完成后再原子性地发布
+        spec = AUDIO_FORMATS[audio_format]
+        audio_id, partial_path, final_path = audio_store.allocate(spec['extension'])
+        source_path = final_path + '.src' + audio_store.PARTIAL_SUFFIX if spec['ffmpeg_args'] else partial_path
         
         try:
             communicate = edge_tts.Communicate(text, voice)
-            await communicate.save(output_path)
-            return output_path
+            await communicate.save(source_path)
+            if spec['ffmpeg_args']:
+                await self._transcode(source_path, partial_path, audio_format)
+            audio_store.publish(partial_path, final_path)
         except Exception as e:
             # 如果创建失败，删除临时文件
-            if os.path.exists(output_path):
-                os.unlink(output_path)
+            audio_store.discard(partial_path)
             raise e
+        finally:
+            if source_path != partial_path:
+                audio_store.discard(source_path)
+        
+        self._cache_set(cache_key, audio_id)
+        return audio_id
     
-    def text_to_speech_sync(self, text: str, voice: str = None) -> str:
+    def text_to_speech_sync(self, text: str, voice: str = None, audio_format: str = 'mp3') -> str:
         """
         同步版本的文本转语音
         """
-        return asyncio.run(self.text_to_speech(text, voice))
+        with bulkheads['tts'].slot():
+            return asyncio.run(self.text_to_speech(text, voice, audio_format))
     
     @staticmethod
     def get_available_voices():
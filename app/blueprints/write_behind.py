@@ -0,0 +1,261 @@
+import atexit
+import json
+import os
+import socket
+import threading
+import time
+from collections import deque
+from datetime import datetime
+from sqlalchemy import insert, update
+from app.extension import db, redis_client
+from app.models import Conversation, ChatMessage
+
+class ChatWriteBehind:
+    """
+    Queue chat turns off the response path and persist them in batched inserts.
+    'memory' mode keeps the queue in this process; 'redis' mode appends to a
+    Redis stream read through a consumer group, so a crashed worker's turns are
+    picked up by another one. 'off' writes synchronously.
+    """
+    GROUP = 'chat-persisters'
+    # 刚提交的行在 pending_for 里再保留一会儿，覆盖读者事务快照早于提交的情况
+    RECENT_SECONDS = 5
+
+    def __init__(self):
+        self.app = None
+        self.mode = 'off'
+        self._queue = deque()
+        # 已出队、正在写入的批次，以及刚提交的行（written_at, row）
+        self._inflight = []
+        self._recent = deque()
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stop_event = threading.Event()
+        self._flush_lock = threading.Lock()
+        self._thread = None
+        self._thread_pid = None
+        self._listeners = []
+        self._group_ready = False
+
+    def init_app(self, app):
+        self.app = app
+        self.mode = app.config.get('CHAT_WRITE_BEHIND', 'memory')
+        self.interval = app.config.get('CHAT_WRITE_BEHIND_INTERVAL', 1.0)
+        self.batch_size = app.config.get('CHAT_WRITE_BEHIND_BATCH', 200)
+        self.stream = app.config.get('CHAT_WRITE_BEHIND_STREAM', 'chat:writebehind')
+        self.max_queue = app.config.get('CHAT_WRITE_BEHIND_MAX_QUEUE', 10000)
+        if self.enabled:
+            atexit.register(self.shutdown)
+
+    @property
+    def enabled(self):
+        return self.mode in ('memory', 'redis')
+
+    def add_listener(self, callback):
+        """
+        callback(conversation_ids) runs inside the app context after each committed flush
+        """
+        self._listeners.append(callback)
+
+    def enqueue(self, conversation_id, messages):
+        """
+        Queue messages (with token_count already computed) for persistence
+        """
+        now = datetime.utcnow()
+        rows = [
+            {
+                'conversation_id': conversation_id,
+                'role': message['role'],
+                'content': message['content'],
+                'token_count': message['token_count'],
+                'created_at': now
+            }
+            for message in messages
+        ]
+        if self.mode == 'redis':
+            try:
+                redis_client.xadd(self.stream, {'rows': json.dumps(rows, ensure_ascii=False, default=str)})
+            except Exception as e:
+                # Redis 不可用时退回进程内队列，不丢失消息
+                print(f"Write-behind stream error, queueing in memory: {str(e)}")
+                self._push(rows)
+        else:
+            self._push(rows)
+        self._ensure_thread()
+
+    def _push(self, rows):
+        with self._lock:
+            overflow = len(self._queue) + len(rows) > self.max_queue
+            if not overflow:
+                self._queue.extend(rows)
+            full = len(self._queue) >= self.batch_size
+        if full:
+            self._wakeup.set()
+        if overflow:
+            # 队列已满：在调用方线程同步写入，数据库不可用时由调用方处理异常，而不是无限堆积
+            print(f"Write-behind queue full ({self.max_queue}), writing {len(rows)} messages synchronously")
+            self._write(rows)
+
+    def pending_for(self, conversation_id):
+        """
+        Messages of a conversation not yet visible in chat_messages to every reader:
+        still queued, being written, or committed within the last RECENT_SECONDS
+        (callers drop the ones their own query already returned), oldest first
+        """
+        with self._lock:
+            self._expire_recent()
+            rows = [row for _, row in self._recent] + self._inflight + list(self._queue)
+            return [dict(row) for row in rows if row['conversation_id'] == conversation_id]
+
+    def _expire_recent(self):
+        # 调用方持有 self._lock
+        cutoff = time.time() - self.RECENT_SECONDS
+        while self._recent and self._recent[0][0] < cutoff:
+            self._recent.popleft()
+
+    def _ensure_thread(self):
+        # 线程不会跨 fork 继承，每个 worker 首次使用时启动自己的 flusher
+        if self._thread is not None and self._thread.is_alive() and self._thread_pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive() and self._thread_pid == os.getpid():
+                return
+            self._stop_event = threading.Event()
+            self._thread = threading.Thread(target=self._run, name='chat-write-behind', daemon=True)
+            self._thread_pid = os.getpid()
+            self._thread.start()
+
+    def _run(self):
+        while not self._stop_event.is_set():
+            self._wakeup.wait(self.interval)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"Write-behind flush error: {str(e)}")
+
+    def flush(self):
+        """
+        Write everything queued so far; returns the number of rows persisted
+        """
+        with self._flush_lock, self.app.app_context():
+            try:
+                written = self._flush_memory()
+                if self.mode == 'redis':
+                    written += self._flush_stream()
+                return written
+            finally:
+                db.session.remove()
+
+    def _flush_memory(self):
+        written = 0
+        while True:
+            # 出队的批次在提交前一直留在 _inflight，读者不会在两者之间看不到它
+            with self._lock:
+                batch = [self._queue.popleft() for _ in range(min(self.batch_size, len(self._queue)))]
+                self._inflight = batch
+            if not batch:
+                return written
+            try:
+                self._write(batch)
+            except Exception:
+                # 写入失败时放回队首，下次重试
+                with self._lock:
+                    self._queue.extendleft(reversed(batch))
+                    self._inflight = []
+                raise
+            with self._lock:
+                self._expire_recent()
+                now = time.time()
+                self._recent.extend((now, row) for row in batch)
+                self._inflight = []
+            written += len(batch)
+
+    @property
+    def _consumer(self):
+        return f"{socket.gethostname()}-{os.getpid()}"
+
+    def _flush_stream(self):
+        if not self._group_ready:
+            try:
+                redis_client.xgroup_create(self.stream, self.GROUP, id='0', mkstream=True)
+            except Exception as e:
+                if 'BUSYGROUP' not in str(e):
+                    raise
+            self._group_ready = True
+
+        written = 0
+        # 先认领崩溃 worker 遗留的未确认消息（XAUTOCLAIM 需要 Redis 6.2+），再读取新消息
+        try:
+            _, claimed, *_ = redis_client.xautoclaim(
+                self.stream, self.GROUP, self._consumer,
+                min_idle_time=int(max(self.interval * 10, 30) * 1000), count=self.batch_size
+            )
+            entries = list(claimed)
+        except Exception as e:
+            print(f"Write-behind claim skipped: {str(e)}")
+            entries = []
+        while True:
+            if not entries:
+                response = redis_client.xreadgroup(self.GROUP, self._consumer, {self.stream: '>'}, count=self.batch_size)
+                entries = response[0][1] if response else []
+            if not entries:
+                return written
+            rows = []
+            for _, fields in entries:
+                for row in json.loads(fields['rows']):
+                    row['created_at'] = datetime.fromisoformat(row['created_at'])
+                    rows.append(row)
+            self._write(rows)
+            ids = [entry_id for entry_id, _ in entries]
+            redis_client.xack(self.stream, self.GROUP, *ids)
+            redis_client.xdel(self.stream, *ids)
+            written += len(rows)
+            entries = []
+
+    def _write(self, rows):
+        conversation_ids = {row['conversation_id'] for row in rows}
+        # 排队期间被删除的会话，其消息直接丢弃，避免外键错误卡住整个批次
+        existing = {
+            conversation_id for (conversation_id,) in
+            db.session.query(Conversation.id).filter(Conversation.id.in_(conversation_ids))
+        }
+        dropped = len([row for row in rows if row['conversation_id'] not in existing])
+        if dropped:
+            print(f"Write-behind dropped {dropped} messages of deleted conversations")
+        rows = [row for row in rows if row['conversation_id'] in existing]
+        if not rows:
+            return
+        try:
+            db.session.execute(insert(ChatMessage), rows)
+            db.session.execute(
+                update(Conversation)
+                .where(Conversation.id.in_(existing))
+                .values(updated_at=datetime.utcnow())
+            )
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        for callback in self._listeners:
+            try:
+                callback(sorted(existing))
+            except Exception as e:
+                print(f"Write-behind listener error: {str(e)}")
+
+    def shutdown(self):
+        """
+        Stop the flusher and write whatever is still queued (atexit / ASGI shutdown)
+        """
+        self._stop_event.set()
+        self._wakeup.set()
+        if self.app is None or not self.enabled:
+            return
+        try:
+            written = self.flush()
+            if written:
+                print(f"Write-behind flushed {written} messages on shutdown")
+        except Exception as e:
+            print(f"Write-behind shutdown flush failed: {str(e)}")
+
+chat_writer = ChatWriteBehind()
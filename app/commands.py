@@ -0,0 +1,285 @@
+# Flask CLI commands (flask --app run <command>)
+
+import asyncio
+import json
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import click
+import httpx
+from flask.cli import with_appcontext
+from flask_jwt_extended import create_access_token
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+from app.models import UserModel, Conversation, ChatMessage
+from app.blueprints.query_checks import scratch_database, seed, plan_problems, render_counts
+from app.config import Config
+
+@click.command('explain-check')
+@click.option('--url', envvar='EXPLAIN_CHECK_DATABASE_URL', default='sqlite://',
+              help='Empty scratch database to migrate and seed (default: in-memory SQLite).')
+@click.option('--users', default=50, show_default=True)
+@click.option('--conversations', default=40, show_default=True, help='Conversations per user.')
+@click.option('--messages', default=10, show_default=True, help='Messages per conversation.')
+@click.option('--posts', default=40, show_default=True, help='Community posts per user.')
+@click.option('--keep', is_flag=True, help='Leave the seeded tables in place afterwards.')
+@with_appcontext
+def explain_check(url, users, conversations, messages, posts, keep):
+    """
+    Migrate and seed a scratch database, EXPLAIN the hot queries, fail on full scans,
+    filesorts or pages that need more queries to render than their budget.
+    """
+    failed = False
+    try:
+        with scratch_database(url, keep) as connection:
+            seed(connection, users, conversations, messages, posts)
+            click.echo(f"Seeded {users} users, {users * conversations} conversations, "
+                       f"{users * conversations * messages} messages, {users * posts} posts ({connection.dialect.name})")
+
+            for name, plan, problems in plan_problems(connection):
+                click.echo(f"{'❌' if problems else '✅'} {name}")
+                for line in plan:
+                    click.echo(f"    {line}")
+                failed = failed or bool(problems)
+
+            for name, count, rows, budget in render_counts(connection):
+                click.echo(f"{'❌' if count > budget else '✅'} {name}: {rows} rows rendered in {count} queries (max {budget})")
+                failed = failed or count > budget
+    except ValueError as e:
+        raise click.ClickException(str(e))
+    if failed:
+        raise click.ClickException('Hot queries regressed to a full scan, filesort or per-row queries')
+
+def _create_one_by_one(session, user_id, messages):
+    # 改动前的写法：先提交会话，再逐个 ORM 对象插入消息，第二次提交
+    conversation = Conversation(user_id=user_id, title='bench', content='bench', date='2026-01-01')
+    session.add(conversation)
+    session.commit()
+    for message in messages:
+        session.add(ChatMessage(conversation_id=conversation.id, role=message['role'], content=message['content']))
+    session.commit()
+
+def _create_batched(session, user_id, messages):
+    # POST /conversations 现在的写法：flush 取 id，一次批量插入，一个事务
+    conversation = Conversation(user_id=user_id, title='bench', content='bench', date='2026-01-01')
+    session.add(conversation)
+    session.flush()
+    ChatMessage.insert_many(conversation.id, messages, session=session)
+    session.commit()
+
+@click.command('bench-create')
+@click.option('--url', envvar='EXPLAIN_CHECK_DATABASE_URL', default='sqlite://',
+              help='Empty scratch database to migrate (default: in-memory SQLite).')
+@click.option('--messages', default=1000, show_default=True, help='Messages in each created conversation.')
+@click.option('--runs', default=5, show_default=True)
+@with_appcontext
+def bench_create(url, messages, runs):
+    """
+    Time creating a conversation with a large message payload: per-object inserts
+    with two commits (the old code) against ChatMessage.insert_many in one transaction.
+    """
+    payload = [
+        {'role': 'user' if n % 2 == 0 else 'assistant', 'content': f'今天天气很好，我们去公园散步。第 {n} 条消息。' * 3}
+        for n in range(messages)
+    ]
+    try:
+        with scratch_database(url) as connection:
+            connection.execute(UserModel.__table__.insert(), [
+                {'id': 1, 'name': 'bench', 'email': 'bench@example.com', 'password_hash': '-', 'created_at': datetime.utcnow()}
+            ])
+            connection.commit()
+            executed = []
+
+            def record(conn, cursor, sql, parameters, context, executemany):
+                executed.append(sql)
+
+            click.echo(f"Creating a conversation with {messages} messages, {runs} runs each ({connection.dialect.name})")
+            event.listen(connection, 'before_cursor_execute', record)
+            try:
+                results = {}
+                # 交替运行，避免缓存预热只偏向其中一种
+                for _ in range(runs):
+                    for name, create in (('one by one', _create_one_by_one), ('insert_many', _create_batched)):
+                        executed.clear()
+                        with Session(bind=connection) as session:
+                            started = time.perf_counter()
+                            create(session, 1, payload)
+                            elapsed = time.perf_counter() - started
+                        results.setdefault(name, []).append((elapsed, len(executed)))
+            finally:
+                event.remove(connection, 'before_cursor_execute', record)
+    except ValueError as e:
+        raise click.ClickException(str(e))
+
+    for name, samples in results.items():
+        timings = sorted(elapsed for elapsed, _ in samples)
+        click.echo(f"  {name}: median {timings[len(timings) // 2] * 1000:.1f} ms, "
+                   f"best {timings[0] * 1000:.1f} ms, {samples[-1][1]} statements")
+
+class _StubUpstream(BaseHTTPRequestHandler):
+    """
+    OpenAI-compatible /chat/completions that answers after a fixed delay
+    """
+    protocol_version = 'HTTP/1.1'
+
+    def do_POST(self):
+        payload = json.loads(self.rfile.read(int(self.headers.get('Content-Length') or 0)) or b'{}')
+        time.sleep(self.server.latency)
+        body = json.dumps({
+            'id': 'bench', 'object': 'chat.completion', 'created': int(time.time()), 'model': payload.get('model'),
+            'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': 'ok'}, 'finish_reason': 'stop'}],
+            'usage': {'prompt_tokens': 1, 'completion_tokens': 1, 'total_tokens': 2}
+        }).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+class _StubServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 1024
+
+    def __init__(self, latency):
+        super().__init__(('127.0.0.1', 0), _StubUpstream)
+        self.latency = latency
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+def _wait_healthy(url, process, timeout=60):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise click.ClickException(f"{url} exited during startup (rerun with --server-logs)")
+        try:
+            if httpx.get(f"{url}/health", timeout=1).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.5)
+    raise click.ClickException(f"{url} did not become healthy in {timeout}s")
+
+async def _drive(url, path, token, total, concurrency):
+    """
+    Send `total` requests from `concurrency` clients; returns (seconds, latencies, status counts)
+    """
+    latencies, statuses = [], Counter()
+    remaining = iter(range(total))
+    headers = {'Authorization': f'Bearer {token}'}
+    # 每个模拟用户一个单连接客户端：httpx 单个大连接池在数百连接时分配请求是 O(n²)，会先把压测端压垮
+    ssl_context = httpx.create_ssl_context()
+    clients = [httpx.AsyncClient(base_url=url, headers=headers, timeout=120, verify=ssl_context) for _ in range(concurrency)]
+
+    async def client_loop(client):
+        for n in remaining:
+            # 每个请求内容不同，避免被 single-flight 合并或命中结果缓存
+            if path == '/api/chat':
+                payload = {'messages': [{'role': 'user', 'content': f'bench {n}'}]}
+            else:
+                payload = {'currentContent': '', 'text': f'bench {n}', 'force': True}
+            started = time.perf_counter()
+            try:
+                response = await client.post(path, json=payload)
+                statuses[response.status_code] += 1
+            except httpx.HTTPError as e:
+                statuses[type(e).__name__] += 1
+            latencies.append(time.perf_counter() - started)
+
+    try:
+        started = time.perf_counter()
+        await asyncio.gather(*[client_loop(client) for client in clients])
+        return time.perf_counter() - started, sorted(latencies), statuses
+    finally:
+        for client in clients:
+            await client.aclose()
+
+@click.command('bench-gateway')
+@click.option('--endpoint', type=click.Choice(['chat', 'regenerate-text']), default='chat', show_default=True)
+@click.option('--requests', 'total', default=1000, show_default=True)
+@click.option('--concurrency', default=200, show_default=True, help='Concurrent clients.')
+@click.option('--latency', default=0.5, show_default=True, help='Stub upstream response time in seconds.')
+@click.option('--threads', default=Config.ASGI_WSGI_THREADS, show_default=True, help='gunicorn threads for the WSGI server.')
+@click.option('--server-logs', is_flag=True, help='Show the servers\' output.')
+@with_appcontext
+def bench_gateway(endpoint, total, concurrency, latency, threads, server_logs):
+    """
+    Throughput of the LLM endpoints under concurrency: one uvicorn worker (asgi:app)
+    against one gunicorn gthread worker (run:app), both calling a local stub upstream
+    with a fixed latency. Uses the configured database and Redis; rate limits are off.
+    """
+    user = UserModel.query.order_by(UserModel.id).first()
+    if user is None:
+        raise click.ClickException('No users in the database; run flask db upgrade and start the app once')
+    token = create_access_token(identity=str(user.id))
+
+    upstream = _StubServer(latency)
+    threading.Thread(target=upstream.serve_forever, daemon=True).start()
+    upstream_url = f"http://127.0.0.1:{upstream.server_address[1]}"
+
+    # 两个服务都指向本地桩，并把并发上限放开到压测的并发数
+    env = dict(
+        os.environ, OPENROUTER_BASE_URL=upstream_url, GLM_BASE_URL=upstream_url, GPT_API_KEY='bench', CHAT_API_KEY='bench',
+        RATE_LIMIT_ENABLED='False', LLM_HEDGE_ENABLED='False',
+        LLM_MAX_CONCURRENT=str(concurrency), LLM_MAX_QUEUE=str(concurrency), LLM_POOL_SIZE=str(max(threads, Config.LLM_POOL_SIZE))
+    )
+    root = os.path.dirname(Config.MIGRATIONS_DIR)
+    output = None if server_logs else subprocess.DEVNULL
+    servers = {}
+    asgi_port, wsgi_port = _free_port(), _free_port()
+    argvs = {
+        'ASGI (uvicorn, 1 worker)': [sys.executable, '-m', 'uvicorn', 'asgi:app', '--host', '127.0.0.1',
+                                     '--port', str(asgi_port), '--workers', '1', '--no-access-log'],
+        f'WSGI (gunicorn, 1 worker x {threads} threads)': [sys.executable, '-m', 'gunicorn', 'run:app', '--bind',
+                                                           f'127.0.0.1:{wsgi_port}', '--workers', '1', '--worker-class',
+                                                           'gthread', '--threads', str(threads), '--timeout', '300'],
+    }
+    urls = dict(zip(argvs, [f'http://127.0.0.1:{asgi_port}', f'http://127.0.0.1:{wsgi_port}']))
+    results = {}
+    try:
+        for name, argv in argvs.items():
+            servers[name] = subprocess.Popen(argv, cwd=root, env=env, stdout=output, stderr=output)
+        for name, process in servers.items():
+            _wait_healthy(urls[name], process)
+
+        click.echo(f"POST /api/{endpoint}: {total} requests, {concurrency} concurrent clients, upstream latency {latency}s")
+        for name, url in urls.items():
+            # 预热：建立连接池、加载分词器
+            asyncio.run(_drive(url, f'/api/{endpoint}', token, min(concurrency, 20), min(concurrency, 20)))
+            elapsed, latencies, statuses = asyncio.run(_drive(url, f'/api/{endpoint}', token, total, concurrency))
+            results[name] = total / elapsed
+            p50 = latencies[len(latencies) // 2] * 1000
+            p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] * 1000
+            click.echo(f"  {name}: {results[name]:.1f} req/s, p50 {p50:.0f} ms, p99 {p99:.0f} ms, "
+                       f"status {dict(sorted(statuses.items(), key=str))}")
+    finally:
+        for process in servers.values():
+            process.terminate()
+        for process in servers.values():
+            try:
+                process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+        upstream.shutdown()
+
+    if len(results) == 2:
+        asgi_rps, wsgi_rps = results.values()
+        # 理论上限：WSGI 约为 threads / latency，ASGI 约为 concurrency / latency
+        click.echo(f"ASGI/WSGI throughput: {asgi_rps / wsgi_rps:.1f}x "
+                   f"(bounds ~{threads / latency:.0f} vs ~{concurrency / latency:.0f} req/s)")
+
+def register_commands(app):
+    app.cli.add_command(explain_check)
+    app.cli.add_command(bench_gateway)
+    app.cli.add_command(bench_create)
@@ -1,6 +1,7 @@
 import os
 from dotenv import load_dotenv
 from datetime import timedelta
+import tempfile
 
 # Load environment variables
 load_dotenv()
@@ -35,7 +36,11 @@ class Config:
     PASSWORD = "0119"
     DATABASE = "message"
     DB_URI = f"mysql+pymysql://{USERNAME}:{PASSWORD}@{HOSTNAME}:{PORT}/{DATABASE}?charset=utf8mb4"
-    SQLALCHEMY_DATABASE_URI = DB_URI
+    SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL') or DB_URI
+    
+    # 表结构由 migrations/ 管理（flask --app run db upgrade）；仅本地快速启动时打开 create_all
+    DB_AUTO_CREATE = os.environ.get('DB_AUTO_CREATE', 'False').lower() == 'true'
+    MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'migrations')
     
     # Redis 配置
     REDIS_HOST = "127.0.0.1"
@@ -52,6 +57,153 @@ class Config:
     TEXT_REGENERATION_API_KEY = os.getenv('TEXT_REGENERATION_API_KEY')
     GPT_API_KEY = os.getenv('GPT_API_KEY')
 
+    # Server-side chat history (Redis hot cache, chat_messages as source of truth)
+    CHAT_HISTORY_LIMIT = int(os.environ.get('CHAT_HISTORY_LIMIT') or 40)
+    CHAT_HISTORY_TTL = int(os.environ.get('CHAT_HISTORY_TTL') or 3600)
+    # Prompt token budget (system prompt + summary + recent turns + new turn)
+    CHAT_CONTEXT_TOKEN_BUDGET = int(os.environ.get('CHAT_CONTEXT_TOKEN_BUDGET') or 4000)
+    CHAT_SUMMARY_MIN_TOKENS = int(os.environ.get('CHAT_SUMMARY_MIN_TOKENS') or 500)
+    CHAT_SUMMARY_CHUNK_TOKENS = int(os.environ.get('CHAT_SUMMARY_CHUNK_TOKENS') or 3000)
+
+    # Keyset pagination for list endpoints (?limit=&cursor=)
+    PAGE_SIZE_DEFAULT = int(os.environ.get('PAGE_SIZE_DEFAULT') or 50)
+    PAGE_SIZE_MAX = int(os.environ.get('PAGE_SIZE_MAX') or 200)
+
+    # Public community feed: first pages cached pre-serialised in Redis, invalidated on writes
+    COMMUNITY_FEED_CACHE_ENABLED = os.environ.get('COMMUNITY_FEED_CACHE_ENABLED', 'True').lower() == 'true'
+    COMMUNITY_FEED_CACHE_TTL = int(os.environ.get('COMMUNITY_FEED_CACHE_TTL') or 30)
+    # 缓存失效后只让一个请求重建首页，与 SINGLE_FLIGHT_ENABLED 无关
+    COMMUNITY_FEED_SINGLE_FLIGHT = os.environ.get('COMMUNITY_FEED_SINGLE_FLIGHT', 'True').lower() == 'true'
+
+    # Full-text search over diaries and chat messages (GET /api/search)
+    SEARCH_SNIPPET_CHARS = int(os.environ.get('SEARCH_SNIPPET_CHARS') or 120)
+    SEARCH_MAX_TERMS = int(os.environ.get('SEARCH_MAX_TERMS') or 8)
+
+    # Write-behind persistence of chat turns: 'memory', 'redis' (stream) or 'off'
+    CHAT_WRITE_BEHIND = os.environ.get('CHAT_WRITE_BEHIND') or 'memory'
+    CHAT_WRITE_BEHIND_INTERVAL = float(os.environ.get('CHAT_WRITE_BEHIND_INTERVAL') or 1.0)
+    CHAT_WRITE_BEHIND_BATCH = int(os.environ.get('CHAT_WRITE_BEHIND_BATCH') or 200)
+    CHAT_WRITE_BEHIND_STREAM = os.environ.get('CHAT_WRITE_BEHIND_STREAM') or 'chat:writebehind'
+    # 进程内队列上限；排满时（数据库变慢或不可用）直接同步写入
+    CHAT_WRITE_BEHIND_MAX_QUEUE = int(os.environ.get('CHAT_WRITE_BEHIND_MAX_QUEUE') or 10000)
+
+    # "Related memories": per-user vector index over diary content fed into chat context
+    MEMORY_INDEX_ENABLED = os.environ.get('MEMORY_INDEX_ENABLED', 'True').lower() == 'true'
+    MEMORY_EMBEDDER = os.environ.get('MEMORY_EMBEDDER') or 'hashing'  # or 'package.module:ClassName'
+    MEMORY_EMBED_DIM = int(os.environ.get('MEMORY_EMBED_DIM') or 256)
+    MEMORY_INDEX_DIR = os.environ.get('MEMORY_INDEX_DIR') or os.path.join(tempfile.gettempdir(), 'ora_memory')
+    MEMORY_CHUNK_CHARS = int(os.environ.get('MEMORY_CHUNK_CHARS') or 400)
+    MEMORY_EXCERPT_CHARS = int(os.environ.get('MEMORY_EXCERPT_CHARS') or 200)
+    MEMORY_TOP_K = int(os.environ.get('MEMORY_TOP_K') or 3)
+    MEMORY_MIN_SCORE = float(os.environ.get('MEMORY_MIN_SCORE') or 0.15)
+    MEMORY_CONTEXT_TOKENS = int(os.environ.get('MEMORY_CONTEXT_TOKENS') or 300)
+
+    # /api/regenerate-text result cache (in-process LRU + Redis)
+    REGENERATE_CACHE_SIZE = int(os.environ.get('REGENERATE_CACHE_SIZE') or 1024)
+    REGENERATE_CACHE_TTL = int(os.environ.get('REGENERATE_CACHE_TTL') or 86400)
+    # /api/regenerate-text/batch: items per request and per-request parallelism
+    REGENERATE_BATCH_MAX_ITEMS = int(os.environ.get('REGENERATE_BATCH_MAX_ITEMS') or 20)
+    REGENERATE_BATCH_CONCURRENCY = int(os.environ.get('REGENERATE_BATCH_CONCURRENCY') or 4)
+    REGENERATE_BATCH_WORKERS = int(os.environ.get('REGENERATE_BATCH_WORKERS') or 16)
+
+    # LLM provider endpoints (overridable to point at a proxy or a local stub)
+    OPENROUTER_BASE_URL = os.environ.get('OPENROUTER_BASE_URL') or 'https://openrouter.ai/api/v1'
+    GLM_BASE_URL = os.environ.get('GLM_BASE_URL') or 'https://open.bigmodel.cn/api/paas/v4'
+
+    # LLM HTTP connection pools (shared per process)
+    LLM_POOL_SIZE = int(os.environ.get('LLM_POOL_SIZE') or 20)
+    LLM_CONNECT_TIMEOUT = float(os.environ.get('LLM_CONNECT_TIMEOUT') or 5)
+    LLM_READ_TIMEOUT = float(os.environ.get('LLM_READ_TIMEOUT') or 30)
+    LLM_KEEPALIVE_EXPIRY = float(os.environ.get('LLM_KEEPALIVE_EXPIRY') or 60)
+    LLM_HTTP2 = os.environ.get('LLM_HTTP2', 'True').lower() == 'true'
+    # ASGI serving path: async pools can hold far more in-flight calls per worker
+    LLM_ASYNC_POOL_SIZE = int(os.environ.get('LLM_ASYNC_POOL_SIZE') or 1000)
+    ASGI_WSGI_THREADS = int(os.environ.get('ASGI_WSGI_THREADS') or 10)
+
+    # Provider routing across the LLM backends (latency/error aware, optional hedging)
+    LLM_PROVIDERS = [name.strip() for name in (os.environ.get('LLM_PROVIDERS') or 'openrouter,glm').split(',') if name.strip()]
+    LLM_ROUTER_WINDOW = int(os.environ.get('LLM_ROUTER_WINDOW') or 50)
+    LLM_ROUTER_MIN_SAMPLES = int(os.environ.get('LLM_ROUTER_MIN_SAMPLES') or 5)
+    LLM_ROUTER_ERROR_THRESHOLD = float(os.environ.get('LLM_ROUTER_ERROR_THRESHOLD') or 0.5)
+    LLM_ROUTER_COOLDOWN = float(os.environ.get('LLM_ROUTER_COOLDOWN') or 30)
+    # 对冲在异步客户端上进行，落后的请求会被取消；已经生成的 token 仍可能被上游计费
+    LLM_HEDGE_ENABLED = os.environ.get('LLM_HEDGE_ENABLED', 'False').lower() == 'true'
+    LLM_HEDGE_PERCENTILE = int(os.environ.get('LLM_HEDGE_PERCENTILE') or 90)
+    LLM_HEDGE_MIN_DELAY = float(os.environ.get('LLM_HEDGE_MIN_DELAY') or 0.5)
+    LLM_HEDGE_MAX_DELAY = float(os.environ.get('LLM_HEDGE_MAX_DELAY') or 10)
+
+    # Model tiers per provider: short/simple requests go to the fast tier
+    LLM_MODELS = {
+        'openrouter': {
+            'fast': os.environ.get('OPENROUTER_FAST_MODEL') or 'openai/gpt-4o-mini',
+            'standard': os.environ.get('OPENROUTER_STANDARD_MODEL') or 'openai/gpt-4o'
+        },
+        'glm': {
+            'fast': os.environ.get('GLM_FAST_MODEL') or 'glm-4-flash',
+            'standard': os.environ.get('GLM_STANDARD_MODEL') or 'glm-4-plus'
+        },
+    }
+    LLM_TIERING_ENABLED = os.environ.get('LLM_TIERING_ENABLED', 'True').lower() == 'true'
+    # 超过这些阈值（字符数 / 上下文 token）的请求使用标准模型
+    LLM_FAST_MAX_CHARS = {
+        'regenerate': int(os.environ.get('LLM_FAST_MAX_CHARS_REGENERATE') or 600),
+        'chat': int(os.environ.get('LLM_FAST_MAX_CHARS_CHAT') or 200),
+    }
+    LLM_FAST_MAX_CONTEXT_TOKENS = int(os.environ.get('LLM_FAST_MAX_CONTEXT_TOKENS') or 1500)
+
+    # Single-flight: identical in-flight LLM requests share one upstream call
+    SINGLE_FLIGHT_ENABLED = os.environ.get('SINGLE_FLIGHT_ENABLED', 'True').lower() == 'true'
+    SINGLE_FLIGHT_LOCK_TTL = float(os.environ.get('SINGLE_FLIGHT_LOCK_TTL') or 90)
+    SINGLE_FLIGHT_WAIT_TIMEOUT = float(os.environ.get('SINGLE_FLIGHT_WAIT_TIMEOUT') or 90)
+    SINGLE_FLIGHT_RESULT_TTL = int(os.environ.get('SINGLE_FLIGHT_RESULT_TTL') or 10)
+
+    # Audio store settings (TTS artifacts)
+    AUDIO_STORE_DIR = os.environ.get('AUDIO_STORE_DIR') or os.path.join(tempfile.gettempdir(), 'ora_audio')
+    AUDIO_TTL_SECONDS = int(os.environ.get('AUDIO_TTL_SECONDS') or 3600)
+    AUDIO_MAX_BYTES = int(os.environ.get('AUDIO_MAX_BYTES') or 512 * 1024 * 1024)
+    AUDIO_JANITOR_INTERVAL = int(os.environ.get('AUDIO_JANITOR_INTERVAL') or 300)
+    AUDIO_CACHE_MAX_AGE = int(os.environ.get('AUDIO_CACHE_MAX_AGE') or 3600)
+    # TTS output settings: Opus is transcoded with ffmpeg (edge-tts only emits mp3)
+    TTS_DEFAULT_FORMAT = os.environ.get('TTS_DEFAULT_FORMAT') or 'mp3'
+    TTS_OPUS_BITRATE = os.environ.get('TTS_OPUS_BITRATE') or '24k'
+    FFMPEG_BINARY = os.environ.get('FFMPEG_BINARY') or 'ffmpeg'
+    # Pipelined chat-to-speech: sentences are synthesized while the LLM streams
+    TTS_PIPELINE_WORKERS = int(os.environ.get('TTS_PIPELINE_WORKERS') or 4)
+    TTS_MIN_SEGMENT_CHARS = int(os.environ.get('TTS_MIN_SEGMENT_CHARS') or 8)
+    # 由前置的 nginx/apache 负责发送文件 (X-Sendfile)
+    USE_X_SENDFILE = os.environ.get('USE_X_SENDFILE', 'False').lower() == 'true'
+
+    # Upstream bulkheads: max in-flight calls per upstream plus a bounded wait queue
+    BULKHEADS = {
+        'llm': {
+            'max_concurrent': int(os.environ.get('LLM_MAX_CONCURRENT') or 32),
+            'max_queue': int(os.environ.get('LLM_MAX_QUEUE') or 64),
+            'queue_timeout': float(os.environ.get('LLM_QUEUE_TIMEOUT') or 5),
+            'retry_after': 2
+        },
+        'tts': {
+            'max_concurrent': int(os.environ.get('TTS_MAX_CONCURRENT') or 8),
+            'max_queue': int(os.environ.get('TTS_MAX_QUEUE') or 32),
+            'queue_timeout': float(os.environ.get('TTS_QUEUE_TIMEOUT') or 5),
+            'retry_after': 2
+        },
+        'asr': {
+            'max_concurrent': int(os.environ.get('ASR_MAX_CONCURRENT') or 2),
+            'max_queue': int(os.environ.get('ASR_MAX_QUEUE') or 8),
+            'queue_timeout': float(os.environ.get('ASR_QUEUE_TIMEOUT') or 10),
+            'retry_after': 5
+        },
+    }
+
+    # Per-user token buckets (rate requests per `per` seconds, bursts up to `burst`)
+    RATE_LIMIT_ENABLED = os.environ.get('RATE_LIMIT_ENABLED', 'True').lower() == 'true'
+    RATE_LIMITS = {
+        'chat': {'rate': 30, 'per': 60, 'burst': 10},
+        'regenerate': {'rate': 60, 'per': 60, 'burst': 20},
+        'transcribe': {'rate': 30, 'per': 60, 'burst': 10},
+        'voice_turn': {'rate': 20, 'per': 60, 'burst': 5},
+    }
+
     # Server settings
     HOST = os.environ.get('HOST') or 'localhost'
     PORT = int(os.environ.get('PORT') or 3002)
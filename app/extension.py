@@ -1,12 +1,16 @@
 from flask_sqlalchemy import SQLAlchemy
+from flask_migrate import Migrate
 from flask_jwt_extended import JWTManager
 from flask_mail import Mail
 import redis
 from .config import Config
+from .blueprints.audio_store import AudioStore
 
 db = SQLAlchemy()
+migrate = Migrate()
 jwt = JWTManager() 
 mail = Mail()
+audio_store = AudioStore()
 
 redis_client = redis.StrictRedis(
     host=Config.REDIS_HOST,
@@ -1,7 +1,11 @@
-# Defines database models (User, Conversation and ChatMessage)
+# Defines database models (User, Conversation, ChatMessage, ConversationSummary and CommunityPost)
 
 from datetime import datetime
+from sqlalchemy import event, insert, inspect, select
+from sqlalchemy.orm import Session, joinedload, object_session, selectinload
 from app.extension import db
+from app.blueprints.feed_cache import feed_cache
+from app.blueprints.tokens import count_tokens
 from werkzeug.security import generate_password_hash, check_password_hash
 
 class UserModel(db.Model):
@@ -44,20 +48,68 @@ class Conversation(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
+    # 与列表查询 WHERE user_id ORDER BY created_at, id 一致，避免 filesort（见 migrations/versions/0003）
+    __table_args__ = (
+        db.Index('ix_conversations_user_created', 'user_id', 'created_at', 'id'),
+        # 全文检索：MySQL 用 ngram 分词；SQLite 的 FTS5 表由 migrations/versions/0005 创建
+        db.Index('ft_conversations_title_content', 'title', 'content', mysql_prefix='FULLTEXT', mysql_with_parser='ngram').ddl_if(dialect='mysql'),
+    )
+    
     # Relationships
     messages = db.relationship('ChatMessage', backref=db.backref('conversation', lazy=True), lazy=True, cascade='all, delete-orphan')
+    summary = db.relationship('ConversationSummary', uselist=False, lazy=True, cascade='all, delete-orphan')
     
-    def to_dict(self):
-        return {
+    def to_dict(self, include_messages=True):
+        data = {
             'id': self.id,
             'user_id': self.user_id,
             'title': self.title,
             'content': self.content,
             'date': self.date,
             'created_at': self.created_at.isoformat(),
-            'updated_at': self.updated_at.isoformat(),
-            'messages': [message.to_dict() for message in self.messages]
+            'updated_at': self.updated_at.isoformat()
         }
+        if include_messages:
+            data['messages'] = [message.to_dict() for message in self.messages]
+        return data
+    
+    @staticmethod
+    def list_query(user_id):
+        """
+        (Conversation, message_count, last_message_at) rows of one user's conversations
+        """
+        # 消息数量和最后一条消息时间用关联子查询一次取回，不再逐个会话加载全部消息
+        message_count = db.session.query(db.func.count(ChatMessage.id)) \
+            .filter(ChatMessage.conversation_id == Conversation.id) \
+            .correlate(Conversation) \
+            .scalar_subquery()
+        last_message_at = db.session.query(db.func.max(ChatMessage.created_at)) \
+            .filter(ChatMessage.conversation_id == Conversation.id) \
+            .correlate(Conversation) \
+            .scalar_subquery()
+        return db.session.query(Conversation, message_count, last_message_at) \
+            .filter(Conversation.user_id == user_id)
+    
+    @staticmethod
+    def detail_query(conversation_id, user_id):
+        """
+        One of a user's conversations with its messages loaded in a single extra query
+        """
+        return Conversation.query.options(selectinload(Conversation.messages)) \
+            .filter_by(id=conversation_id, user_id=user_id)
+    
+    def to_list_dict(self, message_count, last_message_at):
+        """
+        List representation: message count and latest activity instead of the messages
+        """
+        data = self.to_dict(include_messages=False)
+        data['message_count'] = message_count or 0
+        data['last_message_at'] = last_message_at.isoformat() if last_message_at else None
+        return data
+
+def _default_token_count(context):
+    # 插入时计算一次（包括批量 insert），之后构建上下文直接复用
+    return count_tokens(context.get_current_parameters().get('content'))
 
 class ChatMessage(db.Model):
     __tablename__ = 'chat_messages'
@@ -66,8 +118,30 @@ class ChatMessage(db.Model):
     conversation_id = db.Column(db.Integer, db.ForeignKey('conversations.id'), nullable=False)
     role = db.Column(db.String(50), nullable=False)  # 'system', 'user', or 'assistant'
     content = db.Column(db.Text, nullable=False)
+    token_count = db.Column(db.Integer, nullable=True, default=_default_token_count)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     
+    # 历史加载按会话取最新消息；计数/最后时间子查询也只读这个索引
+    __table_args__ = (
+        db.Index('ix_chat_messages_conversation_created', 'conversation_id', 'created_at', 'id'),
+        db.Index('ft_chat_messages_content', 'content', mysql_prefix='FULLTEXT', mysql_with_parser='ngram').ddl_if(dialect='mysql'),
+    )
+    
+    @staticmethod
+    def insert_many(conversation_id, messages, session=None):
+        """
+        Add messages to the current transaction as one multi-row INSERT (no commit);
+        session defaults to db.session
+        """
+        if not messages:
+            return
+        now = datetime.utcnow()
+        # 同一时间戳，按自增 id 保持原有顺序；token_count 由列默认值逐行计算
+        (session or db.session).execute(insert(ChatMessage), [
+            {'conversation_id': conversation_id, 'role': message['role'], 'content': message['content'], 'created_at': now}
+            for message in messages
+        ])
+    
     def to_dict(self):
         return {
             'id': self.id,
@@ -77,6 +151,25 @@ class ChatMessage(db.Model):
             'created_at': self.created_at.isoformat()
         } 
 
+class ConversationSummary(db.Model):
+    __tablename__ = 'conversation_summaries'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    conversation_id = db.Column(db.Integer, db.ForeignKey('conversations.id'), nullable=False, unique=True)
+    content = db.Column(db.Text, nullable=False)
+    token_count = db.Column(db.Integer, nullable=False, default=0)
+    last_message_id = db.Column(db.Integer, nullable=False, default=0)  # 已折叠进摘要的最后一条消息
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    def to_dict(self):
+        return {
+            'conversation_id': self.conversation_id,
+            'content': self.content,
+            'token_count': self.token_count,
+            'last_message_id': self.last_message_id,
+            'updated_at': self.updated_at.isoformat() if self.updated_at else None
+        }
+
 class CommunityPost(db.Model):
     __tablename__ = 'community_posts'
     
@@ -87,17 +180,33 @@ class CommunityPost(db.Model):
     is_public = db.Column(db.Boolean, default=True, nullable=False)
     source_type = db.Column(db.String(50), default='original')  # 'original', 'diary', 'system'
     source_id = db.Column(db.Integer, nullable=True)  # conversation_id if source_type is 'diary'
+    author_name = db.Column(db.String(50), nullable=True)  # 冗余的作者名，改名时由 _sync_author_name 同步
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
+    # 公开广场和"我的帖子"两个分页查询各一个索引
+    __table_args__ = (
+        db.Index('ix_community_posts_public_created', 'is_public', 'created_at', 'id'),
+        db.Index('ix_community_posts_user_created', 'user_id', 'created_at', 'id'),
+    )
+    
     # Relationships
     author = db.relationship('UserModel', backref=db.backref('community_posts', lazy=True), lazy=True)
     
+    @staticmethod
+    def list_query(**filters):
+        """
+        Posts matching filters with their authors joined in, so a page renders in one query
+        """
+        return CommunityPost.query.options(joinedload(CommunityPost.author)).filter_by(**filters)
+    
     def to_dict(self):
+        # author_name 为空的旧帖子才回退到 author 关系
+        author_name = self.author_name or (self.author.name if self.author else None)
         return {
             'id': self.id,
             'user_id': self.user_id,
-            'author_name': self.author.name if self.author else 'Anonymous',
+            'author_name': author_name or 'Anonymous',
             'title': self.title,
             'content': self.content,
             'is_public': self.is_public,
@@ -105,4 +214,31 @@ class CommunityPost(db.Model):
             'source_id': self.source_id,
             'created_at': self.created_at.isoformat(),
             'updated_at': self.updated_at.isoformat()
-        }
\ No newline at end of file
+        }
+
+@event.listens_for(CommunityPost, 'before_insert')
+def _fill_author_name(mapper, connection, target):
+    if target.author_name is None and target.user_id is not None:
+        target.author_name = connection.scalar(select(UserModel.name).where(UserModel.id == target.user_id))
+
+@event.listens_for(UserModel, 'after_update')
+def _sync_author_name(mapper, connection, target):
+    # 用户改名时在同一事务里更新其所有帖子上的冗余作者名
+    if inspect(target).attrs.name.history.has_changes():
+        result = connection.execute(
+            CommunityPost.__table__.update()
+            .where(CommunityPost.__table__.c.user_id == target.id)
+            .values(author_name=target.name)
+        )
+        if result.rowcount:
+            # 缓存的广场首页带着旧名字，提交后再失效
+            object_session(target).info['feed_stale'] = True
+
+@event.listens_for(Session, 'after_commit')
+def _invalidate_feed_after_rename(session):
+    if session.info.pop('feed_stale', False):
+        feed_cache.invalidate()
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_feed_stale(session):
+    session.info.pop('feed_stale', None)
@@ -1,22 +1,259 @@
-from flask import Blueprint, request, jsonify, send_file
+from flask import Blueprint, request, jsonify, send_file, current_app, Response, stream_with_context
 from flask_jwt_extended import jwt_required, get_jwt_identity, decode_token
-# from app.blueprints.chat import AIService
 from app.blueprints.asr import ASRService
 from app.blueprints.tts import TTSService
-from app.blueprints.openai import AIService
-from app.extension import db
+from app.blueprints.speech_pipeline import SpeechPipeline
+from app.blueprints.history import conversation_history
+from app.blueprints.write_behind import chat_writer
+from app.blueprints.memory_index import memory_index
+from app.blueprints.pagination import keyset_page, page_size
+from app.blueprints.feed_cache import feed_cache
+from app.blueprints.search import diary_search
+from app.blueprints.context import ContextBuilder
+from app.blueprints.result_cache import ResultCache, normalize_text
+from app.blueprints.provider_router import ProviderRouter
+from app.blueprints.limits import bulkheads, BulkheadFull, overloaded, rate_limited, rate_limiter, too_many_requests
+from app.blueprints.fanout import fan_out
+from app.blueprints.single_flight import SingleFlight, payload_key
+from app.blueprints.model_tiers import choose_tier
+from app.blueprints.tokens import count_tokens, message_tokens
+from app.extension import db, audio_store
 from app.models import UserModel, Conversation, ChatMessage, CommunityPost
+from sqlalchemy import update
 from io import BytesIO
 import requests
 from app.config import Config
 import os
-import tempfile
+import json
+import itertools
+import base64
 from datetime import datetime
 
 bp = Blueprint('main', __name__)
-ai_service = AIService()
+# 按延迟和错误率在 OpenRouter / GLM 之间路由
+ai_service = ProviderRouter.from_config()
 asr_service = ASRService()
 tts_service = TTSService()
+context_builder = ContextBuilder(ai_service)
+regenerate_cache = ResultCache('regenerate', Config.REGENERATE_CACHE_SIZE, Config.REGENERATE_CACHE_TTL)
+# 重复提交/重试的相同请求共享一次上游调用
+regenerate_flight = SingleFlight('regenerate')
+chat_flight = SingleFlight('chat')
+
+def _refresh_summaries(conversation_ids):
+    # 消息落库之后再更新滚动摘要
+    for conversation_id in conversation_ids:
+        context_builder.refresh_summary_async(conversation_id)
+
+chat_writer.add_listener(_refresh_summaries)
+
+def _sse(event, payload):
+    """
+    Format one Server-Sent Events message
+    """
+    return f"event: {event}\ndata: {json.dumps(payload, ensure_ascii=False)}\n\n"
+
+def _sse_response(events):
+    return Response(
+        stream_with_context(events),
+        mimetype='text/event-stream',
+        headers={
+            'Cache-Control': 'no-cache',
+            'X-Accel-Buffering': 'no'  # 禁止 nginx 缓冲，保证逐个 token 下发
+        }
+    )
+
+def _inline_audio(audio_id):
+    """
+    Base64 body of a stored audio artifact, for clients that want it in the same response
+    """
+    path = audio_store.resolve(audio_id)
+    if not path:
+        return None
+    with open(path, 'rb') as f:
+        return base64.b64encode(f.read()).decode('ascii')
+
+def _stream_chat(messages, speech=None, on_complete=None, tier=None, lead_events=(), inline_audio=False):
+    """
+    Relay provider tokens as SSE: delta events, then done (or error).
+    With a SpeechPipeline, audio events for finished sentences are interleaved in order.
+    on_complete receives the assistant message once the reply has fully streamed.
+    The first upstream event is pulled before the response starts, so a full
+    bulkhead or a failing provider is still reported as a plain HTTP error.
+    tier is a (model tier, reason) pair from _chat_tier; lead_events are
+    (event, payload) pairs sent before the reply; inline_audio embeds audio as base64.
+    """
+    upstream = ai_service.chat_stream(messages, *(tier or ()))
+    try:
+        first_event = next(upstream)
+    except Exception:
+        upstream.close()
+        if speech:
+            speech.cancel()
+        raise
+    
+    def audio_event(segment):
+        if inline_audio and segment.get('audio_id'):
+            segment['audio_base64'] = _inline_audio(segment['audio_id'])
+        return _sse('audio', segment)
+    
+    def generate():
+        try:
+            for event, payload in lead_events:
+                yield _sse(event, payload)
+            for event in itertools.chain([first_event], upstream):
+                if event['type'] == 'delta':
+                    yield _sse('delta', {'content': event['content']})
+                    if speech:
+                        speech.feed(event['content'])
+                        for segment in speech.ready():
+                            yield audio_event(segment)
+                    continue
+                
+                if on_complete:
+                    on_complete({'role': event['role'], 'content': event['content']})
+                if speech:
+                    speech.finish()
+                    for segment in speech.drain():
+                        yield audio_event(segment)
+                yield _sse('done', {
+                    'message': {'role': event['role'], 'content': event['content']},
+                    'finish_reason': event['finish_reason'],
+                    'usage': event['usage'],
+                    'model_tier': event.get('tier')
+                })
+        except Exception as e:
+            print(f"Chat stream error: {str(e)}")
+            yield _sse('error', {'error': str(e)})
+        finally:
+            # 客户端断开时 WSGI 服务器会关闭本 generator，这里继续关闭上游流
+            upstream.close()
+            if speech:
+                speech.cancel()
+    
+    return _sse_response(generate())
+
+def _chat_messages(raw):
+    """
+    Validate a client-supplied message list; returns ([{role, content}], error message or None)
+    """
+    if not isinstance(raw, list):
+        return None, 'messages must be a list'
+    messages = []
+    for m in raw:
+        if not isinstance(m, dict) or not isinstance(m.get('role'), str) or not isinstance(m.get('content'), str):
+            return None, 'Each message needs a string role and content'
+        messages.append({'role': m['role'], 'content': m['content']})
+    return messages, None
+
+def _prepare_chat(data, current_user_id):
+    """
+    Resolve the prompt for a chat request.
+    Returns (messages, save_turn, error) where error is (payload, status) or None.
+    """
+    if not isinstance(data, dict):
+        return None, None, ({'error': 'Invalid JSON body'}, 400)
+    # 会话模式：客户端只发送新的一轮，历史由服务端加载
+    conversation_id = data.get('conversation_id')
+    if conversation_id is None:
+        if 'messages' not in data:
+            return None, None, ({'error': 'No messages provided'}, 400)
+        messages, invalid = _chat_messages(data['messages'])
+        if invalid:
+            return None, None, ({'error': invalid}, 400)
+        return messages, None, None
+    
+    owned = db.session.query(Conversation.id).filter_by(id=conversation_id, user_id=current_user_id).first()
+    if not owned:
+        return None, None, ({'error': 'Conversation not found'}, 404)
+    if data.get('message'):
+        if not isinstance(data['message'], str):
+            return None, None, ({'error': 'message must be a string'}, 400)
+        new_messages = [{'role': 'user', 'content': data['message']}]
+    else:
+        new_messages, invalid = _chat_messages(data.get('messages', []))
+        if invalid:
+            return None, None, ({'error': invalid}, 400)
+    if not new_messages:
+        return None, None, ({'error': 'No message provided'}, 400)
+    # 用户其他日记中的相关片段，避免重复提问
+    query = ' '.join(m['content'] for m in new_messages if m['role'] == 'user')
+    memories = memory_index.search(current_user_id, query, exclude=conversation_id)
+    # 按 token 预算截取最近的历史，更早的部分由滚动摘要代替
+    messages = context_builder.build(conversation_id, conversation_history.load(conversation_id), new_messages, memories)
+    
+    def save_turn(reply):
+        # 保存失败不影响本次回复
+        try:
+            conversation_history.append(conversation_id, new_messages + [reply])
+            if not chat_writer.enabled:
+                context_builder.refresh_summary_async(conversation_id)
+        except Exception as e:
+            print(f"Failed to persist chat turn: {str(e)}")
+    
+    return messages, save_turn, None
+
+def _transcribe_audio(audio_data):
+    """
+    Run ASR on an uploaded audio body and return the cleaned transcript
+    """
+    from funasr.utils.postprocess_utils import rich_transcription_postprocess
+    # 模型推理占用 CPU/GPU，限制并发
+    with bulkheads['asr'].slot():
+        res = asr_service.model.generate(
+            input=BytesIO(audio_data),
+            cache={},
+            language="auto",
+            use_itn=True,
+            batch_size_s=60,
+            merge_vad=True,
+            merge_length_s=15,
+        )
+    return rich_transcription_postprocess(res[0]["text"]).strip()
+
+def _chat_tier(data, messages):
+    """
+    (model tier, reason) for a chat request, judged by the latest user message and prompt size
+    """
+    last_user = next((m['content'] for m in reversed(messages) if m['role'] == 'user'), '')
+    context_tokens = sum(message_tokens(m) for m in messages)
+    return choose_tier('chat', last_user, context_tokens, data.get('tier'))
+
+def _regenerate_tier(current_content, new_content, requested=None):
+    return choose_tier('regenerate', new_content, count_tokens(current_content), requested)
+
+def _chat_flight_key(current_user_id, data, messages, tier):
+    """
+    Canonical payload for coalescing identical non-streaming chat requests
+    """
+    return payload_key(current_user_id, data.get('conversation_id'), messages, tier)
+
+def _regenerate_cache_key(current_content, new_content, tier):
+    return regenerate_cache.make_key(
+        normalize_text(current_content),
+        normalize_text(new_content),
+        ai_service.model_signature(tier),
+        ai_service.regenerate_prompt_version
+    )
+
+def _regenerate_cached(current_content, new_content, force=False, requested_tier=None):
+    """
+    Regenerate text through the result cache.
+    Returns (text, cache tier or None, model tier).
+    """
+    tier, reason = _regenerate_tier(current_content, new_content, requested_tier)
+    key = _regenerate_cache_key(current_content, new_content, tier)
+    if not force:
+        cached, cache_tier = regenerate_cache.get(key)
+        if cached is not None:
+            return cached, cache_tier, tier
+    
+    regenerated_text, shared = regenerate_flight.do(
+        key, lambda: ai_service.regenerate_text(current_content, new_content, tier, reason)
+    )
+    if not shared:
+        regenerate_cache.set(key, regenerated_text)
+    return regenerated_text, None, tier
 
 # Protected routes
 @bp.route('/conversations', methods=['POST'])
@@ -37,19 +274,12 @@ def create_conversation():
         )
         
         db.session.add(conversation)
+        # flush 拿到 id 后一次性批量插入消息，整体一个事务：失败时不会留下没有消息的半截会话
+        db.session.flush()
+        ChatMessage.insert_many(conversation.id, data.get('messages'))
         db.session.commit()
         
-        # Add initial messages if provided
-        if 'messages' in data:
-            for msg in data['messages']:
-                message = ChatMessage(
-                    conversation_id=conversation.id,
-                    role=msg['role'],
-                    content=msg['content']
-                )
-                db.session.add(message)
-            db.session.commit()
-        
+        memory_index.upsert(current_user_id, conversation)
         return jsonify(conversation.to_dict()), 201
     except Exception as e:
         db.session.rollback()
@@ -59,11 +289,20 @@ def create_conversation():
 @jwt_required()
 def get_conversations():
     """
-    Get all conversations for current user
+    Get the current user's conversations, newest first (?limit=&cursor=)
     """
     current_user_id = get_jwt_identity()
-    conversations = Conversation.query.filter_by(user_id=current_user_id).order_by(Conversation.created_at.desc()).all()
-    return jsonify([conv.to_dict() for conv in conversations])
+    try:
+        rows, next_cursor = keyset_page(
+            Conversation.list_query(current_user_id), Conversation,
+            request.args.get('cursor'), request.args.get('limit'), key=lambda row: row[0]
+        )
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify({
+        'conversations': [conv.to_list_dict(count, last_at) for conv, count, last_at in rows],
+        'next_cursor': next_cursor
+    })
 
 @bp.route('/conversations/<int:conversation_id>', methods=['GET'])
 @jwt_required()
@@ -72,7 +311,7 @@ def get_conversation(conversation_id):
     Get a specific conversation
     """
     current_user_id = get_jwt_identity()
-    conversation = Conversation.query.filter_by(id=conversation_id, user_id=current_user_id).first_or_404()
+    conversation = Conversation.detail_query(conversation_id, current_user_id).first_or_404()
     return jsonify(conversation.to_dict())
 
 @bp.route('/conversations/<int:conversation_id>', methods=['PUT'])
@@ -95,6 +334,8 @@ def update_conversation(conversation_id):
             conversation.date = data['date']
         
         db.session.commit()
+        if {'title', 'content', 'date'} & set(data):
+            memory_index.upsert(current_user_id, conversation)
         return jsonify(conversation.to_dict())
     except Exception as e:
         db.session.rollback()
@@ -112,22 +353,115 @@ def delete_conversation(conversation_id):
     try:
         db.session.delete(conversation)
         db.session.commit()
+        conversation_history.invalidate(conversation_id)
+        memory_index.remove(current_user_id, conversation_id)
         return jsonify({'message': 'Conversation deleted successfully'})
     except Exception as e:
         db.session.rollback()
         return jsonify({'message': 'Server error'}), 500
 
+@bp.route('/conversations/<int:conversation_id>/messages', methods=['POST'])
+@jwt_required()
+def append_messages(conversation_id):
+    """
+    Append messages to a conversation ({messages: [{role, content}]} or a single {role, content}).
+    Returns only the new rows.
+    """
+    current_user_id = get_jwt_identity()
+    data = request.get_json() or {}
+    items = data['messages'] if 'messages' in data else [data]
+    if not isinstance(items, list) or not items or not all(
+        isinstance(item, dict) and item.get('role') in ('system', 'user', 'assistant')
+        and isinstance(item.get('content'), str) and item['content']
+        for item in items
+    ):
+        return jsonify({'error': 'messages must be a non-empty list of {role, content}'}), 400
+    
+    # 归属校验只查 id，不加载会话正文和已有消息
+    owned = db.session.query(Conversation.id).filter_by(id=conversation_id, user_id=current_user_id).first()
+    if not owned:
+        return jsonify({'error': 'Conversation not found'}), 404
+    
+    try:
+        rows = [ChatMessage(conversation_id=conversation_id, role=item['role'], content=item['content']) for item in items]
+        db.session.add_all(rows)
+        db.session.execute(
+            update(Conversation)
+            .where(Conversation.id == conversation_id)
+            .values(updated_at=datetime.utcnow())
+        )
+        db.session.flush()
+        # commit 后对象会过期，先序列化，避免逐行重新查询
+        created = [row.to_dict() for row in rows]
+        cached = [{'id': row.id, 'role': row.role, 'content': row.content, 'token_count': row.token_count} for row in rows]
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'message': 'Server error'}), 500
+    
+    conversation_history.extend(conversation_id, cached)
+    return jsonify({'messages': created}), 201
+
+@bp.route('/search', methods=['GET'])
+@jwt_required()
+def search():
+    """
+    Ranked full-text search over the current user's diaries and chat messages (?q=&limit=&offset=)
+    """
+    query = (request.args.get('q') or '').strip()
+    if not query:
+        return jsonify({'error': 'q is required'}), 400
+    try:
+        offset = max(0, int(request.args.get('offset') or 0))
+    except ValueError:
+        return jsonify({'error': 'offset must be an integer'}), 400
+    
+    try:
+        results, next_offset = diary_search.search(
+            get_jwt_identity(), query, page_size(request.args.get('limit')), offset
+        )
+    except Exception as e:
+        print(f"Search error: {str(e)}")
+        return jsonify({'message': 'Server error'}), 500
+    return jsonify({'query': query, 'results': results, 'next_offset': next_offset})
+
 @bp.route('/chat', methods=['POST'])
 @jwt_required()
+@rate_limited('chat')
 def chat():
     """
     Chat with AI and optionally return audio response
     """
     current_user_id = get_jwt_identity()
-    data = request.get_json()
+    data = request.get_json(silent=True)
+    
+    messages, save_turn, error = _prepare_chat(data, current_user_id)
+    if error:
+        return jsonify(error[0]), error[1]
+    conversation_id = data.get('conversation_id')
     
     try:
-        response = ai_service.chat(data['messages'])
+        if data.get('stream', False):
+            speech = None
+            if data.get('voice_response', False):
+                # 流水线模式：每完成一句就开始合成语音
+                audio_format = tts_service.negotiate_format(request.accept_mimetypes, data.get('audio_format'))
+                speech = SpeechPipeline(tts_service, audio_format, data.get('voice'))
+            return _stream_chat(messages, speech, save_turn, _chat_tier(data, messages))
+        
+        tier, reason = _chat_tier(data, messages)
+        response, shared = chat_flight.do(
+            _chat_flight_key(current_user_id, data, messages, tier),
+            lambda: ai_service.chat(messages, tier, reason)
+        )
+        if shared:
+            response['coalesced'] = True
+        
+        if save_turn:
+            # 合并的重复请求不再重复保存同一轮对话
+            if not shared:
+                save_turn(response['choices'][0]['message'])
+            response['conversation_id'] = conversation_id
         
         # 检查是否需要语音回复
         if data.get('voice_response', False):
@@ -135,11 +469,15 @@ def chat():
                 ai_message_content = response['choices'][0]['message']['content']
                 print(f"Generating TTS for: {ai_message_content[:50]}...")  # 调试日志
                 
-                audio_path = tts_service.text_to_speech_sync(ai_message_content)
-                print(f"Generated audio file: {audio_path}")  # 调试日志
+                audio_format = tts_service.negotiate_format(request.accept_mimetypes, data.get('audio_format'))
+                audio_id = tts_service.text_to_speech_sync(ai_message_content, audio_format=audio_format)
+                print(f"Generated audio: {audio_id} ({audio_format})")  # 调试日志
                 
-                # 将音频文件路径添加到响应中 (传递完整路径)
-                response['audio_path'] = audio_path
+                # 只返回不透明的音频ID，audio_path 保留用于兼容旧客户端
+                response['audio_id'] = audio_id
+                response['audio_path'] = audio_id
+                response['audio_url'] = f"/api/audio/{audio_id}"
+                response['audio_format'] = audio_format
                 response['has_audio'] = True
                 print("TTS generation successful")  # 调试日志
             except Exception as tts_error:
@@ -148,11 +486,24 @@ def chat():
                 response['tts_error'] = str(tts_error)
         
         return jsonify(response)
+    except BulkheadFull as e:
+        return overloaded(e)
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@bp.route('/llm/providers', methods=['GET'])
+@jwt_required()
+def get_llm_providers():
+    """
+    Report provider routing order, rolling latency/error stats and bulkhead usage
+    """
+    snapshot = ai_service.snapshot()
+    snapshot['bulkheads'] = {name: bulkhead.snapshot() for name, bulkhead in bulkheads.items()}
+    return jsonify(snapshot)
+
 @bp.route('/transcribe', methods=['POST'])
 @jwt_required()
+@rate_limited('transcribe')
 def transcribe():
     """
     Transcribe audio to text
@@ -162,25 +513,98 @@ def transcribe():
     
     audio_file = request.files['audio']
     try:
-        # Convert the audio file to a format that ASRService can process
-        audio_data = audio_file.read()
-        audio_buffer = BytesIO(audio_data)
+        # Use the ASR model to transcribe the uploaded bytes directly
+        return jsonify({'text': _transcribe_audio(audio_file.read())})
+    except BulkheadFull as e:
+        return overloaded(e)
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@bp.route('/voice-turn', methods=['POST'])
+@jwt_required()
+@rate_limited('voice_turn')
+def voice_turn():
+    """
+    One voice turn in one request: transcribe the audio, chat, synthesize the reply.
+    multipart form: audio, plus conversation_id or messages (JSON), stream,
+    audio_format, voice, tier, inline_audio.
+    """
+    if 'audio' not in request.files:
+        return jsonify({'error': 'No audio file provided'}), 400
+    current_user_id = get_jwt_identity()
+    form = request.form
+    stream = form.get('stream', 'false').lower() == 'true'
+    inline_audio = form.get('inline_audio', 'false').lower() == 'true'
+
+    # 表单字段在识别之前校验，错误请求不浪费一次 ASR
+    data = {'tier': form.get('tier')}
+    if form.get('conversation_id'):
+        try:
+            data['conversation_id'] = int(form['conversation_id'])
+        except ValueError:
+            return jsonify({'error': 'conversation_id must be an integer'}), 400
+    else:
+        try:
+            raw_messages = json.loads(form.get('messages') or '[]')
+        except ValueError:
+            return jsonify({'error': 'messages must be a JSON list'}), 400
+        history, invalid = _chat_messages(raw_messages)
+        if invalid:
+            return jsonify({'error': invalid}), 400
+
+    try:
+        transcript = _transcribe_audio(request.files['audio'].read())
+        if not transcript:
+            return jsonify({'error': 'No speech detected', 'transcript': ''}), 422
         
-        # Use the ASR model to transcribe
-        res = asr_service.model.generate(
-            input=audio_buffer,
-            cache={},
-            language="auto",
-            use_itn=True,
-            batch_size_s=60,
-            merge_vad=True,
-            merge_length_s=15,
-        )
+        if 'conversation_id' in data:
+            data['message'] = transcript
+        else:
+            data['messages'] = history + [{'role': 'user', 'content': transcript}]
+        messages, save_turn, error = _prepare_chat(data, current_user_id)
+        if error:
+            return jsonify(error[0]), error[1]
+        
+        audio_format = tts_service.negotiate_format(request.accept_mimetypes, form.get('audio_format'))
+        if stream:
+            # 先发送识别结果，再逐句下发回复文本和语音
+            speech = SpeechPipeline(tts_service, audio_format, form.get('voice'))
+            return _stream_chat(
+                messages, speech, save_turn, _chat_tier(data, messages),
+                lead_events=[('transcript', {'text': transcript})],
+                inline_audio=inline_audio
+            )
         
-        # Process result
-        from funasr.utils.postprocess_utils import rich_transcription_postprocess
-        text = rich_transcription_postprocess(res[0]["text"])
-        return jsonify({'text': text.strip()})
+        tier, reason = _chat_tier(data, messages)
+        response = ai_service.chat(messages, tier, reason)
+        reply = response['choices'][0]['message']
+        if save_turn:
+            save_turn(reply)
+        
+        result = {
+            'transcript': transcript,
+            'message': reply,
+            'conversation_id': data.get('conversation_id'),
+            'model_tier': tier,
+            'has_audio': False
+        }
+        try:
+            audio_id = tts_service.text_to_speech_sync(reply['content'], form.get('voice'), audio_format)
+            result.update({
+                'audio_id': audio_id,
+                'audio_url': f"/api/audio/{audio_id}",
+                'audio_format': audio_format,
+                'has_audio': True
+            })
+            if inline_audio:
+                result['audio_base64'] = _inline_audio(audio_id)
+        except Exception as tts_error:
+            # 语音合成失败时仍返回文字回复
+            print(f"TTS Error: {tts_error}")
+            result['tts_error'] = str(tts_error)
+        return jsonify(result)
+    except BulkheadFull as e:
+        return overloaded(e)
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -210,6 +634,7 @@ def stop_asr():
 
 @bp.route('/regenerate-text', methods=['POST'])
 @jwt_required()
+@rate_limited('regenerate')
 def regenerate_text():
     """
     Regenerate text using AI
@@ -222,15 +647,96 @@ def regenerate_text():
         current_content = data.get('currentContent', '')
         new_content = data['text']
         
-        regenerated_text = ai_service.regenerate_text(current_content, new_content)
-        return jsonify({'regenerated_text': regenerated_text})
+        regenerated_text, cache_tier, model_tier = _regenerate_cached(
+            current_content, new_content, data.get('force', False), data.get('tier')
+        )
+        return jsonify({
+            'regenerated_text': regenerated_text,
+            'cached': cache_tier is not None,
+            'cache_tier': cache_tier,
+            'model_tier': model_tier
+        })
+    except BulkheadFull as e:
+        return overloaded(e)
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
-@bp.route('/audio/<path:filename>', methods=['GET'])
-def get_audio(filename):
+@bp.route('/regenerate-text/batch', methods=['POST'])
+@jwt_required()
+def regenerate_text_batch():
     """
-    Serve audio files with token authentication
+    Regenerate several paragraphs concurrently.
+    Returns results in request order, or streams them as SSE when stream=true.
+    """
+    data = request.get_json()
+    items = (data or {}).get('items')
+    if not isinstance(items, list) or not items:
+        return jsonify({'error': 'No items provided'}), 400
+    if len(items) > Config.REGENERATE_BATCH_MAX_ITEMS:
+        return jsonify({'error': f'Too many items (max {Config.REGENERATE_BATCH_MAX_ITEMS})'}), 400
+    if not all(isinstance(item, dict) and 'text' in item for item in items):
+        return jsonify({'error': 'Every item needs a text field'}), 400
+    
+    # 每个段落按一次调用计入限流
+    allowed, retry_after = rate_limiter.check('regenerate', get_jwt_identity(), cost=len(items))
+    if not allowed:
+        return too_many_requests(retry_after)
+    
+    force = data.get('force', False)
+    # 与 page_size 相同：无法解析时用默认值，并限制在 [1, 上限] 之间
+    try:
+        concurrency = int(data.get('concurrency') or Config.REGENERATE_BATCH_CONCURRENCY)
+    except (TypeError, ValueError):
+        concurrency = Config.REGENERATE_BATCH_CONCURRENCY
+    concurrency = max(1, min(concurrency, Config.REGENERATE_BATCH_CONCURRENCY))
+    
+    def regenerate_item(item):
+        return _regenerate_cached(item.get('currentContent', ''), item['text'], force, item.get('tier') or data.get('tier'))
+    
+    def item_result(index, result, error):
+        if error:
+            payload = {'index': index, 'error': str(error)}
+            if isinstance(error, BulkheadFull):
+                payload['retry_after'] = error.retry_after
+            return payload
+        regenerated_text, cache_tier, model_tier = result
+        return {
+            'index': index,
+            'regenerated_text': regenerated_text,
+            'cached': cache_tier is not None,
+            'cache_tier': cache_tier,
+            'model_tier': model_tier
+        }
+    
+    if data.get('stream', False):
+        def generate():
+            failed = 0
+            for index, result, error in fan_out(regenerate_item, items, concurrency):
+                failed += 1 if error else 0
+                yield _sse('item', item_result(index, result, error))
+            yield _sse('done', {'count': len(items), 'failed': failed})
+        return _sse_response(generate())
+    
+    results = [None] * len(items)
+    for index, result, error in fan_out(regenerate_item, items, concurrency):
+        results[index] = item_result(index, result, error)
+    return jsonify({
+        'results': results,
+        'failed': sum(1 for result in results if 'error' in result)
+    })
+
+@bp.route('/regenerate-text/cache-stats', methods=['GET'])
+@jwt_required()
+def regenerate_cache_stats():
+    """
+    Report regenerate-text cache hit ratios
+    """
+    return jsonify(regenerate_cache.stats())
+
+@bp.route('/audio/<audio_id>', methods=['GET'])
+def get_audio(audio_id):
+    """
+    Serve audio files by opaque id with token authentication
     """
     try:
         # 支持两种认证方式：Header中的Authorization或查询参数中的token
@@ -253,35 +759,29 @@ def get_audio(filename):
             # 手动验证token
             decoded_token = decode_token(token)
             current_user_id = decoded_token['sub']
-            print(f"Audio request authenticated for user: {current_user_id}")
         except Exception as jwt_error:
             print(f"JWT verification failed: {jwt_error}")
             return jsonify({'error': 'Invalid token'}), 401
         
-        print(f"Audio request for: {filename}")  # 调试日志
-        
-        # 处理Windows路径分隔符
-        if filename.startswith('C:\\'):
-            audio_path = filename
-        else:
-            # 如果不是完整路径，假设是临时文件名
-            audio_path = filename
-        
-        print(f"Resolved audio path: {audio_path}")  # 调试日志
-        
-        if not os.path.exists(audio_path):
-            print(f"Audio file not found: {audio_path}")  # 调试日志
+        # 只接受存储中的不透明ID，不再接受任意文件系统路径
+        audio_path = audio_store.resolve(audio_id)
+        if not audio_path:
             return jsonify({'error': 'File not found'}), 404
         
-        print(f"Serving audio file: {audio_path}")  # 调试日志
-        
-        # 返回音频文件
-        return send_file(
+        # conditional=True 支持 Range / ETag / Last-Modified，文件内容按ID不可变
+        response = send_file(
             audio_path,
-            mimetype='audio/mpeg',
+            mimetype=audio_store.mimetype_for(audio_path),
             as_attachment=False,
-            download_name=f'tts_audio_{os.path.basename(audio_path)}'
+            download_name=f'tts_audio_{os.path.basename(audio_path)}',
+            conditional=True,
+            etag=True,
+            max_age=current_app.config['AUDIO_CACHE_MAX_AGE']
         )
+        # 需要认证的资源，只允许浏览器私有缓存
+        response.cache_control.public = False
+        response.cache_control.private = True
+        return response
     except Exception as e:
         print(f"Error serving audio: {str(e)}")  # 调试日志
         return jsonify({'error': str(e)}), 500
@@ -294,23 +794,37 @@ def get_tts_voices():
     """
     try:
         voices = TTSService.get_available_voices()
-        return jsonify({'voices': voices})
+        return jsonify({'voices': voices, 'formats': tts_service.supported_formats()})
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 # Community API endpoints
+def _community_feed(cursor, limit):
+    posts, next_cursor = keyset_page(CommunityPost.list_query(is_public=True), CommunityPost, cursor, limit)
+    return {
+        'success': True,
+        'posts': [post.to_dict() for post in posts],
+        'next_cursor': next_cursor
+    }
+
 @bp.route('/community/posts', methods=['GET'])
 @jwt_required()
 def get_community_posts():
     """
-    Get all public community posts
+    Get public community posts, newest first (?limit=&cursor=)
     """
+    cursor = request.args.get('cursor')
     try:
-        posts = CommunityPost.query.filter_by(is_public=True).order_by(CommunityPost.created_at.desc()).all()
-        return jsonify({
-            'success': True,
-            'posts': [post.to_dict() for post in posts]
-        })
+        if cursor or not Config.COMMUNITY_FEED_CACHE_ENABLED:
+            return jsonify(_community_feed(cursor, request.args.get('limit')))
+        # 首页对所有用户都一样，直接返回缓存好的 JSON
+        limit = page_size(request.args.get('limit'))
+        body, outcome = feed_cache.first_page(limit, lambda: current_app.json.dumps(_community_feed(None, limit)))
+        response = current_app.response_class(body, mimetype='application/json')
+        response.headers['X-Cache'] = outcome
+        return response
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -318,15 +832,21 @@ def get_community_posts():
 @jwt_required()
 def get_my_posts():
     """
-    Get current user's community posts
+    Get current user's community posts, newest first (?limit=&cursor=)
     """
     current_user_id = get_jwt_identity()
     try:
-        posts = CommunityPost.query.filter_by(user_id=current_user_id).order_by(CommunityPost.created_at.desc()).all()
+        posts, next_cursor = keyset_page(
+            CommunityPost.list_query(user_id=current_user_id), CommunityPost,
+            request.args.get('cursor'), request.args.get('limit')
+        )
         return jsonify({
             'success': True,
-            'posts': [post.to_dict() for post in posts]
+            'posts': [post.to_dict() for post in posts],
+            'next_cursor': next_cursor
         })
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -354,6 +874,8 @@ def create_community_post():
         
         db.session.add(post)
         db.session.commit()
+        if post.is_public:
+            feed_cache.invalidate()
         
         return jsonify({
             'success': True,
@@ -376,8 +898,11 @@ def delete_community_post(post_id):
         if not post:
             return jsonify({'error': 'Post not found or unauthorized'}), 404
         
+        was_public = post.is_public
         db.session.delete(post)
         db.session.commit()
+        if was_public:
+            feed_cache.invalidate()
         
         return jsonify({'success': True})
     except Exception as e:
@@ -0,0 +1,46 @@
+"""chat_messages.token_count and conversation_summaries
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-19 10:05:00
+
+create_all() adds new tables but never new columns, so a database it created
+may already have conversation_summaries while still missing token_count.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0002'
+down_revision = '0001'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    inspector = sa.inspect(op.get_bind())
+
+    columns = {column['name'] for column in inspector.get_columns('chat_messages')}
+    if 'token_count' not in columns:
+        # 旧消息留空，构建上下文时按需计算
+        op.add_column('chat_messages', sa.Column('token_count', sa.Integer(), nullable=True))
+
+    if 'conversation_summaries' not in inspector.get_table_names():
+        op.create_table(
+            'conversation_summaries',
+            sa.Column('id', sa.Integer(), nullable=False),
+            sa.Column('conversation_id', sa.Integer(), nullable=False),
+            sa.Column('content', sa.Text(), nullable=False),
+            sa.Column('token_count', sa.Integer(), nullable=False),
+            sa.Column('last_message_id', sa.Integer(), nullable=False),
+            sa.Column('updated_at', sa.DateTime(), nullable=True),
+            sa.ForeignKeyConstraint(['conversation_id'], ['conversations.id']),
+            sa.PrimaryKeyConstraint('id'),
+            sa.UniqueConstraint('conversation_id')
+        )
+
+
+def downgrade():
+    op.drop_table('conversation_summaries')
+    op.drop_column('chat_messages', 'token_count')
@@ -0,0 +1,52 @@
+"""composite indexes for the paginated hot queries
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-19 10:10:00
+
+Each index leads with the equality column and continues with the keyset sort
+key (created_at, id), so the newest-first pages are a backward index range
+scan with no filesort. `flask explain-check` fails if a plan stops using them.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0003'
+down_revision = '0002'
+branch_labels = None
+depends_on = None
+
+INDEXES = [
+    # GET /api/conversations
+    ('ix_conversations_user_created', 'conversations', ['user_id', 'created_at', 'id']),
+    # 历史加载、会话列表的消息数/最后消息时间子查询
+    ('ix_chat_messages_conversation_created', 'chat_messages', ['conversation_id', 'created_at', 'id']),
+    # GET /api/community/posts
+    ('ix_community_posts_public_created', 'community_posts', ['is_public', 'created_at', 'id']),
+    # GET /api/community/my-posts
+    ('ix_community_posts_user_created', 'community_posts', ['user_id', 'created_at', 'id']),
+]
+
+# MySQL 会丢掉外键列上自动建的索引，改用以该列开头的复合索引支撑外键
+FOREIGN_KEY_COLUMNS = [
+    ('conversations', 'user_id'),
+    ('chat_messages', 'conversation_id'),
+    ('community_posts', 'user_id'),
+]
+
+
+def upgrade():
+    inspector = sa.inspect(op.get_bind())
+    for name, table, columns in INDEXES:
+        if name not in {index['name'] for index in inspector.get_indexes(table)}:
+            op.create_index(name, table, columns)
+
+
+def downgrade():
+    # 先给外键列补回单列索引，否则 MySQL 拒绝删除复合索引
+    for table, column in FOREIGN_KEY_COLUMNS:
+        op.create_index(f'ix_{table}_{column}', table, [column])
+    for name, table, _ in reversed(INDEXES):
+        op.drop_index(name, table_name=table)
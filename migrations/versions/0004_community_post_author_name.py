@@ -0,0 +1,33 @@
+"""community_posts.author_name
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2026-10-19 11:00:00
+
+Denormalized author name so the feed does not need users at all; backfilled
+from users here and kept in sync by the UserModel after_update listener.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0004'
+down_revision = '0003'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    columns = {column['name'] for column in sa.inspect(op.get_bind()).get_columns('community_posts')}
+    if 'author_name' not in columns:
+        op.add_column('community_posts', sa.Column('author_name', sa.String(length=50), nullable=True))
+    op.execute(
+        'UPDATE community_posts SET author_name = '
+        '(SELECT users.name FROM users WHERE users.id = community_posts.user_id) '
+        'WHERE author_name IS NULL'
+    )
+
+
+def downgrade():
+    op.drop_column('community_posts', 'author_name')
@@ -0,0 +1,74 @@
+"""full-text indexes for diary and message search
+
+Revision ID: 0005
+Revises: 0004
+Create Date: 2026-10-19 12:00:00
+
+MySQL: FULLTEXT indexes with the ngram parser (CJK text has no spaces to split on).
+SQLite: external-content FTS5 tables with the trigram tokenizer, kept in sync by
+triggers. Other databases get nothing and search falls back to LIKE.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0005'
+down_revision = '0004'
+branch_labels = None
+depends_on = None
+
+MYSQL_INDEXES = [
+    ('ft_conversations_title_content', 'conversations', 'title, content'),
+    ('ft_chat_messages_content', 'chat_messages', 'content'),
+]
+
+# (FTS 表, 源表, 列)
+SQLITE_FTS = [
+    ('conversations_fts', 'conversations', ['title', 'content']),
+    ('chat_messages_fts', 'chat_messages', ['content']),
+]
+
+
+def _sqlite_fts_statements(fts, table, columns):
+    column_list = ', '.join(columns)
+    new_values = ', '.join(f'new.{column}' for column in columns)
+    old_values = ', '.join(f'old.{column}' for column in columns)
+    delete = f"INSERT INTO {fts}({fts}, rowid, {column_list}) VALUES ('delete', old.id, {old_values});"
+    insert = f"INSERT INTO {fts}(rowid, {column_list}) VALUES (new.id, {new_values});"
+    return [
+        f"CREATE VIRTUAL TABLE {fts} USING fts5({column_list}, content='{table}', content_rowid='id', tokenize='trigram')",
+        f"CREATE TRIGGER {fts}_ai AFTER INSERT ON {table} BEGIN {insert} END",
+        f"CREATE TRIGGER {fts}_ad AFTER DELETE ON {table} BEGIN {delete} END",
+        # 只在索引列变化时重建 FTS 行，updated_at 之类的更新不触发
+        f"CREATE TRIGGER {fts}_au AFTER UPDATE OF {column_list} ON {table} BEGIN {delete} {insert} END",
+        # 已有数据一次性建索引
+        f"INSERT INTO {fts}({fts}) VALUES ('rebuild')",
+    ]
+
+
+def upgrade():
+    bind = op.get_bind()
+    inspector = sa.inspect(bind)
+    if bind.dialect.name == 'mysql':
+        for name, table, columns in MYSQL_INDEXES:
+            if name not in {index['name'] for index in inspector.get_indexes(table)}:
+                op.execute(f"CREATE FULLTEXT INDEX {name} ON {table} ({columns}) WITH PARSER ngram")
+    elif bind.dialect.name == 'sqlite':
+        existing = set(inspector.get_table_names())
+        for fts, table, columns in SQLITE_FTS:
+            if fts not in existing:
+                for statement in _sqlite_fts_statements(fts, table, columns):
+                    op.execute(statement)
+
+
+def downgrade():
+    bind = op.get_bind()
+    if bind.dialect.name == 'mysql':
+        for name, table, _ in MYSQL_INDEXES:
+            op.drop_index(name, table_name=table)
+    elif bind.dialect.name == 'sqlite':
+        for fts, _, _ in SQLITE_FTS:
+            for suffix in ('ai', 'ad', 'au'):
+                op.execute(f"DROP TRIGGER IF EXISTS {fts}_{suffix}")
+            op.execute(f"DROP TABLE IF EXISTS {fts}")
@@ -0,0 +1,101 @@
+"""
+ASGI gateway against a stubbed LLM provider: concurrency and auth (the assertions behind flask bench-gateway)
+"""
+import asyncio
+import time
+import httpx
+import pytest
+from flask_jwt_extended import create_access_token
+from app.asgi import create_asgi_app
+from app.blueprints import async_ai
+from app.blueprints.async_ai import AsyncProviderRouter
+from app.blueprints.provider_router import ProviderRouter
+from app.config import Config
+from app.extension import db
+from app.models import UserModel
+
+STREAM_DELAY = 0.5
+CONCURRENT_STREAMS = 10
+
+class StubProvider:
+    """
+    Sync side of the stub; the async router only reads its model config
+    """
+    REGENERATE_PROMPT_VERSION = 1
+
+    @staticmethod
+    def model_for(tier):
+        return f'stub-{tier}'
+
+class AsyncStubProvider:
+    """
+    Streams one delta, then finishes after STREAM_DELAY without blocking the loop
+    """
+    async def chat_stream(self, messages, model=None):
+        yield {'type': 'delta', 'content': 'ok'}
+        await asyncio.sleep(STREAM_DELAY)
+        yield {'type': 'done', 'role': 'assistant', 'content': 'ok', 'finish_reason': 'stop', 'usage': None}
+
+@pytest.fixture(scope='module')
+def token(app):
+    db.create_all()
+    user = UserModel(name='gateway', email='gateway@example.com', password_hash='-')
+    db.session.add(user)
+    db.session.commit()
+    yield create_access_token(identity=str(user.id))
+    db.session.remove()
+    db.drop_all()
+
+@pytest.fixture
+def gateway(app, monkeypatch):
+    # 限流依赖 Redis，这里只测网关本身
+    monkeypatch.setattr(Config, 'RATE_LIMIT_ENABLED', False)
+    monkeypatch.setitem(async_ai.ASYNC_PROVIDERS, 'stub', AsyncStubProvider)
+    gateway = create_asgi_app(app)
+    gateway.ai = AsyncProviderRouter(ProviderRouter({'stub': StubProvider()}, hedge=False))
+    return gateway
+
+def _client(gateway):
+    return httpx.AsyncClient(transport=httpx.ASGITransport(app=gateway), base_url='http://gateway')
+
+def test_concurrent_streams_do_not_block_each_other(gateway, token):
+    async def stream(client):
+        response = await client.post(
+            '/api/chat',
+            json={'messages': [{'role': 'user', 'content': 'hi'}], 'stream': True},
+            headers={'Authorization': f'Bearer {token}'}
+        )
+        return response
+
+    async def run():
+        async with _client(gateway) as client:
+            started = time.perf_counter()
+            responses = await asyncio.gather(*[stream(client) for _ in range(CONCURRENT_STREAMS)])
+            return responses, time.perf_counter() - started
+
+    responses, elapsed = asyncio.run(run())
+    assert all(response.status_code == 200 for response in responses)
+    assert all('event: done' in response.text for response in responses)
+    # 串行需要 CONCURRENT_STREAMS * STREAM_DELAY；并发时应接近一次的时长
+    assert elapsed < STREAM_DELAY * 3, f"{CONCURRENT_STREAMS} streams took {elapsed:.2f}s"
+
+@pytest.mark.parametrize('path, body', [
+    ('/api/chat', {'messages': [{'role': 'user', 'content': 'hi'}]}),
+    ('/api/regenerate-text', {'text': 'hi'}),
+])
+def test_missing_token_is_rejected(gateway, path, body):
+    async def run():
+        async with _client(gateway) as client:
+            return await client.post(path, json=body)
+
+    response = asyncio.run(run())
+    assert response.status_code == 401
+    assert response.json()['msg'] == 'Missing authorization header'
+
+def test_invalid_token_is_rejected(gateway):
+    async def run():
+        async with _client(gateway) as client:
+            return await client.post('/api/chat', json={'messages': []}, headers={'Authorization': 'Bearer not-a-jwt'})
+
+    response = asyncio.run(run())
+    assert response.status_code == 401
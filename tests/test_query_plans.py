@@ -0,0 +1,25 @@
+"""
+Query plan and query-count budgets for the hot read paths (same checks as flask explain-check)
+"""
+import pytest
+from app.blueprints.query_checks import scratch_database, seed, plan_problems, render_counts
+
+@pytest.fixture(scope='module')
+def seeded(app):
+    # 迁移到 head 的内存 SQLite，索引与线上一致
+    with scratch_database('sqlite://') as connection:
+        seed(connection)
+        yield connection
+
+def test_hot_queries_use_indexes(seeded):
+    failures = {name: problems for name, plan, problems in plan_problems(seeded) if problems}
+    assert not failures, f"full scan or filesort: {failures}"
+
+def test_pages_render_within_query_budget(seeded):
+    over = {name: f"{count} queries (max {budget})" for name, count, rows, budget in render_counts(seeded) if count > budget}
+    assert not over, f"per-row queries while rendering: {over}"
+
+def test_pages_render_rows(seeded):
+    # 预算只有在真的渲染了数据时才有意义
+    for name, count, rows, budget in render_counts(seeded):
+        assert rows > 0, name